@@ -7,45 +7,1341 @@ provided in the top-level COPYRIGHT file.
 Authors: Ethan Coon (ecoon@lanl.gov)
 
 Takes a ats_input_spec parameter instance and generates the corresponding xml.
+
+Two backends are available: "native", which needs only the standard
+library, and "amanzi_xml", which builds amanzi_xml objects and needs
+that package.  Both write the same files.
 """
 
+import io
+import collections
+import pickle
+import os
+import copy
+import hashlib
+import itertools
+import tarfile
+import zipfile
 import warnings
+import concurrent.futures
+import functools
+import xml.etree.ElementTree
+import xml.sax.saxutils
+import numpy as np
 import ats_input_spec.primitives
-import amanzi_xml.common.parameter
-import amanzi_xml.common.parameter_list
-import amanzi_xml.utils.parser
-import amanzi_xml.utils.io
+import ats_input_spec.specs
+import ats_input_spec.source_reader
+
+try:
+    import amanzi_xml.common.parameter
+    import amanzi_xml.common.parameter_list
+    import amanzi_xml.utils.parser
+    import amanzi_xml.utils.io
+except ImportError:
+    amanzi_xml = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
 
-def primitive_to_xml(par):
+backends = ['native', 'amanzi_xml']
+
+def _check_backend(backend):
+    if backend not in backends:
+        raise ValueError(f'Invalid xml backend "{backend}", valid are: {backends}')
+    if backend == 'amanzi_xml' and amanzi_xml is None:
+        raise ImportError('The "amanzi_xml" xml backend requires the amanzi_xml package.')
+
+def primitive_to_xml(par, bindings=None):
     """Returns xml for a Parameter"""
-    return amanzi_xml.utils.parser.objects[par.ptype_string](par.name, par.get())
+    value = _bound(par.get(), bindings)
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    return amanzi_xml.utils.parser.objects[par.ptype_string](par.name, value)
     
-def derived_to_xml(par):
+def derived_to_xml(par, bindings=None):
     """Returns xml for a ParameterList"""
     plist = amanzi_xml.common.parameter_list.ParameterList(par.name)
 
     for p in par.get().parameters():
         if p.has_value():
-            plist.append(obj_to_xml(p))
+            plist.append(obj_to_xml(p, bindings))
     return plist
 
-def obj_to_xml(par):
+def obj_to_xml(par, bindings=None):
     """Returns xml for a Parameter or ParameterList"""
     if par.is_primitive():
-        return primitive_to_xml(par)
+        return primitive_to_xml(par, bindings)
     else:
-        return derived_to_xml(par)
+        return derived_to_xml(par, bindings)
 
-def to_xml(main):
-    """Returns xml for a full ATS spec."""
+def _main_parameter(main, check=True):
+    """Wraps main in the top level Parameter, warning if it is incomplete."""
     main_par = ats_input_spec.specs.Parameter('Main', value=main)
+    if check:
+        _check_complete(main_par)
+    return main_par
+
+def _check_complete(main_par):
     if not main_par.is_complete():
         warnings.warn('Creating an incomplete XML object, missing entries!')
-    return obj_to_xml(main_par)
 
-def write(main, filename):
-    """Write xml file for a full ATS spec."""
-    xml = to_xml(main)
-    amanzi_xml.utils.io.toFile(xml, filename)
-    
-    
+def _primitive_parameters(par):
+    """Generator for all primitive Parameters with a value in par.
+
+    As in writing, lists without a value are skipped, e.g. those with
+    values only in ONE OF branches that are not selected.  Values with
+    cached xml are skipped, as they have no Placeholders.
+    """
+    if par.is_primitive():
+        if par.value is not None:
+            yield par
+    elif par.has_value() and par.value._xml_cache is None:
+        for p in par.value.parameters():
+            yield from _primitive_parameters(p)
+
+def _resolve_bindings(main_par, bindings):
+    """Returns a dict from each Placeholder in main_par to its value in bindings.
+
+    Values are validated against the type of the Placeholder.  All
+    unbound Placeholders are reported at once, before anything is
+    written.
+    """
+    if bindings is None:
+        bindings = dict()
+    resolved = dict()
+    unbound = set()
+    for p in _primitive_parameters(main_par):
+        value = p.value
+        if type(value) is ats_input_spec.primitives.Placeholder and value not in resolved:
+            if value.name not in bindings:
+                unbound.add(value.name)
+                continue
+            try:
+                resolved[value] = ats_input_spec.primitives.valid_from_type(value.ptype, bindings[value.name])
+            except TypeError as err:
+                raise TypeError(f'Binding for placeholder "{value.name}": {err}')
+    if len(unbound) > 0:
+        raise KeyError(f'Unbound placeholders: {sorted(unbound)}')
+    return resolved
+
+def _bound(value, resolved):
+    """Returns value, or its bound value if it is a Placeholder."""
+    if type(value) is ats_input_spec.primitives.Placeholder:
+        try:
+            return resolved[value]
+        except (KeyError, TypeError):
+            raise KeyError(f'Unbound placeholder "{value.name}"')
+    return value
+
+def to_xml(main, backend='native', bindings=None):
+    """Returns xml for a full ATS spec.
+
+    The native backend, the default, returns an
+    xml.etree.ElementTree.Element, the amanzi_xml backend returns an
+    amanzi_xml ParameterList.  bindings
+    is a dict from Placeholder names to values.
+    """
+    _check_backend(backend)
+    main_par = _main_parameter(main)
+    resolved = _resolve_bindings(main_par, bindings)
+    if backend == 'native':
+        return _obj_to_element(main_par, resolved)
+    return obj_to_xml(main_par, resolved)
+
+def write(main, filename, backend='native', bindings=None, cache=False,
+          sidecar=None, known_specs=None, sidecar_min_size=10000,
+          only_if_changed=False):
+    """Write xml file for a full ATS spec.
+
+    bindings is a dict from the names of Placeholders in main to their
+    values.  Placeholders without a binding raise a KeyError before the
+    file is opened.
+
+    If cache, the native backend keeps the xml of each ParameterList on
+    its value, and the next write only renders ParameterLists that have
+    been changed since.  Changes must be made by setting values; lists
+    modified in place are not seen.
+
+    If sidecar, an HDF5 filename, tabular functions with at least
+    sidecar_min_size values are written to it instead, see
+    externalize().  This needs known_specs.
+
+    If only_if_changed, the xml is compared as it is rendered to the
+    existing file, which is left untouched, mtime included, if they are
+    the same.  Otherwise the file is replaced atomically, by writing a
+    temporary file in the same directory and renaming it.  If
+    only_if_changed is a digest from content_hash(), e.g. stored from a
+    previous write, it is compared to that instead of reading the file.
+    A sidecar is likewise only written if its datasets changed.  This
+    compares the xml of the native backend, so needs that backend.
+
+    Returns True if the file was written.
+    """
+    if only_if_changed and backend != 'native':
+        raise ValueError(f'only_if_changed compares the native xml, it cannot be used with the "{backend}" backend.')
+    _check_backend(backend)
+    if sidecar is not None:
+        if known_specs is None:
+            raise ValueError('Writing a sidecar file requires known_specs, to find the fromfile functions.')
+        main = externalize(main, sidecar, known_specs, sidecar_min_size, bool(only_if_changed))
+    if only_if_changed:
+        lines = _native_lines(main, bindings, cache)
+        if isinstance(only_if_changed, str):
+            return _write_if_hash_changed(lines, filename, only_if_changed)
+        return _write_if_changed(lines, filename)
+
+    if backend == 'native':
+        lines = _native_lines(main, bindings, cache)
+        with open(filename, 'w', encoding='utf-8') as fid:
+            fid.writelines(lines)
+    else:
+        xml = to_xml(main, backend, bindings)
+        amanzi_xml.utils.io.toFile(xml, filename)
+    return True
+
+
+def content_hash(main, bindings=None):
+    """The sha256 hex digest of the file write() would write."""
+    digest = hashlib.sha256()
+    for chunk in _encoded(_native_lines(main, bindings, False)):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def _encoded(lines):
+    return (line.encode('utf-8') for line in lines)
+
+def _write_if_changed(lines, filename):
+    """Writes lines to filename unless it already has exactly that content.
+
+    The file is read alongside rendering, and nothing is written until
+    the first difference.  Returns True if the file was written.
+    """
+    chunks = _encoded(lines)
+    matched = 0
+    try:
+        fid = open(filename, 'rb')
+    except FileNotFoundError:
+        return _replace(filename, chunks)
+
+    with fid:
+        for chunk in chunks:
+            if fid.read(len(chunk)) != chunk:
+                chunks = itertools.chain([chunk,], chunks)
+                break
+            matched += len(chunk)
+        else:
+            if fid.read(1) == b'':
+                return False
+        # the part that matched is copied from the file
+        fid.seek(0)
+        return _replace(filename, chunks, fid, matched)
+
+def _write_if_hash_changed(lines, filename, digest):
+    """Writes lines to filename unless the file exists and their hash is digest.
+
+    The lines are rendered once, into the hash and the chunks kept in
+    memory, which are only written if the hash is not digest.
+    """
+    current = hashlib.sha256()
+    chunks = []
+    for chunk in _encoded(lines):
+        current.update(chunk)
+        chunks.append(chunk)
+    if current.hexdigest() == digest and os.path.exists(filename):
+        return False
+    return _replace(filename, chunks)
+
+def _replace(filename, chunks, prefix=None, prefix_size=0):
+    """Atomically replaces filename with prefix_size bytes of prefix, then chunks."""
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    tmp = os.path.join(dirname, f'.{basename}.{os.getpid()}.{os.urandom(4).hex()}.tmp')
+    try:
+        with open(tmp, 'xb') as fid:
+            while prefix_size > 0:
+                block = prefix.read(min(prefix_size, _chunk))
+                fid.write(block)
+                prefix_size -= len(block)
+            fid.writelines(chunks)
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return True
+
+
+#
+# The native backend, which writes the same format without building the
+# amanzi_xml tree.
+#
+_attribute_entities = {'"':'&quot;', '\n':'&#10;'}
+
+def _escape(string):
+    """Escapes a string for use as a double-quoted xml attribute."""
+    return xml.sax.saxutils.escape(string, _attribute_entities)
+
+_chunk = 65536
+
+def _value_to_string(value):
+    """Formats a primitive value as in the value attribute of a Parameter."""
+    if type(value) is bool:
+        return 'true' if value else 'false'
+    elif type(value) is list:
+        return '{' + ', '.join(_value_to_string(v) for v in value) + '}'
+    elif isinstance(value, np.ndarray):
+        # str() of the python floats or ints, formatted in bulk, in
+        # chunks so that e.g. a memory-mapped array is not all read
+        # into python floats at once
+        return '{' + ', '.join(', '.join(map(str, value[i:i+_chunk].tolist()))
+                               for i in range(0, len(value), _chunk)) + '}'
+    else:
+        return str(value)
+
+def _xml_lines(par, level, resolved=None):
+    """Generator for the lines of xml for a Parameter or ParameterList.
+
+    resolved maps Placeholders to their values.  Returns True if par is
+    a ParameterList whose entries are all ParameterLists, which are
+    followed by a blank line.
+    """
+    if par.is_primitive():
+        indent = '  '*level
+        name = _escape(par.name)
+        value = _escape(_value_to_string(_bound(par.get(), resolved)))
+        yield f'{indent}<Parameter name="{name}" type="{par.ptype_string}" value="{value}"/>\n'
+        return False
+
+    children = ((p.is_primitive(), _xml_lines(p, level+1, resolved))
+                for p in par.get().parameters() if p.has_value())
+    return (yield from _list_lines(par.name, level, children))
+
+def _list_lines(name, level, children):
+    """Generator for the lines of xml for a ParameterList.
+
+    children is an iterable of (is_primitive, lines) pairs for the valued
+    entries of the list, where lines is a generator as in _xml_lines().
+    """
+    indent = '  '*level
+    header = f'{indent}<ParameterList name="{_escape(name)}" type="ParameterList"'
+    all_lists = True
+    blank_line = False
+    for primitive, lines in children:
+        if header is not None:
+            yield header + '>\n'
+            header = None
+        elif blank_line:
+            yield '\n'
+        blank_line = yield from lines
+        all_lists = all_lists and not primitive
+
+    if header is not None:
+        yield header + '/>\n'
+        return False
+    yield f'{indent}</ParameterList>\n'
+    return all_lists
+
+def _collect(lines):
+    """Runs a generator of lines, returning the joined text and its return value."""
+    text = []
+    while True:
+        try:
+            text.append(next(lines))
+        except StopIteration as err:
+            return ''.join(text), err.value
+
+def _cached(text, blank_line):
+    """A generator as in _xml_lines() for already rendered text."""
+    yield text
+    return blank_line
+
+def _obj_to_element(par, resolved=None):
+    """Returns an xml.etree Element for a Parameter or ParameterList."""
+    if par.is_primitive():
+        return xml.etree.ElementTree.Element('Parameter', name=par.name, type=par.ptype_string,
+                                             value=_value_to_string(_bound(par.get(), resolved)))
+    plist = xml.etree.ElementTree.Element('ParameterList', name=par.name, type='ParameterList')
+    for p in par.get().parameters():
+        if p.has_value():
+            plist.append(_obj_to_element(p, resolved))
+    return plist
+
+def _native_lines(main, bindings, cache):
+    """Resolves bindings and returns the lines of xml for a full ATS spec."""
+    main_par = _main_parameter(main, not cache)
+    if ats_input_spec.specs._deferred:
+        # resolving bindings skips lists with cached xml, so clear those changed first
+        ats_input_spec.specs._flush_deferred()
+    resolved = _resolve_bindings(main_par, bindings)
+    if cache:
+        # check after rendering, which caches is_complete() too
+        text = _cached_xml(main_par, 0, resolved)[0]
+        _check_complete(main_par)
+        return [text,]
+    return _xml_lines(main_par, 0, resolved)
+
+def _cached_xml(par, level, resolved):
+    """Returns the xml of a ParameterList, using and filling the cache on its value.
+
+    Returns the text, the blank line flag as in _xml_lines(), and
+    whether it was cached.  Text containing Placeholders depends on the
+    bindings, so is not cached.
+    """
+    value = par.value
+    cache = value._xml_cache
+    if cache is not None and cache[0] == level and cache[1] == par.name:
+        return cache[2], cache[3], True
+
+    value._link_xml_parents()
+    cacheable = True
+    children = []
+    for p in value.parameters():
+        if p.has_value():
+            if p.is_primitive():
+                text, blank_line = _collect(_xml_lines(p, level+1, resolved))
+                cacheable = cacheable and type(p.value) is not ats_input_spec.primitives.Placeholder
+            else:
+                text, blank_line, cached = _cached_xml(p, level+1, resolved)
+                cacheable = cacheable and cached
+            children.append((p.is_primitive(), _cached(text, blank_line)))
+        elif not p.is_primitive() and p.value is not None:
+            # not written, but setting values in it must clear the cache
+            ats_input_spec.specs._link_all(p.value)
+
+    text, blank_line = _collect(_list_lines(par.name, level, children))
+    if cacheable:
+        value._xml_cache = (level, par.name, text, blank_line)
+    return text, blank_line, cacheable
+
+def write_stream(main, fileobj, bindings=None, cache=False):
+    """Writes xml for a full ATS spec to a writable stream.
+
+    Elements are written as the spec is traversed, so this does not
+    hold a copy of the full document in memory, unless cache is used.
+    The output, bindings, and cache are the same as write().
+    """
+    lines = _native_lines(main, bindings, cache)
+    if isinstance(fileobj, (io.RawIOBase, io.BufferedIOBase)):
+        lines = _encoded(lines)
+    fileobj.writelines(lines)
+
+
+#
+# Moving large tabular functions to a sidecar HDF5 file.
+#
+_tabular_arrays = ('x values', 'y values')
+_fromfile_parameters = ('file', 'x header', 'y header')
+
+def _large_tabular(container, path, min_size):
+    """Generator for (path, TypedSpec, Parameter) of the typed sublists in
+    container with x and y values, at least one with min_size entries."""
+    for p in container.parameters():
+        if p.is_primitive() or p.value is None:
+            continue
+        sublist = p.value
+        if isinstance(container, ats_input_spec.specs.TypedSpec) and \
+           all(k in sublist for k in _tabular_arrays):
+            values = [sublist[k] for k in _tabular_arrays]
+            if all(isinstance(v, (list, np.ndarray)) for v in values) and \
+               max(len(v) for v in values) >= min_size:
+                yield path+(p.name,), container, p
+        else:
+            yield from _large_tabular(sublist, path+(p.name,), min_size)
+
+def _has_datasets(filename, datasets):
+    """Does the HDF5 file filename hold exactly datasets, a dict from names to arrays?"""
+    try:
+        fid = h5py.File(filename, 'r')
+    except OSError:
+        return False
+    with fid:
+        return set(fid.keys()) == set(datasets) and \
+            all(isinstance(fid[name], h5py.Dataset) and np.array_equal(fid[name][()], data)
+                for (name, data) in datasets.items())
+
+def _typename(typed_spec, name):
+    """The type named by a sublist of a TypedSpec, or None."""
+    if typed_spec.policy == 'standard':
+        return name[:-len(' parameters')] if name.endswith(' parameters') else None
+    elif typed_spec.policy == 'inline':
+        return None
+    return _sublist_type(typed_spec, name)
+
+def externalize(main, sidecar, known_specs, min_size=10000, only_if_changed=False):
+    """Returns main with large tabular functions moved to an HDF5 file.
+
+    Typed sublists with "x values" and "y values", at least one of
+    which has min_size entries, and whose type has a fromfile variant
+    in known_specs (e.g. "function-tabular-fromfile-spec" for the
+    "tabular" function) are rewritten to that variant.  The values are
+    written to datasets in sidecar, named from the path to the sublist.
+    sidecar is used as the "file" parameter, so it should be the path
+    ATS will see, e.g. relative to where it runs.
+
+    If only_if_changed, sidecar is left untouched if it already holds
+    exactly these datasets.
+
+    main is not modified, and is returned if nothing is moved.
+    Otherwise the whole of main is copied and the moved sublists are
+    rewritten in the copy, so this costs a copy of main.  Unchanged
+    entries are not shared with main, as each object has one parent.
+    """
+    moves = []
+    for path, typed_spec, par in _large_tabular(main, (), min_size):
+        typename = _typename(typed_spec, par.name)
+        if typename is None:
+            continue
+        specname = _typed_specname(f'{typed_spec.type} {typename} fromfile')
+        if specname not in known_specs:
+            continue
+        fromfile = known_specs[specname]
+        others = [p for p in par.value.valued() if p.name not in _tabular_arrays]
+        if not all(k in fromfile for k in _fromfile_parameters) or \
+           not all(p.name in fromfile for p in others):
+            continue
+
+        header = ' > '.join(path).replace('/', '_')
+        fromfile['file'] = sidecar
+        fromfile['x header'] = f'{header} > x values'
+        fromfile['y header'] = f'{header} > y values'
+        for p in others:
+            fromfile[p.name] = p.get()
+        moves.append((path, fromfile, [par.value[k] for k in _tabular_arrays]))
+
+    if len(moves) == 0:
+        return main
+    if h5py is None:
+        raise ImportError('Writing a sidecar file requires the h5py package.')
+
+    datasets = dict((fromfile[k], np.asarray(v, dtype=float))
+                    for (path, fromfile, values) in moves
+                    for (k, v) in zip(['x header', 'y header'], values))
+    if not (only_if_changed and _has_datasets(sidecar, datasets)):
+        with h5py.File(sidecar, 'w') as fid:
+            for name, data in datasets.items():
+                fid.create_dataset(name, data=data)
+
+    main = main.copy()
+    for path, fromfile, values in moves:
+        container = main
+        for name in path[:-1]:
+            container = _get_parameter(container, name).get()
+        _get_parameter(container, path[-1]).set(fromfile)
+    return main
+
+
+#
+# Ensembles of files that differ from a template in a few parameters.
+#
+def _ensemble_skeleton(par, level, path, varied, prefixes, found):
+    """Splits the xml of the entries of a ParameterList around the varied paths.
+
+    Returns a list of entries, each one of:
+
+    - ('text', xml, is_primitive, blank_line) for a run of entries that
+      are not varied, rendered once and encoded,
+    - ('hole', path, par, nested) for a varied Parameter, where nested
+      are the varied paths below it, relative to it, or
+    - ('node', name, entries) for a ParameterList containing varied
+      Parameters.
+    """
+    entries = []
+    for p in par.get().parameters():
+        p_path = path + (p.name,)
+        if p_path in varied:
+            found.add(p_path)
+            nested = []
+            for other in varied:
+                if len(other) > len(p_path) and other[:len(p_path)] == p_path:
+                    try:
+                        ats_input_spec.specs.find_parameter(p.get(), other[len(p_path):])
+                    except (KeyError, AttributeError):
+                        continue
+                    found.add(other)
+                    nested.append(other[len(p_path):])
+            entries.append(('hole', p_path, p, nested))
+        elif p_path in prefixes:
+            entries.append(('node', p.name,
+                            _ensemble_skeleton(p, level+1, p_path, varied, prefixes, found)))
+        elif p.has_value():
+            text, blank_line = _collect(_xml_lines(p, level+1))
+            text = text.encode('utf-8')
+            if len(entries) > 0 and entries[-1][0] == 'text':
+                # merge with the previous run
+                _, prev_text, prev_primitive, prev_blank_line = entries.pop()
+                if prev_blank_line:
+                    prev_text = prev_text + b'\n'
+                text = prev_text + text
+                primitive = prev_primitive or p.is_primitive()
+            else:
+                primitive = p.is_primitive()
+            entries.append(('text', text, primitive, blank_line))
+    return entries
+
+def _set_value(container, k, value):
+    """Sets a primitive value, or updates a derived one from a dict."""
+    if isinstance(value, dict):
+        container[k].update(value)
+    else:
+        container[k] = value
+
+def _vary(par, path, nested, variation):
+    """Returns a copy of par with the values in variation at or below path set."""
+    par = par.copy()
+    if path in variation:
+        value = variation[path]
+        if not par.is_primitive() and isinstance(value, dict):
+            par.get().update(value)
+        else:
+            par.set(value)
+    for sub in nested:
+        if path + sub in variation:
+            container = par.get()
+            for k in sub[:-1]:
+                container = container[k]
+            _set_value(container, sub[-1], variation[path + sub])
+    return par
+
+def _ensemble_children(level, entries, variation):
+    """Returns the valued entries of a ParameterList in an ensemble member, as in _list_lines().
+
+    As in writing, ParameterLists without a value in the member are
+    not written.
+    """
+    children = []
+    for entry in entries:
+        if entry[0] == 'text':
+            children.append((entry[2], _cached(entry[1], entry[3])))
+        elif entry[0] == 'hole':
+            p = _vary(entry[2], entry[1], entry[3], variation)
+            if p.has_value():
+                children.append((p.is_primitive(), _xml_lines(p, level+1)))
+        else:
+            nested = _ensemble_children(level+1, entry[2], variation)
+            if len(nested) > 0:
+                children.append((False, _list_lines(entry[1], level+1, nested)))
+    return children
+
+def _ensemble_lines(name, level, entries, variation):
+    """Generator for the lines of xml of a ParameterList in an ensemble member."""
+    return (yield from _list_lines(name, level, _ensemble_children(level, entries, variation)))
+
+def _write_member(skeleton, out_pattern, i, variation):
+    """Writes one member of an ensemble, returning its filename."""
+    filename = out_pattern.format(i=i)
+    lines = _ensemble_lines('Main', 0, skeleton, variation)
+    with open(filename, 'wb') as fid:
+        fid.writelines(line if type(line) is bytes else line.encode('utf-8') for line in lines)
+    return filename
+
+_worker_skeleton = None
+
+def _init_ensemble_worker(skeleton, out_pattern):
+    global _worker_skeleton
+    _worker_skeleton = (skeleton, out_pattern)
+
+def _write_worker_member(args):
+    return _write_member(*_worker_skeleton, *args)
+
+def _variation_path(path):
+    if isinstance(path, str):
+        return (path,)
+    return tuple(path)
+
+def write_ensemble(template, variations, out_pattern, workers=1):
+    """Write xml files for an ensemble of variations on a full ATS spec.
+
+    variations is an iterable of dicts, one per member, mapping paths
+    (tuples of names from main, or a name at the top level) to values.
+    Primitive Parameters are set to the value, derived Parameters are
+    updated from a dict or set to a spec.  Paths not in a member's dict
+    keep the template's value.
+
+    out_pattern is formatted with the member's index, e.g.
+    'run_{i:04d}.xml'.  The template is not modified.
+
+    The xml of everything that is not varied is rendered once and reused
+    for every member, so the cost of each member is that of writing the
+    file.  With workers > 1, members are written by a process pool.
+
+    Returns the list of filenames written.
+    """
+    variations = [dict((_variation_path(k), v) for (k, v) in variation.items())
+                  for variation in variations]
+    varied = set(path for variation in variations for path in variation)
+    prefixes = set(path[:i] for path in varied for i in range(1, len(path)))
+
+    found = set()
+    skeleton = _ensemble_skeleton(_main_parameter(template), 0, tuple(), varied, prefixes, found)
+    if len(found) != len(varied):
+        missing = sorted(' -> '.join(path) for path in varied.difference(found))
+        raise KeyError(f'Varied parameters are not in the template: {missing}')
+
+    if workers is None or workers <= 1 or len(variations) <= 1:
+        return [_write_member(skeleton, out_pattern, i, variation)
+                for (i, variation) in enumerate(variations)]
+
+    chunksize = max(1, len(variations) // (4*workers))
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_ensemble_worker,
+                                                initargs=(skeleton, out_pattern)) as pool:
+        return list(pool.map(_write_worker_member, enumerate(variations), chunksize=chunksize))
+
+
+#
+# Patches holding only the changes relative to a base file.
+#
+def _as_element(xml_or_main, bindings=None):
+    """An xml Element for a main, an xml filename, or an Element, which is copied."""
+    if isinstance(xml_or_main, xml.etree.ElementTree.Element):
+        return copy.deepcopy(xml_or_main)
+    elif isinstance(xml_or_main, (str, os.PathLike)):
+        root = xml.etree.ElementTree.parse(xml_or_main).getroot()
+        # drop the indentation, so that it matches an Element from to_xml()
+        for elem in root.iter():
+            elem.text = elem.tail = None
+        return root
+    return to_xml(xml_or_main, 'native', bindings)
+
+def _delta(elem, base):
+    """Returns the patch of the ParameterList elem relative to base, or None if they are the same.
+
+    A new entry that is not at the end of elem is preceded by an
+    <After name="..."/> naming the entry it follows, or "" if it is first.
+    """
+    patch = xml.etree.ElementTree.Element(elem.tag, elem.attrib)
+    base_children = dict((child.get('name'), child) for child in base)
+    last_kept = max((i for (i, child) in enumerate(elem) if child.get('name') in base_children), default=-1)
+    previous = ''
+    for (i, child) in enumerate(elem):
+        old = base_children.pop(child.get('name'), None)
+        if old is None or old.tag != child.tag:
+            if old is None and i < last_kept:
+                patch.append(xml.etree.ElementTree.Element('After', name=previous))
+            patch.append(child)
+        elif child.tag == 'ParameterList':
+            child_patch = _delta(child, old)
+            if child_patch is not None:
+                patch.append(child_patch)
+        elif child.attrib != old.attrib:
+            patch.append(child)
+        previous = child.get('name')
+    for name in base_children:
+        patch.append(xml.etree.ElementTree.Element('Remove', name=name))
+    if len(patch) == 0:
+        return None
+    return patch
+
+def _apply(elem, patch):
+    """Applies a patch from _delta() to the ParameterList elem, in place."""
+    children = list(elem)
+    index = dict((child.get('name'), i) for (i, child) in enumerate(children))
+    inserted = collections.defaultdict(list)
+    after = None
+    for change in patch:
+        name = change.get('name')
+        i = index.get(name)
+        if change.tag == 'After':
+            after = name
+            continue
+        if change.tag == 'Remove':
+            if i is None:
+                raise KeyError(f'Patch removes "{name}", which is not in the base.')
+            children[i] = None
+            del index[name]
+        elif i is None and after is not None:
+            inserted[after].append(change)
+        elif i is None:
+            index[name] = len(children)
+            children.append(change)
+        elif change.tag == 'ParameterList' and children[i].tag == 'ParameterList':
+            _apply(children[i], change)
+        else:
+            children[i] = change
+        after = None
+
+    def _placed(name):
+        # the entries inserted after name, and those after them
+        for child in inserted.pop(name, []):
+            yield child
+            yield from _placed(child.get('name'))
+
+    result = list(_placed(''))
+    for child in children:
+        if child is not None:
+            result.append(child)
+            result.extend(_placed(child.get('name')))
+    for name in list(inserted):
+        # entries following one that is not in the base
+        result.extend(_placed(name))
+    elem[:] = result
+
+def _element_lines(elem, level):
+    """Generator for the lines of xml for an Element, as in _xml_lines()."""
+    if elem.tag == 'ParameterList':
+        children = ((child.tag != 'ParameterList', _element_lines(child, level+1)) for child in elem)
+        return (yield from _list_lines(elem.get('name'), level, children))
+
+    indent = '  '*level
+    attributes = ' '.join(f'{k}="{_escape(v)}"' for (k, v) in elem.attrib.items())
+    yield f'{indent}<{elem.tag} {attributes}/>\n'
+    return False
+
+def write_delta(main, base, filename, bindings=None):
+    """Write an xml patch file holding only the changes from base to main.
+
+    base is a main, an xml filename, or an xml Element of a full ATS
+    spec.  The patch is a ParameterList holding only the Parameters
+    and ParameterLists that are new or changed in main, with changed
+    ParameterLists holding only their changes, and a <Remove name="..."/>
+    for each entry of base that is not in main.  New entries that are
+    not at the end of their ParameterList are preceded by an
+    <After name="..."/> naming the entry they follow.  bindings are as
+    in write(), and are used for both main and base.
+    """
+    patch = _delta(_as_element(main, bindings), _as_element(base, bindings))
+    if patch is None:
+        patch = xml.etree.ElementTree.Element('ParameterList', name='Main', type='ParameterList')
+    with open(filename, 'w', encoding='utf-8') as fid:
+        fid.writelines(_element_lines(patch, 0))
+
+def apply_delta(base, patch, known_specs=None, problems=None, spec='main-spec'):
+    """Applies a patch from write_delta() to base.
+
+    base is a main, an xml filename, or an xml Element, and patch is an
+    xml filename or Element.  base is not modified.  New entries are
+    inserted where they are in the patched main, see write_delta().
+
+    Returns an xml Element, or, if known_specs is given, reads it into
+    a main as in read().
+    """
+    elem = _as_element(base)
+    _apply(elem, _as_element(patch))
+    if known_specs is None:
+        return elem
+    return read(io.BytesIO(xml.etree.ElementTree.tostring(elem, encoding='utf-8')),
+                known_specs, problems, spec)
+
+
+#
+# Archives holding many files, e.g. an ensemble.
+#
+_archive_formats = ('tar', 'zip')
+
+# fixed metadata, so that the same mains give the same archive
+_zip_date_time = (1980, 1, 1, 0, 0, 0)
+_member_mode = 0o644
+
+def _is_path(archive):
+    return isinstance(archive, (str, bytes, os.PathLike))
+
+def _write_tar_member(tar, name, main):
+    data = io.BytesIO()
+    write_stream(main, data)
+    info = tarfile.TarInfo(name)
+    info.size = data.tell()
+    info.mode = _member_mode
+    data.seek(0)
+    tar.addfile(info, data)
+
+def _write_zip_member(archive, name, main):
+    info = zipfile.ZipInfo(name, date_time=_zip_date_time)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = _member_mode << 16
+    with archive.open(info, 'w') as fid:
+        write_stream(main, fid)
+
+def write_many(mains, archive, format='tar', member_pattern='{i:06d}.xml'):
+    """Write xml files for many full ATS specs into a single archive.
+
+    mains is an iterable of mains, which is consumed one at a time, so
+    it may be a generator that builds each member.  archive is a
+    filename or a writable binary stream.  format is 'tar', which is
+    uncompressed, or 'zip', which is deflated.
+
+    Member names are member_pattern formatted with the index of the
+    main, and the members' times and permissions are fixed, so that the
+    same mains always give the same archive.  Nothing is written to
+    temporary files.
+
+    Returns the list of member names.
+    """
+    if format not in _archive_formats:
+        raise ValueError(f'Unknown archive format "{format}", valid are: {_archive_formats}')
+    names = []
+    if format == 'tar':
+        if _is_path(archive):
+            archive = tarfile.open(archive, 'w|')
+        else:
+            archive = tarfile.open(fileobj=archive, mode='w|')
+        write_member = _write_tar_member
+    else:
+        archive = zipfile.ZipFile(archive, 'w')
+        write_member = _write_zip_member
+
+    with archive:
+        for i, main in enumerate(mains):
+            name = member_pattern.format(i=i)
+            write_member(archive, name, main)
+            names.append(name)
+    return names
+
+def read_many(archive, known_specs, problems=None, spec='main-spec'):
+    """Generator for the (member name, main) pairs of an archive from write_many().
+
+    The format is detected from the archive, a filename or a readable
+    binary stream.  Members are read one at a time, as iterated, and
+    members that are not xml files are skipped.  known_specs, problems,
+    and spec are as in read().
+    """
+    if zipfile.is_zipfile(archive):
+        if not _is_path(archive):
+            archive.seek(0)
+        with zipfile.ZipFile(archive, 'r') as zfile:
+            for info in zfile.infolist():
+                if not info.is_dir() and info.filename.endswith('.xml'):
+                    with zfile.open(info) as fid:
+                        yield info.filename, read(fid, known_specs, problems, spec)
+        return
+
+    if _is_path(archive):
+        tar = tarfile.open(archive, 'r|*')
+    else:
+        archive.seek(0)
+        tar = tarfile.open(fileobj=archive, mode='r|*')
+    with tar:
+        for info in tar:
+            if info.isfile() and info.name.endswith('.xml'):
+                yield info.name, read(tar.extractfile(info), known_specs, problems, spec)
+
+
+#
+# Reading xml into a main built from the specs.
+#
+def _parse_value(ptype, string):
+    """Parses the value attribute of a Parameter of type ptype."""
+    if ptype in ats_input_spec.primitives.valid_list_primitives:
+        inner = string.strip()
+        if len(inner) < 2 or inner[0] != '{' or inner[-1] != '}':
+            raise ValueError(f'Array value "{string}" is not of the form {{a, b, ...}}')
+        inner = inner[1:-1]
+        if len(inner.strip()) == 0:
+            return []
+        # entries are written separated by ", "
+        entries = [entry.strip() for entry in inner.split(',')]
+        if ptype is ats_input_spec.primitives.ListStr:
+            return entries
+        string = '{' + ','.join(entries) + '}'
+    return ats_input_spec.primitives.valid_primitive_from_string(ptype, string)
+
+def _get_parameter(container, name):
+    """Returns the Parameter object name in container, selecting OneOf branches."""
+    if isinstance(container, ats_input_spec.specs.ParameterCollection):
+        return container.get_parameter(name)
+    elif isinstance(container, ats_input_spec.specs.CaseSwitch):
+        if name == container.case.name:
+            return container.case
+        elif not container.case.is_complete():
+            raise KeyError(f'Parameter "{name}" is read before the case "{container.case.name}" is set.')
+        return _get_parameter(container.branches[container.case.get()], name)
+
+    index = container._find_key(name)
+    if isinstance(container, ats_input_spec.specs.OneOf):
+        if container.branch_index is None:
+            container.branch_index = index
+        elif container.branch_index != index:
+            raise KeyError(f'Parameter "{name}" is in a different ONE OF branch than previous parameters.')
+    return _get_parameter(container.collections[index], name)
+
+class SpecCache(object):
+    """Returns copies of specs from a SpecDict, constructing each only once.
+
+    read() uses one for each file; pass one to read() to share it
+    across files.  Changes to the SpecDict are not seen.
+    """
+    def __init__(self, known_specs):
+        self.known_specs = known_specs
+        self.specs = dict()
+
+    def __getitem__(self, key):
+        try:
+            spec = self.specs[key]
+        except KeyError:
+            spec = self.specs[key] = self.known_specs[key]
+        return spec.copy()
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+@functools.lru_cache(maxsize=None)
+def _typed_specname(typename):
+    return ats_input_spec.source_reader.to_specname(typename)
+
+def _set_type(typed_spec, typename, known_specs, report):
+    """Sets the type of a TypedSpec, returning the typed sublist.
+
+    The spec is named from the type, or may be the type itself.  Unknown
+    types are reported and set to an open collection, so that their
+    parameters may still be read.
+    """
+    for specname in [_typed_specname(typed_spec.type+' '+typename), typename]:
+        if specname in known_specs:
+            return typed_spec.set_type(typename, known_specs[specname])
+    report(KeyError(f'Unknown {typed_spec.type} type "{typename}", its parameters are not checked.'))
+    return typed_spec.set_type(typename, ats_input_spec.specs.ParameterCollection(policy_not_in_spec='none'))
+
+def _sublist_type(typed_spec, name):
+    """Returns the type named by a sublist of a sublist-policy TypedSpec, or None."""
+    if typed_spec.policy == 'sublist':
+        prefix = typed_spec.type+': '
+    else:
+        prefix = (typed_spec.type+ats_input_spec.specs.DELIMITER).replace(' ', ats_input_spec.specs.DELIMITER)
+    if name.startswith(prefix):
+        return name[len(prefix):]
+    return None
+
+def _is_typed_sublist(container, name):
+    """Is name the sublist holding the type of a sublist-policy TypedSpec?"""
+    return isinstance(container, ats_input_spec.specs.TypedSpec) and \
+        container.policy.startswith('sublist') and _sublist_type(container, name) is not None
+
+def _is_open(container):
+    """Does container accept parameters that are not in its spec?"""
+    return type(container) is ats_input_spec.specs.ParameterCollection and \
+        container._policy_not_in_spec != 'error'
+
+def _read_list(container, name, known_specs, report):
+    """Returns the container for a ParameterList called name in container."""
+    if isinstance(container, ats_input_spec.specs.TypedCollection):
+        if container.contained_ptype is None or container._primitive:
+            raise TypeError(f'"{name}" is a ParameterList in a list of {container.contained_ptype_string}.')
+        return container.append_empty(name)
+
+    if name in container:
+        par = _get_parameter(container, name)
+        if par.is_primitive():
+            raise TypeError(f'"{name}" is a ParameterList, but should be of type "{par.ptype_string}".')
+        if par.value is None:
+            par.set(known_specs[par.ptype])
+        return par.value
+
+    if isinstance(container, ats_input_spec.specs.TypedSpec) and container.policy.startswith('sublist'):
+        typename = _sublist_type(container, name)
+        if typename is not None:
+            return _set_type(container, typename, known_specs, report)
+
+    if _is_open(container):
+        container[name] = ats_input_spec.specs.ParameterCollection(policy_not_in_spec='none')
+        return container[name]
+    raise KeyError(f'Unknown parameter "{name}".')
+
+def _read_parameter(container, name, ptype_string, value_string, known_specs, report):
+    """Sets the Parameter called name in container from its xml attributes."""
+    try:
+        ptype = ats_input_spec.primitives.text_to_primitive[ptype_string]
+    except KeyError:
+        raise TypeError(f'Parameter "{name}" has unknown type "{ptype_string}".')
+    try:
+        value = _parse_value(ptype, value_string)
+    except (ValueError, RuntimeError, AssertionError):
+        raise TypeError(f'Parameter "{name}" has invalid value "{value_string}" for type "{ptype_string}".')
+    _set_parameter(container, name, ptype, value, known_specs, report)
+
+def _set_parameter(container, name, ptype, value, known_specs, report):
+    """Sets the Parameter called name in container to a value of type ptype."""
+    ptype_string = ats_input_spec.primitives.primitives_to_text[ptype]
+    if isinstance(container, ats_input_spec.specs.TypedCollection):
+        if not container._primitive:
+            raise TypeError(f'"{name}" is a Parameter in a list of {container.contained_ptype_string}.')
+        container[name] = value
+        return
+
+    if name not in container:
+        if _is_open(container):
+            container._pars[name] = ats_input_spec.specs.Parameter(name, ptype, value=value)
+            return
+        raise KeyError(f'Unknown parameter "{name}".')
+
+    par = _get_parameter(container, name)
+    if not par.is_primitive():
+        raise TypeError(f'"{name}" is a Parameter of type "{ptype_string}", but should be a ParameterList.')
+    if par.ptype is not ptype:
+        raise TypeError(f'Parameter "{name}" is of type "{ptype_string}", but should be of type "{par.ptype_string}".')
+
+    if isinstance(container, ats_input_spec.specs.TypedSpec) and name == container.type+' type' \
+       and container.policy in ('standard', 'inline'):
+        _set_type(container, value, known_specs, report)
+    else:
+        container[name] = value
+
+def _reader_problem(problems, names, err):
+    """Raises err, or adds it to problems with the path where it occurred."""
+    if problems is None:
+        raise err
+    problems.append(' -> '.join(names) + ': ' + err.args[0])
+
+def read(filename, known_specs, problems=None, spec='main-spec'):
+    """Reads an xml file into a full ATS spec.
+
+    The file is parsed in a single streaming pass, and each
+    ParameterList is matched to the corresponding spec in known_specs,
+    a SpecDict or SpecCache.  Lists of typed things have their type set from the
+    "... type" parameter or sublist name.  Processed elements are
+    discarded, so memory use is that of the resulting spec.
+
+    By default, the first unknown parameter or parameter of the wrong
+    type raises a KeyError or TypeError, and the first repeated entry
+    of a list a ValueError.  If problems is a list, a
+    message for each is appended to it instead, the offending entry is
+    skipped, and reading continues.
+
+    Returns the spec, by default main.
+    """
+    if not isinstance(known_specs, SpecCache):
+        known_specs = SpecCache(known_specs)
+    result = None
+    containers = []
+    names = []
+    elems = []
+    report = lambda err : _reader_problem(problems, names, err)
+    for event, elem in xml.etree.ElementTree.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            elems.append(elem)
+            if elem.tag == 'ParameterList':
+                name = elem.get('name')
+                if len(containers) == 0:
+                    container = result = known_specs[spec]
+                elif containers[-1] is None:
+                    container = None
+                else:
+                    try:
+                        container = _read_list(containers[-1], name, known_specs, report)
+                    except (KeyError, TypeError, ValueError) as err:
+                        report(err)
+                        container = None
+                containers.append(container)
+                names.append(name)
+
+            elif elem.tag == 'Parameter':
+                if len(containers) > 0 and containers[-1] is not None:
+                    try:
+                        _read_parameter(containers[-1], elem.get('name'), elem.get('type'),
+                                        elem.get('value'), known_specs, report)
+                    except (KeyError, TypeError, ValueError) as err:
+                        report(err)
+
+        else:
+            if elem.tag == 'ParameterList':
+                containers.pop()
+                names.pop()
+            elems.pop()
+            elem.clear()
+            if len(elems) > 0:
+                # processed children are the only children of their parent
+                del elems[-1][:]
+    return result
+
+
+#
+# Pickling by spec name, see specs.SpecDict.
+#
+def _compact(container):
+    """The values set in container, as nested lists like its xml.
+
+    Each entry is (name, ptype_string, value) for a Parameter, or
+    (name, entries) for a ParameterList.  The entries setting the type
+    of a TypedSpec also hold the spec name of the type, or None, as the
+    type does not always name it, and are kept even if the type has no
+    values yet.  Lists from the specs set in an open list, e.g. "land
+    cover types", hold their spec name, so that they are rebuilt with
+    their type.  Unlike in xml, entries appended to a list but not yet
+    filled are kept.  Lists of derived types may also hold columns, see
+    _compact_typed_collection().
+    """
+    if isinstance(container, ats_input_spec.specs.TypedCollection) and not container._primitive:
+        return _compact_typed_collection(container)
+
+    typed = isinstance(container, ats_input_spec.specs.TypedSpec)
+    state = []
+    for p in container.parameters():
+        if p.is_primitive():
+            if p.has_value():
+                entry = (p.name, p.ptype_string, p.value)
+                if typed and p.name == container.type+' type':
+                    entry += (container._typed_spec_name,)
+                state.append(entry)
+        elif p.value is not None:
+            entries = _compact(p.value)
+            if typed and _is_typed_sublist(container, p.name):
+                state.append((p.name, entries, container._typed_spec_name))
+            elif len(entries) > 0 or p.has_value():
+                entry = (p.name, entries)
+                if _is_open(container):
+                    spec_name = p.value.__dict__.get('_spec_source', (None, None))[1]
+                    if spec_name is not None:
+                        entry += (spec_name,)
+                state.append(entry)
+    return state
+
+# fewer entries of the same structure than this are not made columns
+_min_column_run = 8
+
+def _compact_typed_collection(tc):
+    """_compact() of a TypedCollection of derived types.
+
+    Entries stored as columns, and runs of entries of the same
+    structure, are kept as (names, template entries, columns), see
+    TypedCollection.append_columns().
+    """
+    state = []
+    rows = []
+    for k, p in tc._pars.items():
+        if type(p) is ats_input_spec.specs._ColumnRow:
+            if len(rows) > 0 and rows[-1][1].block is not p.block:
+                state.append(_column_entry(rows))
+                rows = []
+            rows.append((k, p))
+        else:
+            if len(rows) > 0:
+                state.append(_column_entry(rows))
+                rows = []
+            state.append((k, _compact(p.value)))
+    if len(rows) > 0:
+        state.append(_column_entry(rows))
+    return _columnize(state)
+
+def _column_entry(rows):
+    """The columns entry for rows of one _ColumnBlock."""
+    block = rows[0][1].block
+    index = np.array([row.index for (k, row) in rows])
+    return ([k for (k, row) in rows], _compact(block.template),
+            dict((path, column[index]) for (path, column) in block.columns.items()))
+
+_column_ptype_strings = ('double', 'int', 'string', 'bool')
+
+def _shape(entries, path, values):
+    """The structure of _compact() entries, or None if they cannot be columns.
+
+    The primitive values are appended to values as (path, value).
+    """
+    shape = []
+    for entry in entries:
+        if type(entry[0]) is list:
+            return None
+        elif type(entry[1]) is list:
+            sub = _shape(entry[1], path + (entry[0],), values)
+            if sub is None:
+                return None
+            shape.append((entry[0], sub) + entry[2:])
+        elif len(entry) == 4:
+            shape.append(entry)
+        elif entry[1] in _column_ptype_strings and \
+             type(entry[2]) is not ats_input_spec.primitives.Placeholder:
+            shape.append(entry[:2])
+            values.append((path + (entry[0],), entry[2]))
+        else:
+            return None
+    return tuple(shape)
+
+def _columnize(state):
+    """Replaces runs of entries of the same structure in state by columns."""
+    result = []
+    i = 0
+    while i < len(state):
+        values = []
+        shape = None if type(state[i][0]) is list else _shape(state[i][1], (), values)
+        if shape is None:
+            result.append(state[i])
+            i += 1
+            continue
+
+        paths = [path for (path, value) in values]
+        rows = [[value for (path, value) in values]]
+        j = i + 1
+        while j < len(state) and type(state[j][0]) is not list:
+            values = []
+            if _shape(state[j][1], (), values) != shape:
+                break
+            rows.append([value for (path, value) in values])
+            j += 1
+
+        if j - i < _min_column_run:
+            result.extend(state[i:j])
+        else:
+            columns = dict((path, [row[c] for row in rows]) for (c, path) in enumerate(paths))
+            result.append(([entry[0] for entry in state[i:j]], state[i][1], columns))
+        i = j
+    return result
+
+def _fill(container, state, known_specs, report):
+    """Sets the values of _compact() in container, as read() would."""
+    for entry in state:
+        if type(entry[0]) is list:
+            names, template_state, columns = entry
+            template = container.contained_ptype.copy()
+            _fill(template, template_state, known_specs, report)
+            container.append_columns(names, columns, template)
+        elif type(entry[1]) is list:
+            if _is_typed_sublist(container, entry[0]):
+                typename = _sublist_type(container, entry[0])
+                if entry[2] is None:
+                    sublist = _set_type(container, typename, known_specs, report)
+                else:
+                    sublist = container.set_type(typename, known_specs[entry[2]])
+            elif len(entry) == 3 and entry[0] not in container and _is_open(container):
+                container[entry[0]] = known_specs[entry[2]]
+                sublist = container[entry[0]]
+            else:
+                sublist = _read_list(container, entry[0], known_specs, report)
+            _fill(sublist, entry[1], known_specs, report)
+        elif len(entry) == 4:
+            if entry[3] is None:
+                _set_type(container, entry[2], known_specs, report)
+            else:
+                container.set_type(entry[2], known_specs[entry[3]])
+        else:
+            name, ptype_string, value = entry
+            _set_parameter(container, name, ats_input_spec.primitives.text_to_primitive[ptype_string],
+                           value, known_specs, report)
+
+def _raise(err):
+    raise err
+
+# a SpecCache for each spec pickled objects were made from, by spec hash
+_rehydrate_caches = dict()
+
+def _rehydrate(spec_name, spec_hash, state):
+    """Unpickles an object made from spec_name, see specs.SpecDict."""
+    try:
+        known_specs = _rehydrate_caches[spec_hash]
+    except KeyError:
+        known_specs = _rehydrate_caches[spec_hash] = \
+            SpecCache(ats_input_spec.specs._find_spec_dict(spec_name, spec_hash))
+    container = known_specs[spec_name]
+    _fill(container, state, known_specs, _raise)
+    return container
+
+def save_session(session, filename):
+    """Saves session, e.g. a dict of partially built mains, to filename.
+
+    Anything picklable may be saved.  Objects from a SpecDict are
+    pickled as their spec name and the values set in them, so the file
+    is about the size of their xml.  See resume_session().
+    """
+    with open(filename, 'wb') as fid:
+        pickle.dump(session, fid, protocol=pickle.HIGHEST_PROTOCOL)
+
+def resume_session(filename):
+    """Loads a session saved by save_session().
+
+    Objects from a SpecDict are rebuilt from a SpecDict of this process
+    holding the same specs, e.g. ats_input_spec.public.known_specs.  A
+    ValueError is raised if there is none, e.g. if the specs have
+    changed since the session was saved.
+    """
+    with open(filename, 'rb') as fid:
+        return pickle.load(fid)
@@ -9,6 +9,8 @@ Authors: Ethan Coon (ecoon@lanl.gov)
 Module for working with primitive parameter types.
 """
 
+import numpy as np
+
 
 class ListBool(object):
     ptype = bool
@@ -22,6 +24,23 @@ class ListInt(object):
 class ListStr(object):
     ptype = str
 
+class Placeholder(object):
+    """A named value of a primitive type, bound when writing."""
+    def __init__(self, name, ptype):
+        if ptype not in valid_types:
+            raise TypeError('Parameter Validation: Type "{0}" not in valid types.'.format(ptype))
+        self.name = name
+        self.ptype = ptype
+
+    def __repr__(self):
+        return "Placeholder(%r, %s)"%(self.name, primitives_to_text[self.ptype])
+
+    def __eq__(self, other):
+        return type(other) is Placeholder and self.name == other.name and self.ptype is other.ptype
+
+    def __hash__(self):
+        return hash((self.name, self.ptype))
+
 valid_primitives = [float, int, str, bool]
 valid_list_primitives = [ListBool,ListFloat,ListInt,ListStr]
 valid_types = valid_primitives + valid_list_primitives
@@ -46,8 +65,16 @@ primitives_to_text = {float:"double",
                       ListBool:"Array(bool)",
                       }
 
+# dtype kinds of numpy arrays accepted as list types
+_array_kinds = {ListFloat:'fiu',
+                ListInt:'iu'}
+
 def valid_from_type(ptype, value):
-    """Returns value interpreted as a ptype."""
+    """Returns value interpreted as a ptype.
+
+    Array(double) and Array(int) values may also be 1D numpy arrays,
+    including memory-mapped ones.
+    """
     if ptype not in valid_types:
         raise TypeError('Parameter Validation: Type "{0}" not in valid types.'.format(ptype))
 
@@ -57,6 +84,11 @@ def valid_from_type(ptype, value):
     if type(value) is ptype:
         return value
 
+    if type(value) is Placeholder:
+        if value.ptype is ptype:
+            return value
+        raise TypeError('Parameter Validation: Placeholder "{0}" of type "{1}" cannot be interpreted as "{2}"'.format(value.name, value.ptype, ptype))
+
     if ptype is bool:
         if type(value) is int and (value == 0 or value == 1):
             return bool(value)
@@ -85,10 +117,55 @@ def valid_from_type(ptype, value):
     elif ptype in valid_list_primitives:
         if type(value) is list:
             return [valid_from_type(ptype.ptype, v) for v in value]
+        elif isinstance(value, np.ndarray) and value.ndim == 1 and \
+             value.dtype.kind in _array_kinds.get(ptype, ''):
+            # validated by dtype, and stored as a read-only view so that
+            # the array is not copied, here or when the Parameter is
+            value = value.astype(ptype.ptype, copy=False).view()
+            value.flags.writeable = False
+            return value
 
     raise TypeError('Parameter Validation: Value "{0}" cannot be interpreted as "{1}"'.format(value,ptype))
 
 
+def valid_column_from_type(ptype, values):
+    """Returns a sequence of values, each interpreted as a ptype, as a numpy array.
+
+    Values of list types are returned as rows of a 2D array.  Unlike
+    valid_from_type(), validation is done once on the dtype of the
+    array, not on each entry.
+    """
+    if ptype not in valid_types:
+        raise TypeError('Parameter Validation: Type "{0}" not in valid types.'.format(ptype))
+
+    if ptype in valid_list_primitives:
+        inner, ndim = ptype.ptype, 2
+    else:
+        inner, ndim = ptype, 1
+
+    if inner is str:
+        array = np.array(values, dtype=object)
+        if array.ndim == ndim and all(type(v) is str for v in array.flat):
+            return array
+    else:
+        array = np.asarray(values)
+        if array.ndim == ndim:
+            kind = array.dtype.kind
+            if inner is bool and kind == 'b':
+                return array
+            elif inner is int and kind in 'iu':
+                return array.astype(int, copy=False)
+            elif inner is float and kind in 'iuf':
+                return array.astype(float, copy=False)
+            elif inner is float and kind in 'US':
+                try:
+                    return array.astype(float)
+                except ValueError:
+                    pass
+
+    raise TypeError('Parameter Validation: Column of dtype "{0}" and shape {1} cannot be interpreted as "{2}"'.format(array.dtype, array.shape, ptype))
+
+
 
 # def print_primitive_type(ptype):
 #     """Pretty-printing of types"""
@@ -149,10 +226,32 @@ def list_from_string(value):
     assert(inner[-1] == "}")
     return inner[1:-1].split(",")
     
+def _array_from_strings(ptype, values):
+    """Converts the entries of a list all at once, or returns None.
+
+    numpy accepts the same strings as float() and int(), and bools are
+    matched against the same spellings as valid_bool_from_string().
+    None is returned if any entry is not accepted, e.g. integers written
+    as 1e3, leaving them to the per-entry functions, which also raise
+    the errors.
+    """
+    if len(values) == 0:
+        return None
+    if ptype is ListBool:
+        values = np.array(values)
+        true = np.isin(values, ['true', 'True', 'TRUE'])
+        if np.all(true | np.isin(values, ['false', 'False', 'FALSE'])):
+            return true.tolist()
+        return None
+    try:
+        return np.array(values, dtype=ptype.ptype).tolist()
+    except (ValueError, OverflowError):
+        return None
+
 def valid_primitive_from_string(ptype, value):
     assert(type(value) is str)
     if type(ptype) is str:
-        ptype = xml_to_primitive[ptype]
+        ptype = text_to_primitive[ptype]
 
     if ptype is int:
         return valid_int_from_string(value)
@@ -163,16 +262,21 @@ def valid_primitive_from_string(ptype, value):
     elif ptype is str:
         return value
     elif ptype is ListFloat:
-        return [valid_float_from_string(p) for p in list_from_string(value)]
+        values = list_from_string(value)
+        return _array_from_strings(ptype, values) or [valid_float_from_string(p) for p in values]
     elif ptype is ListInt:
-        return [valid_int_from_string(p) for p in list_from_string(value)]
+        values = list_from_string(value)
+        return _array_from_strings(ptype, values) or [valid_int_from_string(p) for p in values]
     elif ptype is ListBool:
-        return [valid_bool_from_string(p) for p in list_from_string(value)]
+        values = list_from_string(value)
+        return _array_from_strings(ptype, values) or [valid_bool_from_string(p) for p in values]
     elif ptype is ListStr:
         return list_from_string(value)
 
 def string_from_primitive(value):
-    if type(value) is str:
+    if type(value) is Placeholder:
+        return '<{0}>'.format(value.name)
+    elif type(value) is str:
         return value
     elif type(value) is int:
         return str(value)
@@ -183,6 +287,9 @@ def string_from_primitive(value):
             return "false"
     elif type(value) is float:
         return '%2.8f'%value
+    elif isinstance(value, np.ndarray):
+        # repr() of python floats is the shortest string that round-trips
+        return '{'+','.join(map(repr, value.tolist()))+'}'
     elif type(value) is list:
         assert(len(value) > 0)
         t0 = type(value[0])
@@ -10,6 +10,8 @@ The public interface of the ats_input_spec package.
 
 """
 
+import csv
+import numpy as np
 import ats_input_spec.specs
 from ats_input_spec.specs import DELIMITER
 import ats_input_spec.source_reader
@@ -150,46 +152,56 @@ def set_typical_constants(main):
 
 
     
-def set_land_cover_default_constants(main, land_cover_name, transpiration_model='clm'):
-    """Adds an empty land cover list, and populates it with "standard" default values."""
-    try:
-        lc_list = main['state']['model parameters']['land cover types']
-    except KeyError:
-        lc_list = known_specs['land-cover-spec-list']
-        main['state']['model parameters']['land cover types'] = lc_list
-
-    lc = lc_list.append_empty(land_cover_name)
+def land_cover_default_constants(transpiration_model='clm'):
+    """Returns a dictionary of "standard" default values for a land cover type."""
+    defaults = dict()
 
     # set some basic defaults
-    lc['Priestley-Taylor alpha of snow [-]'] = 1.26
-    lc['Priestley-Taylor alpha of bare ground [-]'] = 1.26
-    lc['Priestley-Taylor alpha of canopy [-]'] = 1.26
-    lc['Priestley-Taylor alpha of transpiration [-]'] = 1.26
-
-    lc['albedo of bare ground [-]'] = 0.4
-    lc['emissivity of bare ground [-]'] = 0.98
-    lc['albedo of canopy [-]'] = 0.11
+    defaults['Priestley-Taylor alpha of snow [-]'] = 1.26
+    defaults['Priestley-Taylor alpha of bare ground [-]'] = 1.26
+    defaults['Priestley-Taylor alpha of canopy [-]'] = 1.26
+    defaults['Priestley-Taylor alpha of transpiration [-]'] = 1.26
+
+    defaults['albedo of bare ground [-]'] = 0.4
+    defaults['emissivity of bare ground [-]'] = 0.98
+    defaults['albedo of canopy [-]'] = 0.11
     
-    lc["Beer's law extinction coefficient, shortwave [-]"] = 0.6
-    lc["Beer's law extinction coefficient, longwave [-]"] = 5
+    defaults["Beer's law extinction coefficient, shortwave [-]"] = 0.6
+    defaults["Beer's law extinction coefficient, longwave [-]"] = 5
 
     if transpiration_model == 'rel perm':
-        lc["maximum xylem capillary pressure [Pa]"] = 2240000
+        defaults["maximum xylem capillary pressure [Pa]"] = 2240000
     elif transpiration_model == 'clm':
-        lc["capillary pressure at fully open stomata [Pa]"] = 3500
-        lc["capillary pressure at fully closed stomata [Pa]"] = 224000
+        defaults["capillary pressure at fully open stomata [Pa]"] = 3500
+        defaults["capillary pressure at fully closed stomata [Pa]"] = 224000
     
-    lc["snow transition depth [m]"] = 0.02
+    defaults["snow transition depth [m]"] = 0.02
     
     # defaults for grass/no vei
-    lc['rooting depth max [m]'] = 5.
-    lc['rooting profile alpha [-]'] = 11.0
-    lc['rooting profile beta [-]'] = 2.0
+    defaults['rooting depth max [m]'] = 5.
+    defaults['rooting profile alpha [-]'] = 11.0
+    defaults['rooting profile beta [-]'] = 2.0
 
     # by default we let the LAI take care of this rather than turn off deciduous 
     # transpiration manually the way that PRMS does it. 
-    lc['leaf on time [doy]'] = -1
-    lc['leaf off time [doy]'] = -1
+    defaults['leaf on time [doy]'] = -1
+    defaults['leaf off time [doy]'] = -1
+    return defaults
+
+def _get_land_cover_list(main):
+    """Gets the land cover types list, adding it if it does not exist."""
+    try:
+        lc_list = main['state']['model parameters']['land cover types']
+    except KeyError:
+        lc_list = known_specs['land-cover-spec-list']
+        main['state']['model parameters']['land cover types'] = lc_list
+    return lc_list
+
+def set_land_cover_default_constants(main, land_cover_name, transpiration_model='clm'):
+    """Adds an empty land cover list, and populates it with "standard" default values."""
+    lc_list = _get_land_cover_list(main)
+    lc = lc_list.append_empty(land_cover_name)
+    lc.update(land_cover_default_constants(transpiration_model))
     return lc
 
 #
@@ -548,9 +560,74 @@ def add_lai_point_evaluators(main, lai_filename, lc_types, crosswalk=None):
         entry_other['component'] = 'cell'
         entry_other_func = entry_other['function'].set_type('constant', known_specs['function-constant-spec'])
         entry_other_func['value'] = 0.
-    
 
-        
+
+#
+# tabular functions from data files
+#
+def _csv_header(fid):
+    """Reads the header line of column names of an open CSV file.
+
+    Names may be quoted, e.g. to contain commas.
+    """
+    names = next(csv.reader([fid.readline().lstrip('#')], skipinitialspace=True))
+    if len(names) == 0:
+        raise ValueError(f'CSV file "{fid.name}" has no header line of column names.')
+    return [name.strip() for name in names]
+
+def read_columns(filename, headers):
+    """Returns a list of numpy arrays, the columns of a data file named by headers.
+
+    .npy files hold a structured array with a field per column, and
+    are memory mapped, so that the columns are views of the file that
+    are only read when written.  .npz files hold one array per column,
+    and CSV files have a header line of column names; only the
+    requested columns are read, by numpy rather than into python
+    floats.
+    """
+    if filename.endswith('.npy'):
+        table = np.load(filename, mmap_mode='r')
+        columns = dict((name, table[name]) for name in (table.dtype.names or ()))
+    elif filename.endswith('.npz'):
+        table = np.load(filename)
+        columns = dict((name, table[name]) for name in headers if name in table.files)
+    else:
+        with open(filename, 'r', newline='') as fid:
+            names = _csv_header(fid)
+        usecols = [names.index(name) for name in headers if name in names]
+        table = np.loadtxt(filename, delimiter=',', skiprows=1, usecols=usecols, ndmin=2)
+        columns = dict((name, table[:,i]) for (i, name) in enumerate(h for h in headers if h in names))
+
+    for name in headers:
+        if name not in columns:
+            raise KeyError(f'Column "{name}" is not in "{filename}"')
+    return [columns[name] for name in headers]
+
+def set_tabular_function(func, x_values, y_values, forms=None):
+    """Sets a function to a tabular function, returning its parameters.
+
+    func is a function TypedSpec, e.g. the "function" of an entry of an
+    independent variable evaluator.  Numpy arrays, including memory
+    mapped ones, are stored and written without copying.
+    """
+    global known_specs
+    ft = func.set_type('tabular', known_specs['function-tabular-spec'])
+    ft['x values'] = x_values
+    ft['y values'] = y_values
+    if forms is not None:
+        ft['forms'] = forms
+    return ft
+
+def set_tabular_function_from_file(func, filename, x_header, y_header, forms=None):
+    """Sets a function to a tabular function of two columns of a data file.
+
+    Unlike the "tabular-fromfile" function, the values are written in
+    the xml.  See read_columns() for the file formats.
+    """
+    x_values, y_values = read_columns(filename, [x_header, y_header])
+    return set_tabular_function(func, x_values, y_values, forms)
+
+
 def add_soil_type(main, region_name, label=None, filename=None, porosity=None, permeability=None, compressibility=None,
                   van_genuchten_alpha=None, van_genuchten_n=None, residual_sat=None, smoothing_interval=None,
                   porosity_key='base_porosity', permeability_key='permeability', compressibility_key='porosity',
@@ -615,3 +692,280 @@ def add_soil_type(main, region_name, label=None, filename=None, porosity=None, p
     
     
                   
+
+
+#
+# Bulk versions of the above, which take tables of values (e.g. one
+# row per soil type) and add all entries in one pass.
+#
+def _table_columns(table):
+    """Returns a dictionary of numpy arrays, one per column of a table.
+
+    table may be a numpy structured array, a pandas DataFrame, a
+    dictionary of sequences, or the filename of a CSV file whose first
+    line is a header of column names, which may be quoted.
+    """
+    if type(table) is str:
+        with open(table, 'r', newline='', encoding='utf-8') as fid:
+            names = _csv_header(fid)
+            table = np.atleast_1d(np.genfromtxt(fid, delimiter=',', names=names, dtype=None,
+                                                encoding='utf-8', deletechars='', replace_space=' ',
+                                                autostrip=True, usemask=True))
+    if isinstance(table, np.ma.MaskedArray):
+        # missing entries become NaN or empty strings
+        columns = dict()
+        for name in table.dtype.names:
+            column = table[name]
+            if not np.ma.is_masked(column):
+                columns[name] = column.data
+            elif column.dtype.kind in 'OUS':
+                columns[name] = column.filled('')
+            else:
+                columns[name] = column.astype(float).filled(np.nan)
+        return columns
+    elif isinstance(table, np.ndarray):
+        return dict((name, table[name]) for name in table.dtype.names)
+    elif hasattr(table, 'columns'):
+        # pandas DataFrame
+        return dict((name, table[name].to_numpy()) for name in table.columns)
+    else:
+        return dict((name, np.asarray(col)) for (name, col) in table.items())
+
+def _present(column):
+    """Mask of the entries of a column that are not missing (NaN, None, or empty)."""
+    if column.dtype.kind == 'f':
+        return ~np.isnan(column)
+    elif column.dtype.kind in 'OUS':
+        return np.array([v is not None and v != '' for v in column.tolist()], dtype=bool)
+    else:
+        return np.ones(len(column), dtype=bool)
+
+def _as_strings(column):
+    """A column as a list of python strings, e.g. for labels read as numbers."""
+    return [str(int(v)) if type(v) is float and v.is_integer() else str(v)
+            for v in column.tolist()]
+
+def _sublist_path(typed_spec):
+    """The path from a TypedSpec whose type is set to its type's parameters."""
+    sublist = typed_spec.get_sublist()
+    if sublist is typed_spec:
+        return ()
+    return (next(p.name for p in typed_spec.parameters() if p.get() is sublist),)
+
+def _append_typed(typed_list, names, typename, typed_spec, columns):
+    """Appends entries, all of one type, to a list of TypedSpecs.
+
+    The type is set once, on a template that all entries copy.
+    columns is a dictionary from parameter names in the type's
+    parameters to either a sequence of values, one per entry, or a
+    scalar value shared by all entries.
+    """
+    template = typed_list.contained_ptype.copy()
+    sublist = template.set_type(typename, typed_spec)
+    path = _sublist_path(template)
+    entry_columns = dict()
+    for k, v in columns.items():
+        if np.ndim(v) == 0:
+            sublist[k] = v
+        else:
+            entry_columns[path+(k,)] = v
+    typed_list.append_columns(names, entry_columns, template)
+
+def add_regions(main, region_type, region_names, **region_args):
+    """Adds many regions of the same type.
+
+    Arguments:
+      region_type       | type of the regions, e.g. "labeled set" or "box"
+      region_names      | names of the regions
+      region_args       | parameters of the region spec, with spaces
+                        |  replaced by underscores (e.g. low_coordinate).
+                        |  Each is either a sequence of values, one per 
+                        |  region (e.g. an (N,3) array of coordinates), or
+                        |  a single value shared by all regions.
+
+    Example usage:
+
+    # labeled sets from a table of labels and names
+    add_regions(main, 'labeled set', names, label=labels, file='mesh.exo',
+                format='Exodus II', entity='CELL')
+
+    # boxes from arrays of corners
+    add_regions(main, 'box', names, low_coordinate=lows, high_coordinate=highs)
+    """
+    global known_specs
+    region_names = _as_strings(np.asarray(region_names))
+    region_args = dict((k.replace('_', ' '), v) for (k,v) in region_args.items())
+    if 'label' in region_args and np.ndim(region_args['label']) > 0:
+        region_args['label'] = _as_strings(np.asarray(region_args['label']))
+    if region_type == 'all':
+        # ugly hack to keep this required but empty list from disappearing...
+        region_args['empty'] = True
+
+    region_type_spec = ats_input_spec.source_reader.to_specname('region '+region_type)
+    _append_typed(main['regions'], region_names, region_type, known_specs[region_type_spec], region_args)
+
+def _get_evaluator(main, key, evaluator_type, evaluator_args=None):
+    """Gets the evaluator key, adding it of evaluator_type if it does not exist."""
+    evals = main['state']['evaluators']
+    if key in evals:
+        return evals[key]
+    fe = evals.append_empty(key)
+    fe.set_type(evaluator_type, known_specs[ats_input_spec.source_reader.to_specname('evaluator '+evaluator_type)])
+    if evaluator_args is not None:
+        fe.update(evaluator_args)
+    return fe
+
+def _add_constant_functions(fe, region_names, values):
+    """Adds one region-constant function entry per region to an evaluator's function list."""
+    func_list = fe['function']
+    template = func_list.contained_ptype.copy()
+    template['component'] = 'cell'
+    template['function'].set_type('constant', known_specs['function-constant-spec'])
+    path = ('function',) + _sublist_path(template['function']) + ('value',)
+    func_list.append_columns(region_names, {'region':region_names, path:values}, template)
+
+def add_soil_types(main, table,
+                   porosity_key='base_porosity', permeability_key='permeability',
+                   compressibility_key='porosity'):
+    """Adds many soil types, given as the rows of a table.
+
+    table may be a numpy structured array, a pandas DataFrame, a
+    dictionary of arrays, or the filename of a CSV file with a header
+    line.  Column names are the arguments of add_soil_type():
+    region_name is required, and all others are optional.  Missing
+    values (NaN or empty) skip that property for that soil type.
+
+    Each evaluator is found or created once, and all of its entries
+    are added together (see TypedCollection.append_columns()).
+    """
+    columns = _table_columns(table)
+    region_names = np.array(_as_strings(columns['region_name']), dtype=object)
+
+    # add the regions
+    if 'label' in columns and 'filename' in columns:
+        mask = _present(columns['label']) & _present(columns['filename'])
+        add_regions(main, 'labeled set', region_names[mask],
+                    label=columns['label'][mask],
+                    file=_as_strings(columns['filename'][mask]),
+                    format='Exodus II',
+                    entity='CELL')
+
+    # add porosity & permeability
+    if 'porosity' in columns:
+        mask = _present(columns['porosity'])
+        fe = _get_evaluator(main, porosity_key, 'independent variable', {'constant in time':True})
+        _add_constant_functions(fe, region_names[mask].tolist(), columns['porosity'][mask])
+    if 'permeability' in columns:
+        mask = _present(columns['permeability'])
+        fe = _get_evaluator(main, permeability_key, 'independent variable tensor',
+                            {'tensor type':'scalar', 'constant in time':True})
+        _add_constant_functions(fe, region_names[mask].tolist(), columns['permeability'][mask])
+
+    # add the entry for pore compressibility
+    if 'compressibility' in columns:
+        mask = _present(columns['compressibility'])
+        fe = _get_evaluator(main, compressibility_key, 'compressible porosity')
+        names = region_names[mask].tolist()
+        fe['compressible porosity model parameters'].append_columns(names,
+                    {'region':names, 'pore compressibility [Pa^-1]':columns['compressibility'][mask]})
+
+    # add the entry for WRM
+    if all(k in columns for k in ['van_genuchten_alpha', 'van_genuchten_n', 'residual_sat']):
+        try:
+            wrm = main['state']['model parameters']['WRM parameters']
+        except KeyError:
+            wrm = known_specs['wrm-typedinline-spec-list']
+            main['state']['model parameters']['WRM parameters'] = wrm
+
+        mask = _present(columns['van_genuchten_alpha']) & _present(columns['van_genuchten_n']) \
+            & _present(columns['residual_sat'])
+        if 'smoothing_interval' in columns:
+            has_smoothing = _present(columns['smoothing_interval'])
+        else:
+            has_smoothing = np.zeros(len(region_names), dtype=bool)
+
+        # entries with and without a smoothing interval are added in runs
+        # of consecutive rows, keeping the order of the table
+        vg_spec = known_specs['wrm-van-genuchten-spec']
+        rows = np.flatnonzero(mask)
+        start = 0
+        while start < len(rows):
+            end = start + 1
+            while end < len(rows) and has_smoothing[rows[end]] == has_smoothing[rows[start]]:
+                end += 1
+            run = rows[start:end]
+            names = region_names[run].tolist()
+            wrm_columns = {'region' : names,
+                           'van Genuchten alpha [Pa^-1]' : columns['van_genuchten_alpha'][run],
+                           'van Genuchten n [-]' : columns['van_genuchten_n'][run],
+                           'residual saturation [-]' : columns['residual_sat'][run]}
+            if has_smoothing[run[0]]:
+                wrm_columns['smoothing interval width [saturation]'] = columns['smoothing_interval'][run]
+            _append_typed(wrm, names, 'van Genuchten', vg_spec, wrm_columns)
+            start = end
+
+
+def _append_table(typed_list, names, columns, template):
+    """Appends one entry per name, with values from table columns.
+
+    Missing values (see _present()) leave that parameter as it is in
+    the template for that entry.  Entries are stored in blocks of
+    consecutive rows that are missing the same columns.
+    """
+    paths = dict()
+    for k in columns:
+        if k in template:
+            paths[k] = (k,)
+        elif k.replace('_', ' ') in template:
+            paths[k] = (k.replace('_', ' '),)
+        else:
+            raise KeyError(f'Column "{k}" is not a parameter of the spec.')
+    int_columns = set(k for k in columns
+                      if ats_input_spec.specs.find_parameter(template, paths[k]).ptype is int)
+
+    present = np.array([_present(columns[k]) for k in columns], dtype=bool).reshape(len(columns), len(names))
+    start = 0
+    while start < len(names):
+        end = start + 1
+        while end < len(names) and (present[:,end] == present[:,start]).all():
+            end += 1
+
+        block_columns = dict()
+        for k, is_present in zip(columns, present[:,start]):
+            if is_present:
+                values = columns[k][start:end]
+                if k in int_columns and values.dtype.kind == 'f' and (values == np.round(values)).all():
+                    values = values.astype(int)
+                block_columns[paths[k]] = values
+        typed_list.append_columns(names[start:end], block_columns, template)
+        start = end
+
+def set_land_cover_types(main, table, defaults=None, transpiration_model='clm'):
+    """Adds many land cover types, given as the rows of a table.
+
+    table may be a numpy structured array, a pandas DataFrame, a
+    dictionary of arrays, or the filename of a CSV file with a header
+    line.  The column land_cover_name is required, all other columns
+    are parameters of the land cover spec (optionally with spaces
+    replaced by underscores).
+
+    Values not in the table, or missing from it (NaN or empty), are
+    taken from defaults, a dictionary that updates the "standard"
+    defaults of land_cover_default_constants(), or otherwise from the
+    spec's defaults.
+
+    Returns the land cover types list.
+    """
+    columns = _table_columns(table)
+    names = _as_strings(columns.pop('land_cover_name'))
+    lc_list = _get_land_cover_list(main)
+
+    # defaults are validated once, on the template
+    template = lc_list.contained_ptype.copy()
+    lc_defaults = land_cover_default_constants(transpiration_model)
+    if defaults is not None:
+        lc_defaults.update(defaults)
+    template.update(lc_defaults)
+
+    _append_table(lc_list, names, columns, template)
+    return lc_list
@@ -0,0 +1,672 @@
+"""ats_input_spec/schema.py
+
+ATS is released under the three-clause BSD License.
+The terms of use and "as is" disclaimer for this license are
+provided in the top-level COPYRIGHT file.
+
+Authors: Ethan Coon (coonet@ornl.gov)
+
+Exports the specs as XML Schema or JSON Schema.
+
+Checking many input files through the Spec object model is slow; these
+schemas let a compiled validator do the same checks: unknown and
+mistyped parameters, required parameters, ONE OF branches, CASE/IF
+switches, typed lists and typed specs.  Defaults are recorded as
+annotations (XSD) or "default" keywords (JSON Schema).
+
+In the xml, every element is a ParameterList or Parameter, and what it
+may contain is set by its name attribute.  XSD 1.0 cannot select a type
+by an attribute, so the XSD uses XSD 1.1 type alternatives and
+assertions, and needs an XSD 1.1 validator (Xerces-J, Saxon, or
+xmlschema's XMLSchema11); lxml/libxml2 only implement XSD 1.0.  The
+JSON Schema (draft 2020-12) checks the JSON form of a file, see
+to_json(), and works with any 2020-12 validator.
+
+Both are built from the unpopulated specs, so each spec is a single
+named definition, and are cached by a hash of the specs they are built
+from, in memory and optionally in a directory.
+"""
+
+import os
+import re
+import json
+import hashlib
+import urllib.parse
+import xml.etree.ElementTree
+
+import ats_input_spec.primitives
+import ats_input_spec.specs
+import ats_input_spec.source_reader
+import ats_input_spec.io
+
+XS = 'http://www.w3.org/2001/XMLSchema'
+VC = 'http://www.w3.org/2007/XMLSchema-versioning'
+xml.etree.ElementTree.register_namespace('xs', XS)
+xml.etree.ElementTree.register_namespace('vc', VC)
+
+# bump when the output changes for the same specs, to miss old caches
+_version = 1
+
+_typed_policies = {'-typed-spec' : 'standard',
+                   '-typedinline-spec' : 'inline',
+                   '-typedsublist-spec' : 'sublist',
+                   '-typedsublistdash-spec' : 'sublistdash'}
+
+
+#
+# A description of the specs shared by both schemas, and hashed for the cache.
+#
+def _describe_parameter(par):
+    desc = {'name' : par.name,
+            'type' : par.ptype_string,
+            'primitive' : par.is_primitive(),
+            'optional' : par.is_optional()}
+    if not par.is_primitive() and type(par.ptype) is not str:
+        # the value was given in place of a spec name, describe it as open
+        desc['type'] = 'list'
+    if par.default is not None:
+        desc['default'] = par.default
+    return desc
+
+def _describe_entries(container):
+    """List of parameter, ONE OF, and CASE descriptions in container."""
+    if isinstance(container, ats_input_spec.specs.ParameterCollection):
+        return [_describe_parameter(p) for p in container.parameters()]
+
+    entries = []
+    for coll in container.collections:
+        if isinstance(coll, ats_input_spec.specs.OneOf):
+            entries.append({'one of' : [_describe_entries(b) for b in coll.collections]})
+        elif isinstance(coll, ats_input_spec.specs.CaseSwitch):
+            entries.append({'case' : _describe_parameter(coll.case),
+                            'branches' : [[value, _describe_entries(b)]
+                                          for (value, b) in coll.branches.items()]})
+        else:
+            entries.extend(_describe_entries(coll))
+    return entries
+
+def _typed_choices(known_specs, my_type):
+    """Dictionary of typename to spec name for the types of my_type.
+
+    These are the specs io.read() would use, e.g. "function-constant-spec"
+    for the "constant" type of "function".  As in io.read(), the spec
+    name may also be used as the type.
+    """
+    prefix = ats_input_spec.source_reader.to_specname(my_type)[:-len('spec')]
+    keys = [key for key in sorted(known_specs) if key.startswith(prefix) and key.endswith('-spec')
+            and '-typed' not in key and len(key) > len(prefix) + len('spec')]
+    choices = dict((key[len(prefix):-len('-spec')].replace(ats_input_spec.specs.DELIMITER, ' '), key)
+                   for key in keys)
+    choices.update((key, key) for key in keys)
+    return choices
+
+def _describe(known_specs, key):
+    if key.endswith('-list'):
+        return {'kind' : 'typed list', 'contains' : key[:-len('-list')]}
+
+    try:
+        spec = known_specs.construct(key, populate=False)
+    except KeyError:
+        # missing specs are not checked, as when reading
+        return {'kind' : 'list', 'open' : True, 'entries' : []}
+
+    if isinstance(spec, ats_input_spec.specs.TypedSpec):
+        policy = next(p for (suffix, p) in _typed_policies.items() if key.endswith(suffix))
+        others = [] if spec.others is None else _describe_entries(spec.others)
+        return {'kind' : 'typed', 'type' : spec.type, 'policy' : policy, 'others' : others,
+                'choices' : _typed_choices(known_specs, spec.type)}
+
+    is_open = type(spec) is ats_input_spec.specs.ParameterCollection and \
+        spec._policy_not_in_spec != 'error'
+    return {'kind' : 'list', 'open' : is_open, 'entries' : _describe_entries(spec)}
+
+def _parameters(entries):
+    """Generator for all parameter descriptions in entries."""
+    for entry in entries:
+        if 'one of' in entry:
+            for branch in entry['one of']:
+                yield from branch
+        elif 'case' in entry:
+            yield entry['case']
+            for value, branch in entry['branches']:
+                yield from branch
+        else:
+            yield entry
+
+def _references(desc):
+    if desc['kind'] == 'typed list':
+        return [desc['contains'],]
+    elif desc['kind'] == 'typed':
+        entries = desc['others']
+        refs = list(desc['choices'].values())
+    else:
+        entries = desc['entries']
+        refs = []
+    return refs + [p['type'] for p in _parameters(entries) if not p['primitive']]
+
+def _model(known_specs, spec):
+    """Dictionary of spec name to description for all specs used by spec."""
+    defs = {}
+    todo = [spec,]
+    while len(todo) > 0:
+        key = todo.pop()
+        if key not in defs:
+            defs[key] = _describe(known_specs, key)
+            todo.extend(_references(defs[key]))
+    return dict(sorted(defs.items()))
+
+def spec_hash(known_specs, spec='main-spec'):
+    """A hash of everything in known_specs used by spec."""
+    return _hash(_model(known_specs, spec), spec)
+
+def _hash(model, spec):
+    text = json.dumps([_version, spec, model], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+#
+# Completeness, shared by both schemas.
+#
+def _can_be_empty(model, key, seen=None):
+    """Is the spec key complete with nothing in it?  See Parameter.is_complete()."""
+    if seen is None:
+        seen = set()
+    if key in seen:
+        return False
+    seen = seen | {key,}
+
+    desc = model[key]
+    if desc['kind'] != 'list' or len(desc['entries']) == 0:
+        # typed lists, typed specs, and empty lists are incomplete when empty
+        return False
+    for entry in desc['entries']:
+        if 'one of' in entry:
+            if not any(all(not _required(model, p, seen) for p in branch) for branch in entry['one of']):
+                return False
+        elif 'case' in entry:
+            case = entry['case']
+            if 'default' not in case:
+                return False
+            branch = next((b for (v, b) in entry['branches'] if v == case['default']), [])
+            if any(_required(model, p, seen) for p in branch):
+                return False
+        elif _required(model, entry, seen):
+            return False
+    return True
+
+def _required(model, par, seen=None):
+    """Must par be in the file?"""
+    if par['optional']:
+        return False
+    return par['primitive'] or not _can_be_empty(model, par['type'], seen)
+
+
+#
+# JSON Schema
+#
+_json_primitives = {'double' : 'number',
+                    'int' : 'integer',
+                    'string' : 'string',
+                    'bool' : 'boolean'}
+
+def _json_ref(key):
+    pointer = key.replace('~', '~0').replace('/', '~1')
+    return {'$ref' : '#/$defs/' + urllib.parse.quote(pointer)}
+
+def _json_parameter(par):
+    if not par['primitive']:
+        schema = _json_ref(par['type'])
+    elif par['type'].startswith('Array('):
+        schema = {'type' : 'array', 'items' : {'type' : _json_primitives[par['type'][len('Array('):-1]]}}
+    else:
+        schema = {'type' : _json_primitives[par['type']]}
+    if 'default' in par:
+        schema['default'] = par['default']
+    return schema
+
+def _json_none_of(names):
+    return {'not' : {'anyOf' : [{'required' : [name,]} for name in names]}}
+
+def _json_entries(model, entries):
+    """Properties, required, and allOf keywords for entries."""
+    properties = {}
+    required = []
+    all_of = []
+    for entry in entries:
+        if 'one of' in entry:
+            branches = [[p['name'] for p in branch] for branch in entry['one of']]
+            any_of = []
+            for branch, names in zip(entry['one of'], branches):
+                others = [n for b in branches if b is not names for n in b if n not in names]
+                schema = {'required' : [p['name'] for p in branch if _required(model, p)]}
+                if len(others) > 0:
+                    schema.update(_json_none_of(others))
+                any_of.append(schema)
+            all_of.append({'anyOf' : any_of})
+            pars = [p for branch in entry['one of'] for p in branch]
+
+        elif 'case' in entry:
+            case = entry['case']
+            case_schema = _json_parameter(case)
+            case_schema['enum'] = [v for (v, b) in entry['branches']]
+            properties[case['name']] = case_schema
+            if _required(model, case):
+                required.append(case['name'])
+
+            for value, branch in entry['branches']:
+                names = [p['name'] for p in branch]
+                others = [n for (v, b) in entry['branches'] if v != value
+                          for n in (p['name'] for p in b) if n not in names]
+                condition = {'properties' : {case['name'] : {'const' : value}}}
+                if case.get('default') != value:
+                    condition['required'] = [case['name'],]
+                then = {'required' : [p['name'] for p in branch if _required(model, p)]}
+                if len(others) > 0:
+                    then.update(_json_none_of(others))
+                all_of.append({'if' : condition, 'then' : then})
+            pars = [p for (v, b) in entry['branches'] for p in b]
+
+        else:
+            if _required(model, entry):
+                required.append(entry['name'])
+            pars = [entry,]
+
+        for p in pars:
+            properties.setdefault(p['name'], _json_parameter(p))
+
+    schema = {'type' : 'object', 'properties' : properties}
+    if len(required) > 0:
+        schema['required'] = required
+    if len(all_of) > 0:
+        schema['allOf'] = all_of
+    return schema
+
+def _sublist_names(desc):
+    """The prefix and names of the sublists of a sublist policy typed spec."""
+    if desc['policy'] == 'sublist':
+        prefix = desc['type']+': '
+        return prefix, [prefix+typename for typename in desc['choices']]
+    prefix = (desc['type']+ats_input_spec.specs.DELIMITER).replace(' ', ats_input_spec.specs.DELIMITER)
+    return prefix, [(prefix+typename).replace(' ', ats_input_spec.specs.DELIMITER)
+                    for typename in desc['choices']]
+
+def _json_typed(model, desc):
+    schema = _json_entries(model, desc['others'])
+    all_of = schema.setdefault('allOf', [])
+    choices = desc['choices']
+    closed = True
+
+    if desc['policy'] in ['standard', 'inline']:
+        type_name = desc['type']+' type'
+        type_schema = {'type' : 'string'}
+        if len(choices) > 0:
+            type_schema['enum'] = list(choices.keys())
+        schema['properties'][type_name] = type_schema
+        schema.setdefault('required', []).append(type_name)
+
+    if desc['policy'] == 'standard':
+        names = dict((typename, typename+' parameters') for typename in choices)
+        for typename, key in choices.items():
+            schema['properties'][names[typename]] = _json_ref(key)
+            all_of.append({'if' : {'properties' : {type_name : {'const' : typename}}},
+                           'then' : {'properties' : dict((name, False) for (t, name) in names.items()
+                                                         if t != typename)}})
+        if len(choices) == 0:
+            schema['patternProperties'] = {' parameters$' : {'type' : 'object'}}
+
+    elif desc['policy'] == 'inline':
+        for typename, key in choices.items():
+            if model[key]['kind'] == 'list':
+                then = _json_entries(model, model[key]['entries'])
+                closed = closed and not model[key]['open']
+            else:
+                then = {}
+                closed = False
+            all_of.append({'if' : {'properties' : {type_name : {'const' : typename}}},
+                           'then' : then})
+        closed = closed and len(choices) > 0
+
+    else:
+        prefix, names = _sublist_names(desc)
+        for name, key in zip(names, choices.values()):
+            schema['properties'][name] = _json_ref(key)
+        if len(choices) == 0:
+            schema['patternProperties'] = {'^'+re.escape(prefix) : {'type' : 'object'}}
+            all_of.append({'minProperties' : 1})
+        else:
+            all_of.append({'oneOf' : [{'required' : [name,]} for name in names]})
+
+    if len(all_of) == 0:
+        schema.pop('allOf')
+    if closed:
+        schema['unevaluatedProperties'] = False
+    return schema
+
+def _json_definition(model, desc):
+    if desc['kind'] == 'typed list':
+        return {'type' : 'object', 'additionalProperties' : _json_ref(desc['contains'])}
+    elif desc['kind'] == 'typed':
+        return _json_typed(model, desc)
+    else:
+        schema = _json_entries(model, desc['entries'])
+        if not desc['open']:
+            schema['unevaluatedProperties'] = False
+        return schema
+
+def _render_json(model, spec):
+    schema = {'$schema' : 'https://json-schema.org/draft/2020-12/schema'}
+    schema.update(_json_ref(spec))
+    schema['$defs'] = dict((key, _json_definition(model, desc)) for (key, desc) in model.items())
+    return json.dumps(schema, indent=1)
+
+
+def to_json(filename):
+    """Returns the JSON form of an xml input file, to check with to_json_schema().
+
+    Each ParameterList is an object and each Parameter its value.
+    """
+    return _json_list(xml.etree.ElementTree.parse(filename).getroot())
+
+def _json_list(elem):
+    result = {}
+    for child in elem:
+        name = child.get('name')
+        if child.tag == 'ParameterList':
+            result[name] = _json_list(child)
+        else:
+            try:
+                ptype = ats_input_spec.primitives.text_to_primitive[child.get('type')]
+            except KeyError:
+                raise ValueError(f'Parameter "{name}" has invalid type "{child.get("type")}".')
+            result[name] = ats_input_spec.io._parse_value(ptype, child.get('value'))
+    return result
+
+
+#
+# XML Schema 1.1
+#
+_number = r'[+\-]?(\d+(\.\d*)?|\.\d+)([eE][+\-]?\d+)?|[+\-]?([iI][nN][fF]|[nN][aA][nN])'
+_integer = r'[+\-]?\d+(\.0*)?([eE]\+?\d+)?'
+_bool = r'true|True|TRUE|false|False|FALSE'
+
+def _array(pattern):
+    return r'\s*\{\s*((' + pattern + r')(\s*,\s*(' + pattern + r'))*)?\s*\}\s*'
+
+_xsd_patterns = {'double' : r'\s*(' + _number + r')\s*',
+                 'int' : r'\s*(' + _integer + r')\s*',
+                 'bool' : _bool,
+                 'string' : None,
+                 'Array(double)' : _array(_number),
+                 'Array(int)' : _array(_integer),
+                 'Array(bool)' : _array(_bool),
+                 'Array(string)' : r'\s*\{.*\}\s*'}
+
+def _xsd_name(name):
+    """A valid type name: spec names are, other than the helpers' dots."""
+    name = re.sub(r'[^\w.\-]', '.', name)
+    if not (name[0].isalpha() or name[0] == '_'):
+        name = '_' + name
+    return name
+
+def _xsd_parameter_type(ptype_string):
+    return 'Parameter.' + _xsd_name(ptype_string)
+
+def _xpath_string(string):
+    return "'" + string.replace("'", "''") + "'"
+
+def _xpath_names(names):
+    return '(' + ', '.join(_xpath_string(n) for n in names) + ')'
+
+def _xpath_has(names):
+    """Are any of names in the list?"""
+    return f'exists(*[@name = {_xpath_names(names)}])'
+
+def _xpath_has_all(names):
+    if len(names) == 0:
+        return 'true()'
+    return ' and '.join(f'exists(*[@name = {_xpath_string(n)}])' for n in names)
+
+def _xpath_value(value):
+    if type(value) is bool:
+        return _xpath_string(ats_input_spec.primitives.string_from_primitive(value))
+    return _xpath_string(str(value))
+
+def _xs(parent, tag, **attrib):
+    return xml.etree.ElementTree.SubElement(parent, f'{{{XS}}}{tag}', attrib)
+
+def _xsd_asserts(model, entries):
+    """XPath tests for the required, ONE OF, and CASE entries."""
+    tests = []
+    for entry in entries:
+        if 'one of' in entry:
+            branches = [[p['name'] for p in branch] for branch in entry['one of']]
+            used = []
+            for branch, names in zip(entry['one of'], branches):
+                own = [n for n in names if not any(n in b for b in branches if b is not names)]
+                if len(own) > 0:
+                    used.append(_xpath_has(own))
+                    tests.append(f'not({used[-1]}) or ' +
+                                 f'({_xpath_has_all([p["name"] for p in branch if _required(model, p)])})')
+            if len(used) > 1:
+                tests.append(f'count(({", ".join(used)})[.]) le 1')
+            if all(any(_required(model, p) for p in branch) for branch in entry['one of']):
+                tests.append(' or '.join(f'({_xpath_has_all([p["name"] for p in branch if _required(model, p)])})'
+                                         for branch in entry['one of']))
+
+        elif 'case' in entry:
+            case = entry['case']
+            attribute = f'*[@name = {_xpath_string(case["name"])}]/@value'
+            value = f'lower-case({attribute})' if case['type'] == 'bool' else attribute
+            all_names = [p['name'] for (v, b) in entry['branches'] for p in b]
+            if _required(model, case):
+                tests.append(f'exists({attribute}) or not({_xpath_has(all_names)})')
+            if case['type'] != 'bool':
+                tests.append(f'not(exists({attribute})) or {value} = '
+                             f'{_xpath_names(str(v) for (v, b) in entry["branches"])}')
+            for v, branch in entry['branches']:
+                names = [p['name'] for p in branch]
+                condition = f'{value} = {_xpath_value(v)}'
+                if case.get('default') == v:
+                    condition = f'not(exists({attribute})) or {condition}'
+                test = _xpath_has_all([p['name'] for p in branch if _required(model, p)])
+                others = [n for n in all_names if n not in names]
+                if len(others) > 0:
+                    test = f'{test} and not({_xpath_has(others)})'
+                tests.append(f'not({condition}) or ({test})')
+
+        elif _required(model, entry):
+            tests.append(f'exists(*[@name = {_xpath_string(entry["name"])}])')
+    return tests
+
+def _xsd_element(content, tag, alternatives, default):
+    """A Parameter or ParameterList child element, typed by name.
+
+    alternatives is a dictionary of name to type, or None when names of
+    different types collide.  default is the type of any other name, or
+    xs:error.
+    """
+    element = _xs(content, 'element', name=tag)
+    for name, xsd_type in alternatives.items():
+        _xs(element, 'alternative', test=f'@name = {_xpath_string(name)}',
+            type=tag if xsd_type is None else xsd_type)
+    _xs(element, 'alternative', type=default)
+    return element
+
+def _xsd_alternatives(pars):
+    """Parameter and ParameterList dictionaries of name to type."""
+    parameters = dict()
+    lists = dict()
+    for p in pars:
+        if p['primitive']:
+            xsd_type = _xsd_parameter_type(p['type'])
+            alternatives = parameters
+        else:
+            xsd_type = _xsd_name(p['type'])
+            alternatives = lists
+        if p['name'] in alternatives and alternatives[p['name']] != xsd_type:
+            alternatives[p['name']] = None
+        else:
+            alternatives[p['name']] = xsd_type
+    return parameters, lists
+
+def _xsd_list_type(schema, name, parameters, lists, is_open, tests, documentation=None):
+    """A ParameterList type.
+
+    parameters and lists are dictionaries for _xsd_element(), or None
+    if not allowed, or lists is the type of all lists in it.
+    """
+    ctype = _xs(schema, 'complexType', name=name)
+    if documentation is not None:
+        _xs(_xs(ctype, 'annotation'), 'documentation').text = documentation
+    content = _xs(ctype, 'choice', minOccurs='0', maxOccurs='unbounded')
+    if parameters is not None:
+        _xsd_element(content, 'Parameter', parameters, 'Parameter' if is_open else 'xs:error')
+    if type(lists) is str:
+        _xs(content, 'element', name='ParameterList', type=lists)
+    elif lists is not None:
+        _xsd_element(content, 'ParameterList', lists, 'ParameterList' if is_open else 'xs:error')
+    _xs(ctype, 'attribute', name='name', type='xs:string', use='required')
+    _xs(ctype, 'attribute', name='type', type='xs:string', fixed='ParameterList')
+    _xs(ctype, 'assert', test='count(*/@name) = count(distinct-values(*/@name))')
+    for test in tests:
+        _xs(ctype, 'assert', test=test)
+    return ctype
+
+def _xsd_defaults(pars):
+    defaults = [f'"{p["name"]}" default: {ats_input_spec.primitives.string_from_primitive(p["default"])}'
+                for p in pars if 'default' in p]
+    return None if len(defaults) == 0 else '\n'.join(defaults)
+
+def _xsd_typed(schema, model, key, desc):
+    pars = list(_parameters(desc['others']))
+    tests = _xsd_asserts(model, desc['others'])
+    choices = desc['choices']
+    is_open = False
+
+    if desc['policy'] in ['standard', 'inline']:
+        type_name = desc['type']+' type'
+        pars.append({'name' : type_name, 'type' : 'string', 'primitive' : True, 'optional' : False})
+        value = f'*[@name = {_xpath_string(type_name)}]/@value'
+        tests.append(f'exists({value})')
+        if len(choices) > 0:
+            tests.append(f'{value} = {_xpath_names(choices)}')
+
+    if desc['policy'] == 'standard':
+        names = [typename+' parameters' for typename in choices]
+        pars.extend({'name' : name, 'type' : choice, 'primitive' : False, 'optional' : True}
+                    for (name, choice) in zip(names, choices.values()))
+        if len(choices) > 0:
+            tests.append(f'every $l in ParameterList[@name = {_xpath_names(names)}] '
+                         f"satisfies $l/@name = concat({value}, ' parameters')")
+        else:
+            is_open = True
+
+    elif desc['policy'] == 'inline':
+        for typename, choice in choices.items():
+            condition = f'not({value} = {_xpath_string(typename)})'
+            if model[choice]['kind'] != 'list':
+                is_open = True
+                continue
+            entries = model[choice]['entries']
+            pars.extend(_parameters(entries))
+            tests.extend(f'{condition} or ({test})' for test in _xsd_asserts(model, entries))
+            if not model[choice]['open']:
+                allowed = [p['name'] for p in _parameters(desc['others'] + entries)] + [type_name,]
+                tests.append(f'{condition} or (every $c in * satisfies $c/@name = {_xpath_names(allowed)})')
+        is_open = is_open or len(choices) == 0
+
+    else:
+        prefix, names = _sublist_names(desc)
+        pars.extend({'name' : name, 'type' : choice, 'primitive' : False, 'optional' : True}
+                    for (name, choice) in zip(names, choices.values()))
+        if len(choices) > 0:
+            tests.append(f'count(ParameterList[@name = {_xpath_names(names)}]) = 1')
+        else:
+            tests.append(f'count(ParameterList[starts-with(@name, {_xpath_string(prefix)})]) = 1')
+            is_open = True
+
+    parameters, lists = _xsd_alternatives(pars)
+    _xsd_list_type(schema, _xsd_name(key), parameters, lists, is_open, tests, _xsd_defaults(pars))
+
+def _render_xsd(model, spec):
+    schema = xml.etree.ElementTree.Element(f'{{{XS}}}schema', {f'{{{VC}}}minVersion' : '1.1'})
+    _xs(_xs(schema, 'annotation'), 'documentation').text = \
+        f'ATS input spec "{spec}", spec hash {_hash(model, spec)}.'
+    _xs(schema, 'element', name='ParameterList', type=_xsd_name(spec))
+
+    # primitive values and parameters
+    for ptype_string, pattern in _xsd_patterns.items():
+        value_type = 'xs:string'
+        if pattern is not None:
+            value_type = 'value.' + _xsd_name(ptype_string)
+            restriction = _xs(_xs(schema, 'simpleType', name=value_type), 'restriction', base='xs:string')
+            _xs(restriction, 'pattern', value=pattern)
+        ctype = _xs(schema, 'complexType', name=_xsd_parameter_type(ptype_string))
+        _xs(ctype, 'attribute', name='name', type='xs:string', use='required')
+        _xs(ctype, 'attribute', name='type', type='xs:string', use='required', fixed=ptype_string)
+        _xs(ctype, 'attribute', name='value', type=value_type, use='required')
+
+    # unchecked parameters and lists, e.g. in an open list
+    ctype = _xs(schema, 'complexType', name='Parameter')
+    for attribute in ['name', 'type', 'value']:
+        _xs(ctype, 'attribute', name=attribute, type='xs:string', use='required')
+    _xsd_list_type(schema, 'ParameterList', {}, {}, True, [])
+
+    for key, desc in model.items():
+        if desc['kind'] == 'typed list':
+            _xsd_list_type(schema, _xsd_name(key), None, _xsd_name(desc['contains']), False, [],
+                           f'A list of "{desc["contains"]}".')
+        elif desc['kind'] == 'typed':
+            _xsd_typed(schema, model, key, desc)
+        else:
+            pars = list(_parameters(desc['entries']))
+            parameters, lists = _xsd_alternatives(pars)
+            _xsd_list_type(schema, _xsd_name(key), parameters, lists, desc['open'],
+                           _xsd_asserts(model, desc['entries']), _xsd_defaults(pars))
+
+    xml.etree.ElementTree.indent(schema, '  ')
+    return xml.etree.ElementTree.tostring(schema, encoding='unicode') + '\n'
+
+
+#
+# Cached entry points
+#
+_cache = dict()
+
+def _cached_schema(extension, render, known_specs, spec, cache_dir):
+    model = _model(known_specs, spec)
+    key = (extension, _hash(model, spec))
+    filename = None if cache_dir is None else os.path.join(cache_dir, f'{key[1]}.{extension}')
+
+    if key in _cache:
+        text = _cache[key]
+    elif filename is not None and os.path.isfile(filename):
+        with open(filename, 'r') as fid:
+            text = fid.read()
+    else:
+        text = render(model, spec)
+    _cache[key] = text
+
+    if filename is not None and not os.path.isfile(filename):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fid:
+            fid.write(text)
+        os.replace(tmp, filename)
+    return text
+
+def to_xsd(known_specs, spec='main-spec', cache_dir=None):
+    """Returns an XSD 1.1 schema, as a string, for files of spec.
+
+    The schema is cached by the hash of the specs, see spec_hash(), and
+    if cache_dir is given also stored there as HASH.xsd.
+    """
+    return _cached_schema('xsd', _render_xsd, known_specs, spec, cache_dir)
+
+def to_json_schema(known_specs, spec='main-spec', cache_dir=None):
+    """Returns a JSON Schema, as a dictionary, for the JSON form of files of spec.
+
+    See to_json() for the JSON form of a file.  The schema is cached as
+    in to_xsd(), as HASH.json.
+    """
+    return json.loads(_cached_schema('json', _render_json, known_specs, spec, cache_dir))
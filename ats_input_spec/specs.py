@@ -11,18 +11,315 @@ Definitions of types that are collections of other parameters.
 """
 
 import collections.abc
+import numpy as np
 import ats_input_spec.primitives
 import ats_input_spec.colors
 import ats_input_spec.printing
 import copy
+import hashlib
+import functools
+import contextlib
 import warnings
 import itertools
+import weakref
 
 DELIMITER = '-'
 
+#
+# Objects cache their xml when written with io.write(cache=True).  That
+# links each object to its container, so that a change clears the cache
+# of everything containing it.  While the xml is cached, is_complete()
+# is cached as well.
+#
+def _invalidate(node):
+    """Clears the cached xml of node and everything containing it.
+
+    In a transaction, this is deferred until a cache is next used.
+    """
+    if _deferred is not None:
+        if node is not None:
+            _deferred[id(node)] = node
+        return
+    while node is not None:
+        node._xml_cache = None
+        node._complete_cache = None
+        node._hash_cache = None
+        node = node._xml_parent
+
+def _uncached(new):
+    """Drops the cached xml and container link copied into new."""
+    d = new.__dict__
+    if '_xml_parent' in d or '_xml_cache' in d:
+        d.pop('_xml_cache', None)
+        d.pop('_complete_cache', None)
+        d.pop('_xml_parent', None)
+    return new
+
+def _cached_complete(is_complete):
+    """Decorates is_complete() to cache its result while the xml is cached."""
+    @functools.wraps(is_complete)
+    def cached_is_complete(self):
+        if _deferred:
+            _flush_deferred()
+        if self._xml_cache is None:
+            return is_complete(self)
+        if self._complete_cache is None:
+            self._complete_cache = is_complete(self)
+        return self._complete_cache
+    return cached_is_complete
+
+
+#
+# Structural hashing.  Containers cache their digest, and link their
+# entries to themselves as when caching xml, so that a change clears the
+# digest of everything containing it.  Copies keep the digest.
+#
+def _digest(parts):
+    """A stable digest of an iterable of strings, numbers, bytes, digests, and tuples of these.
+
+    The parts are hashed one at a time, rather than as one tuple, so
+    that hashing a long list does not keep many objects alive and
+    trigger the garbage collector.  A repr() has no newlines.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(repr(part).encode('utf-8'))
+        h.update(b'\n')
+    return h.digest()
+
+# dtypes that lists and arrays of numbers are hashed as, so that a list
+# and an array of the same values are equal
+_digest_dtypes = {ats_input_spec.primitives.ListFloat : '<f8',
+                  ats_input_spec.primitives.ListInt : '<i8'}
+
+def _value_key(ptype, value):
+    """A value, or the digest of a list of numbers, for use in _digest()."""
+    if ptype in _digest_dtypes and type(value) is not ats_input_spec.primitives.Placeholder:
+        array = np.ascontiguousarray(value, dtype=_digest_dtypes[ptype])
+        return hashlib.blake2b(array.tobytes(), digest_size=16).digest()
+    return value
+
+def _link_all(value):
+    """Links everything in value to its container, see _invalidate()."""
+    value._link_xml_parents()
+    for p in value.parameters():
+        if not p.is_primitive() and p.value is not None:
+            _link_all(p.value)
+
+def _relink(new):
+    """Links the entries of a copy that kept its digest, see _Hashable."""
+    if new._hash_cache is not None:
+        new._link_xml_parents()
+    return new
+
+
+class _Hashable(object):
+    """Comparison by structure: names, types, defaults, optional flags,
+    values, and branch selections.
+
+    Equal digests are taken to be equal structures.  These objects are
+    mutable, so == and hash() are left as for their base classes; use
+    same_as() to compare structures, and structural_hash() as a key.
+    """
+    _hash_cache = None
+
+    def _structural_digest(self):
+        if _deferred:
+            _flush_deferred()
+        if self._hash_cache is None:
+            self._link_xml_parents()
+            self._hash_cache = _digest(itertools.chain((type(self).__name__,), self._digest_parts()))
+        return self._hash_cache
+
+    def structural_hash(self):
+        """A hex string hash of the structure, stable across processes."""
+        return self._structural_digest().hex()
+
+    def same_as(self, other):
+        """True if other has the same structure as self."""
+        if other is self:
+            return True
+        return type(other) is type(self) and \
+            self._structural_digest() == other._structural_digest()
+
+
+#
+# Transactions.  While a snapshot is open, each change records how to
+# undo it, so that a snapshot costs nothing and restoring it costs the
+# number of changes since.  Clearing caches is deferred meanwhile, and
+# done once per changed object when a cache is used or on commit.
+#
+# Snapshots are of the whole process, not of one main: the undo log and
+# the deferred caches are module globals.  While one is open, changes
+# to every spec object are recorded, including other mains and objects
+# a SpecDict constructs, and restore() undoes all of them.  Deferring
+# the clearing of caches of other mains does not change what they
+# write, as caches are cleared before they are used.  So these are
+# module functions only, not methods of a main, which would imply a
+# scope they do not have.  Snapshots are not thread safe.
+#
+_undo_log = None
+_open_snapshots = 0
+_deferred = None
+
+def _record(undo, *args):
+    """Records undo(*args) in the undo log, if a snapshot is open."""
+    if _undo_log is not None:
+        _undo_log.append((undo, args))
+
+def _flush_deferred():
+    """Does the deferred clearing of caches, see _invalidate()."""
+    global _deferred
+    nodes = _deferred
+    _deferred = None
+    for node in nodes.values():
+        _invalidate(node)
+    _deferred = dict()
+
+def _undo_setattr(obj, name, value, node):
+    setattr(obj, name, value)
+    _invalidate(node)
+
+def _undo_set(par, value):
+    # the container may have been linked since the change
+    par.value = value
+    _invalidate(par._xml_parent)
+
+def _undo_insert(collection, names):
+    for k in names:
+        del collection._pars[k]
+    _invalidate(collection)
+
+def _undo_delete(collection, k, par, index):
+    items = list(collection._pars.items())
+    items.insert(index, (k, par))
+    collection._pars.clear()
+    collection._pars.update(items)
+    _invalidate(collection)
+
+def _undo_collections(spec, collections):
+    spec.collections[:] = collections
+    _invalidate(spec)
+
+def snapshot():
+    """Starts recording changes to all spec objects, returning a token for restore().
+
+    Changes to every spec object in the process are recorded, not just
+    those of one main.  Each snapshot must be ended with commit().
+    """
+    global _undo_log, _open_snapshots, _deferred
+    if _undo_log is None:
+        _undo_log = []
+        _deferred = dict()
+    _open_snapshots += 1
+    return (_undo_log, len(_undo_log))
+
+def _check_token(token):
+    if token[0] is not _undo_log or len(_undo_log) < token[1]:
+        raise ValueError('Snapshot has been committed, or restored past.')
+
+def restore(token):
+    """Undoes all changes to spec objects made since snapshot() returned token.
+
+    This includes changes to every main, not just the one being edited.
+    The snapshot stays open, and may be restored again.
+    """
+    _check_token(token)
+    log, position = token
+    while len(log) > position:
+        undo, args = log.pop()
+        undo(*args)
 
-class Parameter(object):
+def commit(token):
+    """Ends a snapshot, keeping the changes.
+
+    When the last snapshot is ended, changes are no longer recorded and
+    deferred cache clearing is done.
+    """
+    global _undo_log, _open_snapshots, _deferred
+    _check_token(token)
+    _open_snapshots -= 1
+    if _open_snapshots == 0:
+        _undo_log = None
+        deferred = _deferred
+        _deferred = None
+        for node in deferred.values():
+            _invalidate(node)
+
+@contextlib.contextmanager
+def transaction():
+    """A context in which changes are undone if an exception is raised.
+
+    As for snapshot(), changes to all spec objects are undone, not just
+    those of one main.  Yields the snapshot token, so that changes can also be undone
+    explicitly with restore().
+    """
+    token = snapshot()
+    try:
+        yield token
+    except BaseException:
+        restore(token)
+        raise
+    finally:
+        commit(token)
+
+
+#
+# Pickling.  Objects constructed by a SpecDict remember their spec name,
+# and pickle as it and the values set in them, much like their xml,
+# rather than as every entry, default, and branch of the spec.  They
+# are rebuilt from a SpecDict of the unpickling process for which the
+# spec has the same schema.spec_hash().  As with xml, only values are
+# kept, not changes made to the spec itself.
+#
+_spec_dicts = []
+
+def _live_spec_dict(spec_name, spec_hash):
+    for ref in list(_spec_dicts):
+        known_specs = ref()
+        if known_specs is None:
+            _spec_dicts.remove(ref)
+        elif known_specs._spec_hash(spec_name) == spec_hash:
+            return known_specs
+    return None
+
+def _find_spec_dict(spec_name, spec_hash):
+    """A SpecDict of this process in which spec_name has spec_hash."""
+    known_specs = _live_spec_dict(spec_name, spec_hash)
+    if known_specs is None:
+        # the specs of this package are loaded when first needed
+        import ats_input_spec.public
+        known_specs = _live_spec_dict(spec_name, spec_hash)
+    if known_specs is None:
+        raise ValueError(f'No specs in this process match those "{spec_name}" was pickled with.')
+    return known_specs
+
+
+class _Pickled(object):
+    """Pickling by spec name and values, for objects constructed by a SpecDict.
+
+    Copying with the copy module is the same as copy().
+    """
+    def __reduce_ex__(self, protocol):
+        source = self.__dict__.get('_spec_source')
+        if source is None:
+            return super().__reduce_ex__(protocol)
+        import ats_input_spec.io
+        known_specs, spec_name = source
+        return (ats_input_spec.io._rehydrate,
+                (spec_name, known_specs._spec_hash(spec_name), ats_input_spec.io._compact(self)))
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+
+class Parameter(_Hashable):
     """An entry, consisting of a name, type, metadata, and value."""
+    _xml_parent = None
+
     def __init__(self, name, ptype=None, default=None, optional=False, value=None):
         self.name = name
 
@@ -113,10 +410,12 @@ class Parameter(object):
     def set(self, value):
         """Sets value with type checking."""
         if self.is_primitive():
-            self.value = ats_input_spec.primitives.valid_from_type(self.ptype, value)
-        else:
-            # no type checking to be done
-            self.value = value
+            value = ats_input_spec.primitives.valid_from_type(self.ptype, value)
+        if _undo_log is not None:
+            _record(_undo_set, self, self.value)
+        self.value = value
+        if self._xml_parent is not None:
+            _invalidate(self._xml_parent)
 
     def get(self):
         """Gets a value, substituting the default."""
@@ -150,26 +449,55 @@ class Parameter(object):
             return self.is_optional() or \
                 (self.value is not None and self.value.is_complete())
 
+    def _digest_key(self):
+        """The tuple that is hashed, see _Hashable."""
+        value = self.value
+        if value is None:
+            key = (self.name, self.ptype_string, self._optional, True)
+        elif not self._primitive:
+            key = (self.name, self.ptype_string, self._optional, False, value._structural_digest())
+        else:
+            key = (self.name, self.ptype_string, self._optional, False, _value_key(self.ptype, value))
+        if self.default is not None:
+            key = key + (_value_key(self.ptype, self.default),)
+        return key
+
+    def _structural_digest(self):
+        # not cached, a change to the value clears the container's digest
+        return _digest(('Parameter', self._digest_key()))
+
     def copy(self):
         """A deep copy of self"""
-        if self.is_primitive():
-            return Parameter(self.name, self.ptype, self.default,
-                             self._optional, self.value)
-        else:
-            if self.value is not None:
-                new_val = self.value.copy()
-            else:
-                new_val = None
-            return Parameter(self.name, self.ptype, self.default,
-                             self._optional, new_val)
+        return self._clone(self.name)
+
+    def _clone(self, name):
+        """A deep copy of self with a new name.
+
+        The name, type, default, and optional flag are immutable and
+        were validated when self was constructed, so they are shared
+        rather than re-validated.  Only the value is copied.
+        """
+        new = Parameter.__new__(Parameter)
+        new.__dict__.update(self.__dict__)
+        _uncached(new)
+        new.name = name
+        if type(self.value) is list:
+            new.value = list(self.value)
+        elif not self._primitive and self.value is not None:
+            new.value = self.value.copy()
+        return new
 
 
 
-class ParameterCollection(collections.abc.MutableMapping):
+class ParameterCollection(_Hashable, _Pickled, collections.abc.MutableMapping):
     """A collection of parameters, this class acts like a dictionary from name : value.
 
     But it is actually a dictionary from name : Parameter instances!
     """
+    _xml_cache = None
+    _complete_cache = None
+    _xml_parent = None
+
     def __init__(self, pars=None, policy_not_in_spec='error', policy_empty_is_complete=False):
         if type(pars) in [list,tuple]:
             pars = dict((p.name, p) for p in pars)
@@ -191,15 +519,20 @@ class ParameterCollection(collections.abc.MutableMapping):
         return len(self._pars)
 
     def __delitem__(self, k):
+        if _undo_log is not None:
+            _record(_undo_delete, self, k, self._pars[k], list(self._pars).index(k))
         del self._pars[k]    
+        _invalidate(self)
                     
     def __setitem__(self, k, v):
+        _invalidate(self)
         if k not in self._pars:
             if self._policy_not_in_spec == 'warn' :
                 warnings.warn(f'Adding parameter {k} of type {type(v)} to the spec.')
             elif self._policy_not_in_spec == 'error':
                 raise KeyError(f'Parameter "{k}" is not in the Collection.')
             self._pars[k] = Parameter(k, type(v), value=v)
+            _record(_undo_insert, self, [k,])
         else:
             self._pars[k].set(v)
 
@@ -207,7 +540,7 @@ class ParameterCollection(collections.abc.MutableMapping):
         return k in self._pars
 
     def __str__(self):
-        return '\n'.join(['%s'%p for p in self._pars.values()])
+        return '\n'.join(['%s'%p for p in self.parameters()])
     
     def parameters(self):
         """Generator for all parameter objects."""
@@ -218,40 +551,62 @@ class ParameterCollection(collections.abc.MutableMapping):
         """Accessor for a parameter object."""
         return self._pars[k]
 
+    @_cached_complete
     def is_complete(self):
         """Does this collection consist of all complete objects?"""
         if len(self) == 0:
             return self._policy_empty_is_complete
-        return all(p.is_complete() for p in self._pars.values())
+        return all(p.is_complete() for p in self.parameters())
 
     def complete(self):
         """Generator for all entries that are complete."""
-        for p in self._pars.values():
+        for p in self.parameters():
             if p.is_complete():
                 yield p
 
     def has_value(self):
-        return any(p.has_value() for p in self._pars.values())
+        return any(p.has_value() for p in self.parameters())
 
     def valued(self):
         """Generator for all entries that has_value()"""
-        for p in self._pars.values():
+        for p in self.parameters():
             if p.has_value():
                 yield p
 
     def is_optional(self):
-        return all(p.is_optional() for p in self._pars.values())
+        return all(p.is_optional() for p in self.parameters())
+
+    def _link_xml_parents(self):
+        """Links entries to self, see _invalidate()."""
+        for p in self._pars.values():
+            if type(p) is Parameter:
+                p._xml_parent = self
+                if not p._primitive and p.value is not None:
+                    p.value._xml_parent = self
                 
+    def _digest_parts(self):
+        yield self._policy_not_in_spec
+        yield self._policy_empty_is_complete
+        for p in self.parameters():
+            yield p._digest_key()
+
     def copy(self):
-        pardict = dict((k,v.copy()) for (k,v) in self._pars.items())
-        return ParameterCollection(pardict, self._policy_not_in_spec)
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        _uncached(new)
+        new._pars = dict((k,v.copy()) for (k,v) in self._pars.items())
+        return _relink(new)
 
     # def append_empty(self, k, v):
     #     self._pars[k] = v
 
 
-class Spec(collections.abc.MutableSequence):
+class Spec(_Hashable, _Pickled, collections.abc.MutableSequence):
     """A collection of Collections, this defines a spec."""
+    _xml_cache = None
+    _complete_cache = None
+    _xml_parent = None
+
     def __init__(self, iterable=None, policy_empty_is_complete=False, **kwargs):
         if iterable is None:
             iterable = list()
@@ -301,14 +656,18 @@ class Spec(collections.abc.MutableSequence):
     def __setitem__(self, i, value):
         if type(i) is int:
             assert(iter(value) is not None)
+            _record(_undo_collections, self, list(self.collections))
             self.collections[i] = value
+            _invalidate(self)
         else:
             index = self._find_key(i)
             self.collections[index][i] = value
 
     def __delitem__(self, i):
         if type(i) is int:
+            _record(_undo_collections, self, list(self.collections))
             self.collections.__delitem__(i)
+            _invalidate(self)
         elif type(i) is str:
             next(coll for coll in self.collections if i in coll).__delitem__(i)
 
@@ -316,10 +675,14 @@ class Spec(collections.abc.MutableSequence):
         return len(self.collections)
 
     def append(self, collection):
+        _record(_undo_collections, self, list(self.collections))
         self.collections.append(collection)
+        _invalidate(self)
     
     def insert(self, i, collection):
+        _record(_undo_collections, self, list(self.collections))
         self.collections.insert(i, collection)
+        _invalidate(self)
         
     def __contains__(self, k):
         return any((k in coll) for coll in self.collections)
@@ -332,6 +695,7 @@ class Spec(collections.abc.MutableSequence):
             for p in collection.parameters():
                 yield p
 
+    @_cached_complete
     def is_complete(self):
         if len(self) == 0:
             return self._policy_empty_is_complete
@@ -355,11 +719,20 @@ class Spec(collections.abc.MutableSequence):
     def is_optional(self):
         return all(coll.is_optional() for coll in self.collections)
 
+    def _link_xml_parents(self):
+        """Links collections to self, see _invalidate()."""
+        for coll in self.collections:
+            coll._xml_parent = self
+            coll._link_xml_parents()
+
     def _update_from_spec(self, other):
         """Updates this spec by adding other items to it."""
         for coll in other.collections:
             self.append(coll)
 
+        if _undo_log is not None:
+            for name in ('includes', 'dependencies', 'keys', 'evaluators'):
+                _record(_undo_setattr, self, name, getattr(self, name), None)
         self.includes = list(set(self.includes+other.includes))
         self.dependencies = list(set(self.dependencies+other.dependencies))
         self.keys = list(set(self.keys+other.keys))
@@ -377,13 +750,21 @@ class Spec(collections.abc.MutableSequence):
             self._update_from_dict(other)
         return self
                 
+    def _digest_parts(self):
+        yield self._policy_empty_is_complete
+        for coll in self.collections:
+            yield coll._structural_digest()
+
     def copy(self):
-        return Spec([coll.copy() for coll in self.collections],
-                    includes=copy.copy(self.includes),
-                    dependencies=copy.copy(self.dependencies),
-                    keys=copy.copy(self.keys),
-                    evaluators=copy.copy(self.evaluators)
-                    )
+        # dependencies, keys, and evaluators are replaced, never
+        # modified in place, so they may be shared with the copy.
+        # includes are emptied in place by SpecDict.construct().
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        _uncached(new)
+        new.includes = list(self.includes)
+        new.collections = [coll.copy() for coll in self.collections]
+        return _relink(new)
 
                 
     
@@ -400,7 +781,9 @@ class OneOf(Spec):
     def __setitem__(self, k, v):
         if type(k) is str:
             index = self._find_key(k)
+            _invalidate(self)
             if self.branch_index is None:
+                _record(_undo_setattr, self, 'branch_index', None, self)
                 self.branch_index = index
             elif self.branch_index != index:
                 raise RuntimeError(f'Attempting to set parameter "{k}" value in previously pruned branch.')
@@ -416,6 +799,7 @@ class OneOf(Spec):
         else:
             return str(self.collections[self.branch_index])
             
+    @_cached_complete
     def is_complete(self):
         # two ways to be complete -- either the collection index is
         # provided and that collection is complete, or the collection index
@@ -442,17 +826,22 @@ class OneOf(Spec):
             for p in self.collections[self.branch_index].valued():
                 yield p
 
-    def copy(self):
-        return OneOf([coll.copy() for coll in self.collections])
+    def _digest_parts(self):
+        yield self.branch_index
+        yield from super(OneOf, self)._digest_parts()
                 
             
 
-class CaseSwitch:
+class CaseSwitch(_Hashable):
     """A single parameter, whose value sets a series of other inclusions.
 
     Enables CASE ... SWITCH(a) ... SWITCH(b) ... SWITCH() ... END
     Enables IF ... THEN ... ELSE ... END
     """
+    _xml_cache = None
+    _complete_cache = None
+    _xml_parent = None
+
     def __init__(self, case, switch_dict):
         assert(type(case) is Parameter)
         assert(case.is_primitive())
@@ -472,6 +861,7 @@ class CaseSwitch:
             raise KeyError(f'Cannot access CaseSwitch branch until case "{self.case.name}" is set.')
         
     def __setitem__(self, k, v):
+        _invalidate(self)
         if k == self.case.name:
             self.case.set(v)
         else:
@@ -518,6 +908,7 @@ class CaseSwitch:
         lines.append('END')
         return '\n'.join(lines)
     
+    @_cached_complete
     def is_complete(self):
         if not self.case.is_complete():
             return False
@@ -553,13 +944,66 @@ class CaseSwitch:
             for p in branch.parameters():
                 yield p
 
+    def _link_xml_parents(self):
+        """Links the case and branches to self, see _invalidate()."""
+        self.case._xml_parent = self
+        for branch in self.branches.values():
+            branch._xml_parent = self
+            branch._link_xml_parents()
+
+    def _digest_parts(self):
+        yield self.case._digest_key()
+        for key, branch in self.branches.items():
+            yield (key, branch._structural_digest())
+
     def copy(self):
         case_copy = self.case.copy()
         switch_copy = dict([(k, v.copy()) for (k,v) in self.branches.items()])
         return CaseSwitch(case_copy, switch_copy)
 
-                
-                
+
+
+class _ColumnBlock(object):
+    """Struct-of-arrays storage for a block of TypedCollection entries.
+
+    Each entry is a copy of template, with the primitive parameter at
+    each path (a tuple of names) set from row i of the corresponding
+    column.  Blocks are never modified after creation.
+    """
+    __slots__ = ('ptype_string', 'template', 'columns')
+
+    def __init__(self, ptype_string, template, columns):
+        self.ptype_string = ptype_string
+        self.template = template
+        self.columns = columns
+
+    def materialize(self, name, i):
+        """Creates the Parameter for the entry in row i."""
+        value = self.template.copy()
+        for path, column in self.columns.items():
+            container = value
+            for k in path[:-1]:
+                container = container[k]
+            if column.ndim == 1:
+                container[path[-1]] = column.item(i)
+            else:
+                container[path[-1]] = column[i].tolist()
+        return Parameter(name, self.ptype_string, value=value)
+
+
+class _ColumnRow(object):
+    """Stands in for an entry of a TypedCollection stored in a _ColumnBlock."""
+    __slots__ = ('block', 'index')
+
+    def __init__(self, block, index):
+        self.block = block
+        self.index = index
+
+    def copy(self):
+        # blocks are never modified, so rows can be shared
+        return self
+
+
 class TypedCollection(ParameterCollection):
     """A ParameterCollection that stores things of a single type."""
     def __init__(self, contained_ptype):
@@ -574,19 +1018,173 @@ class TypedCollection(ParameterCollection):
         super(TypedCollection, self).__init__(list(),
                                               policy_not_in_spec='none',
                                               policy_empty_is_complete=False)
+
+    def __getitem__(self, k):
+        return self.get_parameter(k).get()
+
+    def get_parameter(self, k):
+        """Accessor for a parameter object.
+
+        Entries stored in columns are created on access, and from then
+        on are stored as Parameter objects.
+        """
+        p = self._pars[k]
+        if type(p) is _ColumnRow:
+            p = p.block.materialize(k, p.index)
+            self._pars[k] = p
+            if self._xml_cache is not None or self._hash_cache is not None:
+                # changes anywhere in the entry must clear the caches
+                p._xml_parent = self
+                p.value._xml_parent = self
+                _link_all(p.value)
+        return p
+
+    def parameters(self):
+        """Generator for all parameter objects.
+
+        Entries stored in columns are yielded as temporary Parameter
+        objects, so changes made to them are lost.  Use get_parameter()
+        or [] to modify an entry.
+        """
+        for k, p in self._pars.items():
+            if type(p) is _ColumnRow:
+                yield p.block.materialize(k, p.index)
+            else:
+                yield p
+
+    def _digest_parts(self):
+        if self._primitive:
+            contained = ats_input_spec.primitives.primitives_to_text[self.contained_ptype]
+        elif self.contained_ptype is not None:
+            contained = self.contained_ptype._structural_digest()
+        else:
+            contained = None
+        yield (self.contained_ptype_string, contained)
+        yield from super(TypedCollection, self)._digest_parts()
+
+    def _check_new_names(self, names, caller):
+        """Raises ValueError if names are repeated or already exist."""
+        unique = set(names)
+        if len(unique) != len(names):
+            seen = set()
+            for k in names:
+                if k in seen:
+                    raise ValueError(f'Key "{k}" is repeated, cannot {caller}() with this name.')
+                seen.add(k)
+        existing = unique.intersection(self._pars)
+        if len(existing) > 0:
+            raise ValueError(f'Key "{existing.pop()}" already exists, cannot {caller}() of this name.')
+
     def append_empty(self, k):
         """Add an empty Parameter of type contained_ptype and key k"""
         if k in self:
             raise ValueError(f'Key "{k}" already exists, cannot append_empty() of this name.')
         if self.contained_ptype is None:
             raise RuntimeError('Cannot append_empty() on TypedCollection whose type has not yet been set.')
-        elif self._primitive:
+        _invalidate(self)
+        _record(_undo_insert, self, [k,])
+        if self._primitive:
             self._pars[k] = Parameter(k, self.contained_ptype)
             return self._pars[k]
         else:
             self._pars[k] = Parameter(k, self.contained_ptype_string, value=self.contained_ptype.copy())
             return self._pars[k].get()
 
+    def append_many(self, names, values=None):
+        """Add an empty Parameter of type contained_ptype for each key in names.
+
+        If provided, values is a sequence of the same length as names.
+        For primitive types each entry is the value of the new
+        Parameter; for derived types each entry is a dictionary of
+        settings used to update() the new entry (or None to leave it
+        empty).
+
+        Returns a list of the new entries, as append_empty() would.
+        """
+        names = list(names)
+        if self.contained_ptype is None:
+            raise RuntimeError('Cannot append_many() on TypedCollection whose type has not yet been set.')
+        if values is not None:
+            values = list(values)
+            if len(values) != len(names):
+                raise ValueError(f'append_many() given {len(names)} names but {len(values)} values.')
+
+        self._check_new_names(names, 'append_many')
+
+        if self._primitive:
+            if values is not None:
+                values = [ats_input_spec.primitives.valid_from_type(self.contained_ptype, v) for v in values]
+            prototype = Parameter(None, self.contained_ptype)
+        else:
+            prototype = Parameter(None, self.contained_ptype_string, value=self.contained_ptype)
+
+        # set the values before inserting, so that nothing is inserted
+        # if one is invalid
+        new_pars = [prototype._clone(k) for k in names]
+        if values is not None:
+            if self._primitive:
+                for p, v in zip(new_pars, values):
+                    p.value = v
+            else:
+                for p, v in zip(new_pars, values):
+                    if v is not None:
+                        p.value.update(v)
+
+        self._pars.update((p.name, p) for p in new_pars)
+        _record(_undo_insert, self, names)
+        _invalidate(self)
+
+        if self._primitive:
+            return new_pars
+        else:
+            return [p.value for p in new_pars]
+
+    def append_columns(self, names, columns, template=None):
+        """Add entries for each key in names, stored as columns of primitive values.
+
+        This is a compact alternative to append_many() for long lists
+        whose entries share a structure and differ only in a few
+        primitive values.  columns is a dictionary from parameter name
+        (or tuple of names, for parameters in sublists) to a sequence
+        of values (e.g. a numpy array) of the same length as names.
+        Parameters of list type take 2D arrays, one row per entry.
+
+        Entries are copies of template, which defaults to the
+        contained type but may be used to provide values shared by
+        all entries, or to set the type of a TypedSpec.  Entries are
+        only created as Parameter objects when accessed.
+        """
+        names = list(names)
+        if self.contained_ptype is None:
+            raise RuntimeError('Cannot append_columns() on TypedCollection whose type has not yet been set.')
+        if self._primitive:
+            raise RuntimeError('Cannot append_columns() on TypedCollection of primitive type, use append_many().')
+        self._check_new_names(names, 'append_columns')
+
+        if template is None:
+            template = self.contained_ptype
+        template = template.copy()
+
+        block_columns = dict()
+        for path, values in columns.items():
+            if type(path) is str:
+                path = (path,)
+            par = find_parameter(template, path)
+            if not par.is_primitive():
+                raise TypeError(f'Cannot store non-primitive parameter "{par.name}" in a column.')
+            column = ats_input_spec.primitives.valid_column_from_type(par.ptype, values)
+            if len(column) != len(names):
+                raise ValueError(f'append_columns() given {len(names)} names but {len(column)} values of "{par.name}".')
+            block_columns[tuple(path)] = column
+
+        block = _ColumnBlock(self.contained_ptype_string, template, block_columns)
+        if len(names) > 0:
+            # catch errors in setting values now, rather than on access
+            block.materialize(names[0], 0)
+        self._pars.update((k, _ColumnRow(block, i)) for (i, k) in enumerate(names))
+        _record(_undo_insert, self, names)
+        _invalidate(self)
+
     def __setitem__(self, k, v):
         if self.contained_ptype is None:
             raise RuntimeError('Cannot __setitem__() on TypedCollection whose type has not yet been set.')
@@ -603,11 +1201,12 @@ class TypedCollection(ParameterCollection):
             for p1, p2 in zip(v1.parameters(), v2.parameters()):
                 p1 = p2
 
-    def copy(self):
-        return TypedCollection(self.contained_ptype.copy())
 
 
 class TypedSpec(Spec):
+    # the spec name of the typed spec, if it has one, for pickling
+    _typed_spec_name = None
+
     def __init__(self, my_type, policy='standard', others=None, **kwargs):
         self.type = my_type
         self.policy = policy
@@ -638,6 +1237,7 @@ class TypedSpec(Spec):
                 super(TypedSpec, self).__init__()
 
     def set_type(self, typename, typed_spec):
+        self._typed_spec_name = typed_spec.__dict__.get('_spec_source', (None, None))[1]
         if self.policy == 'standard' or self.policy == 'inline':
             # set the type parameter, call the super one in case we decide to
             # implement __setitem__ here to call set_type()
@@ -666,6 +1266,19 @@ class TypedSpec(Spec):
             raise ValueError(f'Invalid policy "{self.policy}"')
         return self.get_sublist()
 
+    def get_type(self):
+        """Returns the name of the type, or None if it has not been set."""
+        if self.policy == 'standard' or self.policy == 'inline':
+            return self[0].get_parameter(self.type+' type').value
+        if self.policy == 'sublist':
+            prefix = self.type+': '
+        else:
+            prefix = (self.type+DELIMITER).replace(' ', DELIMITER)
+        for p in self.parameters():
+            if p.name.startswith(prefix):
+                return p.name[len(prefix):]
+        return None
+
     def get_sublist(self):
         """Returns the parameters list associated with the type."""
         if self.policy == 'standard':
@@ -677,6 +1290,10 @@ class TypedSpec(Spec):
         elif self.policy.startswith('sublist'):
             return next(self.parameters()).get()
 
+    def _digest_parts(self):
+        yield (self.type, self.policy)
+        yield from super(TypedSpec, self)._digest_parts()
+
     def has_value(self):
         if self.policy.startswith('sublist') and len(self) > 0:
             return True
@@ -684,24 +1301,44 @@ class TypedSpec(Spec):
             return super(TypedSpec, self).has_value()
 
     def copy(self):
-        others = None
+        new = super(TypedSpec, self).copy()
         if self.others is not None:
-            others = self.others.copy()
-        return TypedSpec(self.type, self.policy, others)
+            # others is one of the collections, keep it that way
+            try:
+                i = next(i for (i,coll) in enumerate(self.collections) if coll is self.others)
+            except StopIteration:
+                new.others = self.others.copy()
+            else:
+                new.others = new.collections[i]
+        return new
                 
 
 class SpecDict(collections.abc.MutableMapping):
-    """A dictionary that returns by copy and fills sublists."""
+    """A dictionary that returns by copy and fills sublists.
+
+    What it returns pickles as the spec name and values, see _Pickled.
+    """
     def __init__(self, *args, **kwargs):
         self._store = dict(*args, **kwargs)
+        self._spec_hashes = dict()
+        _spec_dicts.append(weakref.ref(self))
         self['list'] = ParameterCollection(policy_not_in_spec='none')
 
     def __getitem__(self, key):
+        return self.construct(key)
+
+    def construct(self, key, populate=True):
+        """Returns a new spec for key.
+
+        If not populate, derived parameters are left without a value,
+        e.g. to inspect the spec itself rather than fill it.
+        """
         # includes specs we can construct on the fly
         if key.endswith('-list'):
             contained = self[key[:-len('-list')]]
             tc = ats_input_spec.specs.TypedCollection(contained)
             #result = ats_input_spec.specs.Spec([tc,])
+            tc._spec_source = (self, key)
             return tc
         elif key.endswith('-typed-spec'):
             contained_name = key[:-len('-typed-spec')].replace(DELIMITER, ' ')
@@ -738,12 +1375,23 @@ class SpecDict(collections.abc.MutableMapping):
         if hasattr(result, 'includes'):
             while len(result.includes) > 0:
                 for included_spec in copy.copy(result.includes):
-                    result.update(self[included_spec[0]])
+                    result.update(self.construct(included_spec[0], populate))
                     result.includes.remove(included_spec)
 
         # now fill the result
-        populate_specs(result, self)
+        result._spec_source = (self, key)
+        if populate:
+            populate_specs(result, self)
         return result
+
+    def _spec_hash(self, key):
+        """schema.spec_hash() of key, cached until self is changed."""
+        try:
+            return self._spec_hashes[key]
+        except KeyError:
+            import ats_input_spec.schema
+            spec_hash = self._spec_hashes[key] = ats_input_spec.schema.spec_hash(self, key)
+            return spec_hash
             
     def __iter__(self):
         return iter(self._store)
@@ -753,16 +1401,285 @@ class SpecDict(collections.abc.MutableMapping):
 
     def __delitem__(self, key):
         del self._store[key]    
+        self._spec_hashes.clear()
                     
     def __setitem__(self, key, value):
         self._store[key] = value
+        self._spec_hashes.clear()
 
     def update(self, other):
         assert(type(other) is SpecDict)
         self._store.update(other._store)
+        self._spec_hashes.clear()
         return self
 
 
+#
+# Differences between two mains.
+#
+class Diff(object):
+    """Differences between two mains, see diff().
+
+    added and removed are lists of (path, value), and changed is a list
+    of (path, old value, new value), where paths are tuples of names
+    of primitive Parameters.
+    """
+    width = 60
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def _value_string(self, value):
+        if type(value) is list and len(value) == 0:
+            string = '{}'
+        else:
+            string = ats_input_spec.primitives.string_from_primitive(value)
+        if len(string) > self.width:
+            string = string[:self.width-3] + '...'
+        return string
+
+    def _line(self, mark, color, path, *values):
+        name = ats_input_spec.colors.NAME + ' -> '.join(path) + ats_input_spec.colors.RESET
+        values = ' -> '.join(color + self._value_string(v) + ats_input_spec.colors.RESET for v in values)
+        return f'{color}{mark}{ats_input_spec.colors.RESET} {name} : {values}'
+
+    def __str__(self):
+        lines = [self._line('~', ats_input_spec.colors.DEFAULT, path, old, new)
+                 for (path, old, new) in self.changed]
+        lines.extend(self._line('-', ats_input_spec.colors.UNFILLED, path, value)
+                     for (path, value) in self.removed)
+        lines.extend(self._line('+', ats_input_spec.colors.FILLED, path, value)
+                     for (path, value) in self.added)
+        return '\n'.join(lines)
+
+
+def _leaves(par, path):
+    """Generator for (path, value) of the valued primitive Parameters in par."""
+    path = path + (par.name,)
+    if par.is_primitive():
+        yield path, par.value
+    else:
+        for p in par.value.valued():
+            yield from _leaves(p, path)
+
+def _same_value(p, q):
+    return p.ptype is q.ptype and \
+        _value_key(p.ptype, p.value) == _value_key(q.ptype, q.value)
+
+def _diff(a, b, path, result):
+    """Adds the differences between containers a and b to result."""
+    if a._structural_digest() == b._structural_digest():
+        return
+    if isinstance(a, ParameterCollection) and isinstance(b, ParameterCollection):
+        # drop unchanged entries first, as has_value() may traverse them
+        a_pars = dict((p.name, p) for p in a.parameters())
+        b_pars = dict((p.name, p) for p in b.parameters())
+        for name in [k for k in a_pars if k in b_pars]:
+            if a_pars[name]._digest_key() == b_pars[name]._digest_key():
+                del a_pars[name], b_pars[name]
+        a_pars = dict((k, p) for (k, p) in a_pars.items() if p.has_value())
+        b_pars = dict((k, p) for (k, p) in b_pars.items() if p.has_value())
+    else:
+        a_pars = dict((p.name, p) for p in a.valued())
+        b_pars = dict((p.name, p) for p in b.valued())
+    for name, p in a_pars.items():
+        q = b_pars.get(name)
+        if q is None:
+            result.removed.extend(_leaves(p, path))
+        elif p.is_primitive() and q.is_primitive():
+            if not _same_value(p, q):
+                result.changed.append((path + (name,), p.value, q.value))
+        elif not p.is_primitive() and not q.is_primitive():
+            _diff(p.value, q.value, path + (name,), result)
+        else:
+            result.removed.extend(_leaves(p, path))
+            result.added.extend(_leaves(q, path))
+    for name, q in b_pars.items():
+        if name not in a_pars:
+            result.added.extend(_leaves(q, path))
+
+def diff(a, b):
+    """Returns a Diff of the valued Parameters in a and b, e.g. two mains.
+
+    Subtrees with the same structural hash are skipped, so once both
+    are hashed, e.g. b is a copy of a that has since been changed, the
+    cost scales with the size of the change rather than of the mains.
+    print() the result for a colored summary.
+    """
+    result = Diff()
+    _diff(a, b, tuple(), result)
+    return result
+
+
+#
+# Merging fragments of a main, e.g. built in parallel.
+#
+def _conflict_error(path, ours, theirs):
+    raise ValueError(f'Conflicting values of "{" -> ".join(path)}".')
+
+_conflict_policies = {'error' : _conflict_error,
+                      'ours' : lambda path, ours, theirs : ours,
+                      'theirs' : lambda path, ours, theirs : theirs}
+
+# fragments already merged, by id, as their entries are now in a main
+_merged_fragments = weakref.WeakValueDictionary()
+
+def _own_selection_conflict(ours, theirs):
+    """Do ours and theirs themselves select a different type or ONE OF branch?"""
+    if isinstance(ours, TypedSpec):
+        a, b = ours.get_type(), theirs.get_type()
+        if a is not None and b is not None and a != b:
+            return True
+    if isinstance(ours, OneOf):
+        a, b = ours.branch_index, theirs.branch_index
+        if a is not None and b is not None and a != b:
+            return True
+    return False
+
+def _selection_conflict(ours, theirs):
+    """Do ours and theirs select different types or ONE OF branches?
+
+    Lists in them are not checked, they are merged separately.
+    """
+    if _own_selection_conflict(ours, theirs):
+        return True
+    if isinstance(ours, CaseSwitch):
+        return any(_selection_conflict(branch, theirs.branches[k]) for (k, branch) in ours.branches.items())
+    if isinstance(ours, Spec):
+        return any(_selection_conflict(a, b) for (a, b) in zip(ours.collections, theirs.collections))
+    return False
+
+def _graft_value(par, value):
+    """Sets the value of a derived Parameter to value, from a fragment."""
+    par.set(value)
+    value._xml_parent = par._xml_parent
+
+def _merge_parameter(ours, theirs, path, resolve):
+    if theirs.value is None or ours.value is theirs.value:
+        return
+    if ours.value is None:
+        if ours.is_primitive():
+            ours.set(theirs.value)
+        else:
+            _graft_value(ours, theirs.value)
+    elif ours.is_primitive():
+        if not _same_value(ours, theirs):
+            value = resolve(path, ours.value, theirs.value)
+            if value is not ours.value:
+                ours.set(value)
+    elif _selection_conflict(ours.value, theirs.value):
+        value = resolve(path, ours.value, theirs.value)
+        if value is not ours.value:
+            _graft_value(ours, value)
+    else:
+        _merge(ours.value, theirs.value, path, resolve)
+
+def _merge(ours, theirs, path, resolve):
+    """Merges the container theirs into ours, which do not conflict in their selections."""
+    if isinstance(ours, ParameterCollection):
+        if isinstance(ours, TypedCollection) and ours.contained_ptype_string != theirs.contained_ptype_string:
+            raise TypeError(f'Cannot merge a list of {theirs.contained_ptype_string} into a list of '
+                            f'{ours.contained_ptype_string} at "{" -> ".join(path)}".')
+        new = []
+        for k in theirs._pars:
+            if k in ours._pars:
+                _merge_parameter(ours.get_parameter(k), theirs.get_parameter(k), path + (k,), resolve)
+            elif isinstance(ours, TypedCollection) or ours._policy_not_in_spec != 'error':
+                new.append(k)
+            else:
+                raise KeyError(f'Parameter "{" -> ".join(path + (k,))}" is not in the Collection.')
+        if len(new) > 0:
+            # graft the new entries, rows stored as columns included
+            _record(_undo_insert, ours, new)
+            for k in new:
+                p = ours._pars[k] = theirs._pars[k]
+                if type(p) is Parameter:
+                    p._xml_parent = ours
+                    if not p._primitive and p.value is not None:
+                        p.value._xml_parent = ours
+            _invalidate(ours)
+
+    elif isinstance(ours, CaseSwitch):
+        _merge_parameter(ours.case, theirs.case, path + (ours.case.name,), resolve)
+        for k, branch in ours.branches.items():
+            _merge(branch, theirs.branches[k], path, resolve)
+
+    elif _own_selection_conflict(ours, theirs):
+        # resolved as ours at the top level, see merge()
+        return
+
+    else:
+        if isinstance(ours, TypedSpec) and ours.get_type() is None:
+            typename = theirs.get_type()
+            if typename is not None:
+                if theirs.policy == 'inline':
+                    ours.set_type(typename, theirs.collections[-1])
+                else:
+                    ours.set_type(typename, theirs.get_sublist())
+                ours._link_xml_parents()
+        if isinstance(ours, OneOf) and ours.branch_index is None and theirs.branch_index is not None:
+            _record(_undo_setattr, ours, 'branch_index', None, ours)
+            ours.branch_index = theirs.branch_index
+            _invalidate(ours)
+        if len(ours.collections) != len(theirs.collections):
+            raise ValueError(f'Cannot merge specs of different structure at "{" -> ".join(path)}".')
+        for a, b in zip(ours.collections, theirs.collections):
+            if a is not b:
+                _merge(a, b, path, resolve)
+
+def merge(main, *fragments, on_conflict='error'):
+    """Merges fragments, built from the same specs as main, into main.
+
+    Each fragment is, e.g., a main in which a worker process added
+    regions for some of the subcatchments.  Values set in a fragment
+    are set in main, and entries of lists that main does not have are
+    grafted into it, as are the types of TypedSpecs and the branches of
+    ONE OFs that main has not selected.  Entries are moved, not copied,
+    so fragments should not be used afterwards, and merging a fragment
+    that was already merged raises a ValueError.
+
+    A conflict is a value set differently in main and a fragment, or a
+    type or branch selected differently.  on_conflict is one of:
+
+    - 'error', raise a ValueError and leave main unchanged,
+    - 'ours', keep the value in main,
+    - 'theirs', take the value in the fragment, or
+    - a function f(path, ours, theirs) returning the value to keep,
+      where path is the tuple of names of the Parameter.
+
+    Types and branches selected differently in main itself are resolved
+    with path (), and must be kept as ours; the rest of the fragment is
+    still merged.
+
+    Fragments are merged in order.  Returns main.
+    """
+    try:
+        resolve = _conflict_policies[on_conflict]
+    except (KeyError, TypeError):
+        if not callable(on_conflict):
+            raise ValueError(f'Invalid on_conflict "{on_conflict}".')
+        resolve = on_conflict
+
+    for i, fragment in enumerate(fragments):
+        if id(fragment) in _merged_fragments or any(f is fragment for f in fragments[:i]):
+            raise ValueError('Cannot merge a fragment that was already merged, its entries are in a main.')
+
+    with transaction():
+        for fragment in fragments:
+            if _selection_conflict(main, fragment) and \
+               resolve(tuple(), main, fragment) is not main:
+                raise ValueError('Cannot take the types or branches of a fragment at the top level.')
+            _merge(main, fragment, tuple(), resolve)
+    for fragment in fragments:
+        _merged_fragments[id(fragment)] = fragment
+    return main
+
+
 #
 # A couple of default wrappers and helper functions
 #
@@ -773,6 +1690,15 @@ def populate_specs(container, known_specs):
             v.set(known_specs[v.ptype].copy())
             populate_specs(v.get(), known_specs)
 
+def find_parameter(container, path):
+    """Returns the Parameter object at path, a tuple of names, in container."""
+    for k in path[:-1]:
+        container = container[k]
+    try:
+        return next(p for p in container.parameters() if p.name == path[-1])
+    except StopIteration:
+        raise KeyError(f'Parameter "{path[-1]}" is not in the container.')
+
 def get_spec(name, iterable):
     """Mostly for testing, this just takes a bunch of pars and makes a spec."""
     parlist = ParameterCollection(iterable)
@@ -12,6 +12,7 @@ Tests primitives functionality.
 
 import ats_input_spec.primitives as primitives
 import pytest
+import numpy as np
 
 
 def test_bool():
@@ -89,3 +90,85 @@ def test_badtype():
     with pytest.raises(TypeError):
         primitives.valid_from_type(Fail, 'abc')
 
+
+def test_column():
+    c = primitives.valid_column_from_type(float, [1, 2, 3])
+    assert(c.dtype == float)
+    assert(c.tolist() == [1.0, 2.0, 3.0])
+
+    c = primitives.valid_column_from_type(int, np.arange(3))
+    assert(c.item(1) == 1)
+
+    c = primitives.valid_column_from_type(primitives.ListFloat, np.zeros((4,3)))
+    assert(c.shape == (4,3))
+
+    c = primitives.valid_column_from_type(str, ['a', 'b'])
+    assert(c.item(1) == 'b')
+
+    with pytest.raises(TypeError):
+        primitives.valid_column_from_type(int, [1.0, 2.5])
+
+    with pytest.raises(TypeError):
+        primitives.valid_column_from_type(float, [True, False])
+
+    with pytest.raises(TypeError):
+        primitives.valid_column_from_type(str, ['a', 1])
+
+    with pytest.raises(TypeError):
+        primitives.valid_column_from_type(primitives.ListFloat, [1.0, 2.0])
+
+
+def test_array():
+    a = np.linspace(0, 1, 11)
+    p = primitives.valid_from_type(primitives.ListFloat, a)
+    assert(np.shares_memory(p, a))
+    assert(not p.flags.writeable)
+    assert(primitives.valid_from_type(primitives.ListFloat, np.arange(3)).dtype == float)
+    assert(primitives.valid_from_type(primitives.ListInt, np.arange(3, dtype=np.int32)).tolist() == [0,1,2])
+
+    # formatted exactly
+    s = primitives.string_from_primitive(p)
+    assert(s == '{'+','.join(repr(v) for v in a.tolist())+'}')
+    assert(np.array(s[1:-1].split(','), dtype=float).tolist() == a.tolist())
+
+    with pytest.raises(TypeError):
+        primitives.valid_from_type(primitives.ListInt, a)
+
+    with pytest.raises(TypeError):
+        primitives.valid_from_type(primitives.ListFloat, np.zeros((2,2)))
+
+    with pytest.raises(TypeError):
+        primitives.valid_from_type(primitives.ListFloat, np.array(['1.0']))
+
+
+def test_list_from_string():
+    assert(primitives.valid_primitive_from_string('Array(double)', '{1.5, -2,3e2, nan }')[:3] == [1.5, -2.0, 300.0])
+    p = primitives.valid_primitive_from_string('Array(int)', '{1,2, 3}')
+    assert(p == [1,2,3])
+    assert(all(type(v) is int for v in p))
+    p = primitives.valid_primitive_from_string('Array(bool)', '{true,False,TRUE}')
+    assert(p == [True, False, True])
+    assert(all(type(v) is bool for v in p))
+
+    # not accepted by numpy, but by the per-entry parsing
+    assert(primitives.valid_primitive_from_string('Array(int)', '{1,1e3,2.0}') == [1, 1000, 2])
+
+    # errors are those of the per-entry parsing
+    with pytest.raises(RuntimeError, match='Parameter of type double with invalid value "one"'):
+        primitives.valid_primitive_from_string('Array(double)', '{1.0,one}')
+    with pytest.raises(RuntimeError, match='Parameter of type bool with invalid value "yes"'):
+        primitives.valid_primitive_from_string('Array(bool)', '{true,yes}')
+
+
+def test_placeholder():
+    p = primitives.Placeholder('poro', float)
+    assert(primitives.valid_from_type(float, p) is p)
+    assert(p == primitives.Placeholder('poro', float))
+    assert(p != primitives.Placeholder('poro', int))
+    assert(primitives.string_from_primitive(p) == '<poro>')
+
+    with pytest.raises(TypeError):
+        primitives.valid_from_type(int, p)
+
+    with pytest.raises(TypeError):
+        primitives.Placeholder('poro', dict)
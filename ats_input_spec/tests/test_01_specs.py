@@ -11,8 +11,10 @@ Tests specs functionality
 """
 
 import pytest
+import numpy as np
 
 import ats_input_spec.specs as specs
+import ats_input_spec.primitives as primitives
 import ats_input_spec.printing
 
 
@@ -429,6 +431,140 @@ def test_typed_list_derived():
     assert(len(list(tl.valued())) == 2)
     
 
+def test_typed_list_append_many_primitive():
+    tl = specs.TypedCollection(float)
+    pars = tl.append_many(['x', 'y', 'z'], [1, 2.2, '3.3'])
+    assert(len(tl) == 3)
+    assert(len(pars) == 3)
+    assert(tl.is_complete())
+    assert(tl['x'] == 1.0)
+    assert(type(tl['x']) is float)
+    assert(tl['z'] == 3.3)
+
+    # bad types throw before anything is added
+    with pytest.raises(TypeError):
+        tl.append_many(['a', 'b'], [1.0, 'hello'])
+    assert(len(tl) == 3)
+
+
+def test_typed_list_append_many_derived():
+    xy = {'x' : specs.Parameter('x', float),
+          'y' : specs.Parameter('y', float, default=0.0)}
+    xy = specs.ParameterCollection(xy)
+
+    tl = specs.TypedCollection(xy)
+    tl.append_empty('first')
+    names = [f'entry {i}' for i in range(100)]
+    entries = tl.append_many(names)
+    assert(len(tl) == 101)
+    assert(len(entries) == 100)
+    assert(not tl.is_complete())
+
+    # entries do not share values with each other or the prototype
+    entries[0]['x'] = 1.1
+    assert(tl['entry 0']['x'] == 1.1)
+    assert(tl['entry 1']['x'] is None)
+    assert(xy['x'] is None)
+
+    # settings per entry
+    tl2 = specs.TypedCollection(xy)
+    tl2.append_many(['a', 'b'], [{'x':1.0}, {'x':2.0, 'y':3.0}])
+    assert(tl2.is_complete())
+    assert(tl2['b']['x'] == 2.0)
+    assert(tl2['b']['y'] == 3.0)
+    assert(tl2['a']['y'] == 0.0)
+
+    # repeated and existing names throw
+    with pytest.raises(ValueError):
+        tl2.append_many(['c', 'c'])
+    with pytest.raises(ValueError):
+        tl2.append_many(['c', 'a'])
+    with pytest.raises(ValueError):
+        tl2.append_many(['c', 'd'], [{'x':1.0},])
+    assert(len(tl2) == 2)
+
+    # invalid settings throw before anything is added
+    with pytest.raises(KeyError):
+        tl2.append_many(['c', 'd'], [{'x':1.0}, {'not a parameter':2.0}])
+    with pytest.raises(TypeError):
+        tl2.append_many(['c', 'd'], [{'x':1.0}, {'x':'two'}])
+    assert(len(tl2) == 2)
+    
+
+def test_typed_list_append_columns():
+    xy = {'x' : specs.Parameter('x', float),
+          'y' : specs.Parameter('y', float, default=0.0),
+          'name' : specs.Parameter('name', str),
+          'corner' : specs.Parameter('corner', primitives.ListFloat, optional=True)}
+    xy = specs.ParameterCollection(xy)
+
+    tl = specs.TypedCollection(xy)
+    tl.append_empty('first')
+    names = [f'entry {i}' for i in range(100)]
+    tl.append_columns(names, {'x' : np.arange(100),
+                              'name' : names,
+                              'corner' : np.ones((100,3))})
+    assert(len(tl) == 101)
+    assert(list(tl.keys())[1] == 'entry 0')
+    assert(not tl.is_complete())
+    tl['first']['x'] = 1.0
+    tl['first']['name'] = 'first'
+    assert(tl.is_complete())
+    assert(len(list(tl.valued())) == 101)
+
+    # access gives real values, and changes are kept
+    assert(tl['entry 7']['x'] == 7.0)
+    assert(type(tl['entry 7']['x']) is float)
+    assert(tl['entry 7']['name'] == 'entry 7')
+    assert(tl['entry 7']['corner'] == [1.0, 1.0, 1.0])
+    assert(tl['entry 7']['y'] == 0.0)
+    tl['entry 7']['y'] = 2.0
+    assert(tl['entry 7']['y'] == 2.0)
+
+    # copies are independent
+    tl2 = tl.copy()
+    tl2['entry 8']['y'] = 3.0
+    assert(tl2['entry 8']['y'] == 3.0)
+    assert(tl['entry 8']['y'] == 0.0)
+
+    # bad values throw before anything is added
+    with pytest.raises(TypeError):
+        tl.append_columns(['a', 'b'], {'x' : ['hello', 'world']})
+    with pytest.raises(ValueError):
+        tl.append_columns(['a', 'b'], {'x' : [1.0,]})
+    with pytest.raises(KeyError):
+        tl.append_columns(['a', 'b'], {'z' : [1.0, 2.0]})
+    assert(len(tl) == 101)
+
+
+def test_typed_list_append_columns_template():
+    ab = {'a' : specs.Parameter('a', str),
+          'b' : specs.Parameter('b', int)}
+    ab = specs.ParameterCollection(ab)
+
+    template = specs.TypedSpec('wrm', policy='standard')
+    template.set_type('ab', ab)
+    template['ab parameters']['a'] = 'shared'
+
+    tl = specs.TypedCollection(specs.TypedSpec('wrm', policy='standard'))
+    tl.append_columns(['x', 'y'], {('ab parameters', 'b') : [1, 2]}, template)
+    assert(tl.is_complete())
+    assert(tl['y']['wrm type'] == 'ab')
+    assert(tl['y']['ab parameters']['a'] == 'shared')
+    assert(tl['y']['ab parameters']['b'] == 2)
+
+    with pytest.raises(TypeError):
+        tl.append_columns(['z',], {('ab parameters', 'b') : [1.5,]}, template)
+
+    # changes in the sublists of an entry, once accessed, are seen by the hash
+    copy = tl.copy()
+    digest = tl.structural_hash()
+    tl['x']['ab parameters']['b'] = 3
+    assert(tl.structural_hash() != digest)
+    assert(not tl.same_as(copy))
+    assert(len(specs.diff(copy, tl)) == 1)
+    
+
 def test_typed_spec_standard():
     # parameters for type "ab"
     ab = {'a' : specs.Parameter('a', str),
@@ -500,6 +636,26 @@ def test_typed_spec_sublist():
     assert(ts.has_value())
     assert(ts['wrm: ab']['a'] == 'hello')
 
+def test_typed_spec_copy():
+    ab = {'a' : specs.Parameter('a', str),
+          'b' : specs.Parameter('b', int)}
+    ab = specs.ParameterCollection(ab)
+
+    tc = specs.TypedCollection(specs.TypedSpec('wrm', policy='inline'))
+    ts = tc.append_empty('first')
+    ts.set_type('ab', ab)
+    ts['a'] = 'hello'
+
+    # copies keep the type and entries, but not the identity
+    tc2 = tc.copy()
+    assert(len(tc2) == 1)
+    assert(tc2['first']['wrm type'] == 'ab')
+    assert(tc2['first']['a'] == 'hello')
+    tc2['first']['b'] = 3
+    assert(tc2.is_complete())
+    assert(not tc.is_complete())
+
+
 def test_list_typed_spec():
     # parameters for type "ab"
     ab = {'a' : specs.Parameter('a', str),
@@ -553,3 +709,212 @@ def test_includes():
     
 
     
+
+
+def _hashed_spec():
+    xy = specs.ParameterCollection([specs.Parameter('x', float),
+                                    specs.Parameter('y', primitives.ListFloat, optional=True)])
+    one_of = specs.OneOf([specs.ParameterCollection([specs.Parameter('a', str)]),
+                          specs.ParameterCollection([specs.Parameter('b', str)])])
+    cs = specs.CaseSwitch(specs.Parameter('case', bool, default=False),
+                          {True : specs.ParameterCollection([specs.Parameter('c', int)]),
+                           False : specs.ParameterCollection([specs.Parameter('d', int, optional=True)])})
+    ts = specs.TypedSpec('wrm', policy='sublist')
+    pars = specs.ParameterCollection([specs.Parameter('xy', 'xy-spec', value=specs.Spec([xy,])),
+                                      specs.Parameter('wrm', 'wrm-typedsublist-spec', value=ts)])
+    return specs.Spec([pars, one_of, cs])
+
+def test_structural_hash():
+    s1 = _hashed_spec()
+    s2 = _hashed_spec()
+    assert(s1.same_as(s2))
+    assert(s1 is not s2)
+    assert(s1.structural_hash() == s2.structural_hash())
+    assert(s1 != s2)  # == is identity, as specs are mutable
+    assert(not s1.same_as(s1[0]))
+
+    # changes anywhere in the tree are seen, and the digest is cached until then
+    s1['xy']['x'] = 1.0
+    assert(not s1.same_as(s2))
+    assert(s1._hash_cache is not None)
+    s2['xy']['x'] = 1.0
+    assert(s1.same_as(s2))
+    s1['xy']['y'] = [1.0, 2.0]
+    s2['xy']['y'] = np.array([1.0, 2.0])
+    assert(s1.same_as(s2))
+    s2['xy']['y'] = np.array([1.0, 3.0])
+    assert(not s1.same_as(s2))
+    s2['xy']['y'] = [1, 2]
+    assert(s1.same_as(s2))
+
+    # branch selections
+    b1 = _hashed_spec()
+    b1['b'] = 'hello'
+    s1['a'] = 'hello'
+    assert(not s1[1].same_as(b1[1]))
+    assert(not s1.same_as(s2))
+    s2['a'] = 'hello'
+    assert(s1.same_as(s2))
+    s1['case'] = True
+    assert(not s1.same_as(s2))
+    s2['case'] = True
+    assert(s1.same_as(s2))
+
+    # types
+    ab = specs.ParameterCollection([specs.Parameter('a', str)])
+    s1['wrm'].set_type('ab', ab.copy())
+    assert(not s1.same_as(s2))
+    s2['wrm'].set_type('ab', ab.copy())
+    assert(s1.same_as(s2))
+    s1['wrm']['wrm: ab']['a'] = 'van Genuchten'
+    assert(not s1.same_as(s2))
+
+    # copies are equal, without rehashing, and are changed independently
+    s3 = s1.copy()
+    assert(s3._hash_cache == s1._hash_cache)
+    assert(s3.same_as(s1))
+    s3['wrm']['wrm: ab']['a'] = 'Brooks-Corey'
+    assert(not s3.same_as(s1))
+    assert(s1['wrm']['wrm: ab']['a'] == 'van Genuchten')
+
+    # parameters, including defaults and optional flags
+    assert(specs.Parameter('x', float).same_as(specs.Parameter('x', float)))
+    assert(not specs.Parameter('x', float).same_as(specs.Parameter('x', int)))
+    assert(not specs.Parameter('x', float).same_as(specs.Parameter('x', float, optional=True)))
+    assert(not specs.Parameter('x', float, default=1.0).same_as(specs.Parameter('x', float, default=2.0)))
+    assert(not specs.Parameter('x', float, value=1.0).same_as(specs.Parameter('y', float, value=1.0)))
+
+
+def test_diff():
+    s1 = _hashed_spec()
+    s1['xy']['x'] = 1.0
+    s1['xy']['y'] = [1.0, 2.0]
+    s1['a'] = 'hello'
+    s1['wrm'].set_type('ab', specs.ParameterCollection([specs.Parameter('a', str),
+                                                        specs.Parameter('b', int, optional=True)]))
+    s1['wrm']['wrm: ab']['a'] = 'van Genuchten'
+    assert(len(specs.diff(s1, s1.copy())) == 0)
+
+    s2 = s1.copy()
+    s2['xy']['x'] = 2.0
+    s2['xy']['y'] = np.array([1.0, 2.0])
+    s2['wrm']['wrm: ab']['b'] = 3
+    s2['case'] = True
+    s2['c'] = 4
+    d = specs.diff(s1, s2)
+    assert(d.changed == [(('xy', 'x'), 1.0, 2.0)])
+    assert(d.removed == [])
+    assert(d.added == [(('wrm', 'wrm: ab', 'b'), 3), (('case',), True), (('c',), 4)])
+
+    d = specs.diff(s2, s1)
+    assert(d.removed == [(('wrm', 'wrm: ab', 'b'), 3), (('case',), True), (('c',), 4)])
+    lines = str(d).split('\n')
+    assert(len(lines) == 4)
+    assert('xy -> x' in lines[0])
+    assert('2.00000000' in lines[0] and '1.00000000' in lines[0])
+    assert(lines[1].startswith(ats_input_spec.colors.UNFILLED + '-'))
+
+    # only the changed path is visited
+    s3 = s2.copy()
+    s3['xy']['x'] = 3.0
+    s3['wrm'].valued = None
+    assert(specs.diff(s2, s3).changed == [(('xy', 'x'), 2.0, 3.0)])
+
+
+def test_transaction():
+    s = _hashed_spec()
+    s['xy']['x'] = 1.0
+    s['wrm'].set_type('ab', specs.ParameterCollection([specs.Parameter('a', str)],
+                                                      policy_not_in_spec='none'))
+    s0 = s.copy()
+
+    # undone on an exception
+    with pytest.raises(ValueError):
+        with specs.transaction():
+            s['xy']['x'] = 2.0
+            s['a'] = 'hello'
+            s['wrm']['wrm: ab']['a'] = 'van Genuchten'
+            assert(not s.same_as(s0))
+            raise ValueError('try again')
+    assert(s.same_as(s0))
+    assert(s['xy']['x'] == 1.0)
+    assert(s[1].branch_index is None)
+    assert(len(specs.diff(s0, s)) == 0)
+
+    # and kept otherwise
+    with specs.transaction():
+        s['xy']['x'] = 2.0
+    assert(s['xy']['x'] == 2.0)
+    s0 = s.copy()
+
+    # explicit snapshots restore additions, deletions, and types in order
+    tc = specs.TypedCollection(specs.TypedSpec('wrm', policy='sublist'))
+    tc.append_empty('first')
+    keys = list(s['wrm']['wrm: ab'].keys())
+    token = specs.snapshot()
+    s['wrm']['wrm: ab']['b'] = 3
+    del s['wrm']['wrm: ab']['a']
+    s['wrm']['wrm: ab']['extra'] = 1.0
+    tc.append_many(['second', 'third'])
+    tc['first'].set_type('ab', specs.ParameterCollection([specs.Parameter('a', str)]))
+    inner = specs.snapshot()
+    s['xy']['x'] = 3.0
+    specs.commit(inner)
+    specs.restore(token)
+    assert(s.same_as(s0))
+    assert(list(s['wrm']['wrm: ab'].keys()) == keys)
+    assert(list(tc.keys()) == ['first'])
+    assert(len(tc['first']) == 0)
+
+    # the snapshot stays open until committed
+    s['xy']['x'] = 4.0
+    specs.restore(token)
+    assert(s['xy']['x'] == 2.0)
+    specs.commit(token)
+    with pytest.raises(ValueError):
+        specs.restore(token)
+    assert(specs._undo_log is None)
+
+
+def test_transaction_is_global():
+    s = _hashed_spec()
+    other = _hashed_spec()
+    other['xy']['x'] = 1.0
+    other_hash = other.structural_hash()
+
+    # changes to other objects are recorded and undone too
+    with pytest.raises(ValueError):
+        with specs.transaction():
+            s['xy']['x'] = 2.0
+            other['xy']['x'] = 2.0
+            # caches of other are cleared before they are used
+            assert(other.structural_hash() != other_hash)
+            raise ValueError('try again')
+    assert(other['xy']['x'] == 1.0)
+    assert(other.structural_hash() == other_hash)
+
+
+def _one_of_spec():
+    one_of = specs.OneOf([specs.ParameterCollection([specs.Parameter('region', str)]),
+                          specs.ParameterCollection([specs.Parameter('regions', 'string-list')])])
+    return specs.Spec([one_of, specs.ParameterCollection([specs.Parameter('variable', str),
+                                                          specs.Parameter('x', float, optional=True)])])
+
+def test_merge_top_level():
+    main = _one_of_spec()
+    main['region'] = 'a'
+    fragment = _one_of_spec()
+    fragment['regions'] = ['b',]
+    fragment['variable'] = 'v'
+    with pytest.raises(ValueError):
+        specs.merge(main, fragment)
+    with pytest.raises(ValueError):
+        specs.merge(main, fragment, on_conflict='theirs')
+    assert(specs.find_parameter(main, ('variable',)).get() is None)
+
+    # the branch is kept, and the rest of the fragment is merged
+    specs.merge(main, fragment, on_conflict='ours')
+    assert(main['region'] == 'a')
+    assert(main[0].branch_index == 0)
+    assert(main[0][1]['regions'] is None)
+    assert(main['variable'] == 'v')
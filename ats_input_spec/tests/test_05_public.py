@@ -12,8 +12,11 @@ Tests for the public interface, full capability.
 
 
 import pytest
+import numpy as np
+import ats_input_spec.specs
 import ats_input_spec.public
 import ats_input_spec.printing
+import ats_input_spec.io
 
 
 @pytest.fixture
@@ -65,6 +68,50 @@ def test_add_daymet_box(main):
     assert(main['state']['evaluators'].is_complete())
 
 
+def _tabular_entry(main):
+    ev = main['state']['evaluators'].append_empty('surface-air_temperature')
+    ev.set_type('independent variable', ats_input_spec.public.known_specs['evaluator-independent-variable-spec'])
+    entry = ev['function'].append_empty('surface domain')
+    entry['region'] = 'surface domain'
+    entry['component'] = 'cell'
+    return entry
+
+def test_tabular_function_npy(main, tmp_path):
+    table = np.zeros(1000, dtype=[('time [s]', float), ('air temperature [K]', float)])
+    table['time [s]'] = np.arange(1000) * 3600.
+    table['air temperature [K]'] = 270. + np.sin(np.arange(1000) / 24.)
+    filename = str(tmp_path / 'met.npy')
+    np.save(filename, table)
+
+    entry = _tabular_entry(main)
+    ft = ats_input_spec.public.set_tabular_function_from_file(entry['function'], filename,
+                                                               'time [s]', 'air temperature [K]')
+    assert(isinstance(ft['y values'], np.memmap))
+    assert(entry.is_complete())
+
+    xml = ats_input_spec.io.to_xml(main, backend='native')
+    value = xml.find('.//ParameterList[@name="function-tabular"]/Parameter[@name="y values"]').get('value')
+    assert(np.array(value[1:-1].split(','), dtype=float).tolist() == table['air temperature [K]'].tolist())
+
+def test_tabular_function_csv(tmp_path):
+    filename = str(tmp_path / 'met.csv')
+    with open(filename, 'w') as fid:
+        fid.write('time [s], unused, air temperature [K]\n0.0, 1, 270.5\n3600.0, 2, 271.0\n')
+    x, y = ats_input_spec.public.read_columns(filename, ['time [s]', 'air temperature [K]'])
+    assert(x.tolist() == [0.0, 3600.0])
+    assert(y.tolist() == [270.5, 271.0])
+
+    with pytest.raises(KeyError):
+        ats_input_spec.public.read_columns(filename, ['time [s]', 'pressure [Pa]'])
+
+    # quoted names may contain commas
+    with open(filename, 'w') as fid:
+        fid.write('"time, start [s]", "air temperature [K]"\n0.0, 270.5\n3600.0, 271.0\n')
+    x, y = ats_input_spec.public.read_columns(filename, ['time, start [s]', 'air temperature [K]'])
+    assert(x.tolist() == [0.0, 3600.0])
+    assert(y.tolist() == [270.5, 271.0])
+
+
 def test_add_observation(main):
     obs = ats_input_spec.public.add_observation(main, 'water_balance', 'water_balance.csv', time_units='d',
                                                 obs_args={'times start period stop':[0.,1.,-1.],
@@ -100,3 +147,152 @@ def test_add_wrm(main):
     assert(main['state']['evaluators'].is_complete())
 
 
+
+def test_add_soil_types(main):
+    flow_pk = ats_input_spec.public.add_leaf_pk(main, 'flow', main['cycle driver']['PK tree'], 'pk-richards-flow-spec')
+
+    table = {'region_name' : ['GLHYMPS-10101', 'GLHYMPS-10102', 'GLHYMPS-10103'],
+             'label' : [1001, 1002, 1003],
+             'filename' : ['myfile.exo',]*3,
+             'porosity' : [0.25, 0.5, 0.3],
+             'permeability' : [1.e-12, 1.e-10, 1.e-11],
+             'compressibility' : [1.e-9, 1.e-7, 1.e-8],
+             'van_genuchten_alpha' : [0.0001, 0.0001, 0.0002],
+             'van_genuchten_n' : [1.8, 1.54, 2.0],
+             'residual_sat' : [0.1, 0.05, 0.0],
+             'smoothing_interval' : [0.01, float('nan'), 0.01]}
+    ats_input_spec.public.add_soil_types(main, table)
+    print(main)
+    assert(main['state']['evaluators'].is_complete())
+    assert(main['regions']['GLHYMPS-10102']['label'] == '1002')
+    assert(main['state']['evaluators']['base_porosity']['function']['GLHYMPS-10102']['region'] == 'GLHYMPS-10102')
+
+    wrm = main['state']['model parameters']['WRM parameters']
+    assert(len(wrm) == 3)
+    assert(wrm['GLHYMPS-10103']['van Genuchten n [-]'] == 2.0)
+    assert('smoothing interval width [saturation]' in [p.name for p in wrm['GLHYMPS-10101'].valued()])
+    assert('smoothing interval width [saturation]' not in [p.name for p in wrm['GLHYMPS-10102'].valued()])
+    # rows with and without smoothing keep the order of the table
+    assert(list(wrm.keys()) == table['region_name'])
+
+    # a second call adds to the existing evaluators
+    ats_input_spec.public.add_soil_types(main, {'region_name' : ['GLHYMPS-10104',],
+                                                'porosity' : [0.1,]})
+    assert(len(main['state']['evaluators']['base_porosity']['function']) == 4)
+
+def test_add_regions(main):
+    n = 10000
+    names = [f'box {i}' for i in range(n)]
+    lows = np.zeros((n,3))
+    lows[:,0] = np.arange(n)
+    highs = lows + 1.
+    ats_input_spec.public.add_regions(main, 'box', names, low_coordinate=lows, high_coordinate=highs)
+
+    labels = np.arange(1000, 1010)
+    ats_input_spec.public.add_regions(main, 'labeled set', [f'soil {l}' for l in labels],
+                                      label=labels, file='mymesh.exo', format='Exodus II', entity='CELL')
+    assert(len(main['regions']) == n + 10)
+    assert(main['regions'].is_complete())
+    assert(main['regions']['box 7']['region type'] == 'box')
+    assert(main['regions']['box 7']['low coordinate'] == [7.0, 0.0, 0.0])
+    assert(main['regions']['box 7']['high coordinate'] == [8.0, 1.0, 1.0])
+    assert(main['regions']['soil 1003']['label'] == '1003')
+    assert(main['regions']['soil 1003']['file'] == 'mymesh.exo')
+
+def test_set_land_cover_types(main):
+    table = {'land_cover_name' : ['Deciduous Forest', 'Evergreen Forest', 'Shrub/Scrub'],
+             'rooting depth max [m]' : [10., 10., float('nan')],
+             'albedo_of_canopy_[-]' : [0.1, 0.08, 0.12],
+             'leaf on time [doy]' : [130., float('nan'), float('nan')],
+             'leaf off time [doy]' : [280., float('nan'), float('nan')]}
+    lc_list = ats_input_spec.public.set_land_cover_types(main, table,
+                                                         defaults={'snow transition depth [m]':0.05})
+    assert(lc_list.is_complete())
+    assert(len(lc_list) == 3)
+    assert(list(lc_list.keys()) == table['land_cover_name'])
+    assert(lc_list['Deciduous Forest']['rooting depth max [m]'] == 10.)
+    assert(lc_list['Deciduous Forest']['leaf on time [doy]'] == 130)
+    assert(lc_list['Shrub/Scrub']['rooting depth max [m]'] == 5.)
+    assert(lc_list['Shrub/Scrub']['leaf on time [doy]'] == -1)
+    assert(lc_list['Shrub/Scrub']['albedo of canopy [-]'] == 0.12)
+    assert(lc_list['Evergreen Forest']['snow transition depth [m]'] == 0.05)
+
+    with pytest.raises(KeyError):
+        ats_input_spec.public.set_land_cover_types(main, {'land_cover_name' : ['Other',],
+                                                          'not a parameter' : [1.0,]})
+
+def test_set_land_cover_types_csv(main, tmp_path):
+    filename = str(tmp_path / 'land_cover.csv')
+    with open(filename, 'w') as fid:
+        fid.write('land_cover_name,"rooting depth max [m]","albedo of canopy [-]"\n'
+                  'Deciduous Forest,10.0,0.1\nShrub/Scrub,,0.12\n')
+    lc_list = ats_input_spec.public.set_land_cover_types(main, filename)
+    assert(list(lc_list.keys()) == ['Deciduous Forest', 'Shrub/Scrub'])
+    assert(lc_list['Shrub/Scrub']['rooting depth max [m]'] == 5.)
+    assert(lc_list['Shrub/Scrub']['albedo of canopy [-]'] == 0.12)
+
+    # a quoted name with a comma is one column, which is not a parameter
+    with open(filename, 'w') as fid:
+        fid.write('land_cover_name,"albedo, canopy"\nForest,0.1\n')
+    with pytest.raises(KeyError) as err:
+        ats_input_spec.public.set_land_cover_types(main, filename)
+    assert('albedo, canopy' in str(err.value))
+
+
+def _box_fragment(names, fragment=None):
+    if fragment is None:
+        fragment = ats_input_spec.public.get_main()
+    lows = np.zeros((len(names),3))
+    lows[:,0] = [int(name.split()[1]) for name in names]
+    ats_input_spec.public.add_regions(fragment, 'box', names, low_coordinate=lows, high_coordinate=lows+1.)
+    return fragment
+
+def test_merge(main):
+    names = [f'box {i}' for i in range(40)]
+    serial = ats_input_spec.public.get_main()
+    ats_input_spec.public.add_domain(serial, "domain", 3, "read mesh file", {"file":"../mymesh.exo"})
+    serial['cycle driver']['end time'] = 1.0
+    _box_fragment(names, serial)
+
+    ats_input_spec.public.add_domain(main, "domain", 3, "read mesh file", {"file":"../mymesh.exo"})
+    fragment = ats_input_spec.public.get_main()
+    fragment['cycle driver']['end time'] = 1.0
+    fragments = [_box_fragment(names[i:i+10]) for i in range(0, 40, 10)]
+    ats_input_spec.specs.merge(main, fragment, *fragments)
+    assert(main.same_as(serial))
+    assert(list(main['regions'].keys())[-40:] == names)
+
+    # conflicting values
+    fragment = ats_input_spec.public.get_main()
+    fragment['cycle driver']['end time'] = 2.0
+    ats_input_spec.public.add_region(fragment, 'new region', 'all')
+    with pytest.raises(ValueError):
+        ats_input_spec.specs.merge(main, fragment)
+    assert(main.same_as(serial))
+    ats_input_spec.specs.merge(main, fragment, on_conflict='ours')
+    assert(main['cycle driver']['end time'] == 1.0)
+    assert('new region' in main['regions'])
+
+    # a merged fragment's entries are in main, so it cannot be merged again
+    with pytest.raises(ValueError):
+        ats_input_spec.specs.merge(main, fragment, on_conflict='theirs')
+    other = ats_input_spec.public.get_main()
+    with pytest.raises(ValueError):
+        ats_input_spec.specs.merge(other, fragment)
+    assert('new region' not in other['regions'])
+
+    fragment = ats_input_spec.public.get_main()
+    fragment['cycle driver']['end time'] = 2.0
+    ats_input_spec.specs.merge(main, fragment, on_conflict='theirs')
+    assert(main['cycle driver']['end time'] == 2.0)
+
+    # conflicting types
+    fragment = ats_input_spec.public.get_main()
+    ats_input_spec.public.add_region(fragment, 'box 3', 'all')
+    paths = []
+    def keep_ours(path, ours, theirs):
+        paths.append(path)
+        return ours
+    ats_input_spec.specs.merge(main, fragment, on_conflict=keep_ours)
+    assert(paths == [('regions', 'box 3')])
+    assert(main['regions']['box 3']['region type'] == 'box')
@@ -10,6 +10,11 @@ Tests for the public interface, full capability.
 
 """
 import pytest
+import io
+import os
+import numpy as np
+import xml.etree.ElementTree
+import ats_input_spec.specs
 import ats_input_spec.public
 import ats_input_spec.printing
 import ats_input_spec.io
@@ -34,15 +39,477 @@ def main():
     ats_input_spec.public.add_to_all_visualization(main, "times start period stop", ats_input_spec.public.time_in_seconds([0,1,-1], 'd'))
     return main
     
-def test_writing(main):
-    ats_input_spec.io.write(main, 'ats_input_spec/tests/out.xml')
+def test_writing(main, tmp_path):
+    filename = str(tmp_path / 'out.xml')
+    ats_input_spec.io.write(main, filename)
 
     with open('ats_input_spec/tests/out_gold.xml', 'r') as fid:
         lines_gold = fid.read()
 
-    with open('ats_input_spec/tests/out.xml', 'r') as fid:
+    with open(filename, 'r') as fid:
         lines = fid.read()
 
     assert(lines_gold == lines)
-        
-    
+
+
+def test_writing_amanzi_xml(main, tmp_path):
+    pytest.importorskip('amanzi_xml')
+    filename = str(tmp_path / 'out.xml')
+    ats_input_spec.io.write(main, filename, backend='amanzi_xml')
+
+    with open('ats_input_spec/tests/out_gold.xml', 'r') as fid:
+        lines_gold = fid.read()
+
+    with open(filename, 'r') as fid:
+        lines = fid.read()
+
+    assert(lines_gold == lines)
+
+
+def test_to_xml_native(main):
+    xml_native = ats_input_spec.io.to_xml(main, backend='native')
+    assert(xml_native.tag == 'ParameterList')
+    assert(xml_native.get('name') == 'Main')
+    assert([e.get('name') for e in xml_native] == ['cycle driver', 'mesh', 'regions', 'visualization', 'checkpoint'])
+    assert(xml_native.find('./ParameterList[@name="checkpoint"]/Parameter').get('value') == '{0.0, 31536000.0, -31536000.0}')
+
+    # native is the default, as amanzi_xml is optional
+    assert(xml.etree.ElementTree.tostring(ats_input_spec.io.to_xml(main)) ==
+           xml.etree.ElementTree.tostring(xml_native))
+
+    with pytest.raises(ValueError):
+        ats_input_spec.io.to_xml(main, backend='lxml')
+
+
+def test_write_stream(main):
+    with open('ats_input_spec/tests/out_gold.xml', 'r') as fid:
+        lines_gold = fid.read()
+
+    # text streams
+    fid = io.StringIO()
+    ats_input_spec.io.write_stream(main, fid)
+    assert(lines_gold == fid.getvalue())
+
+    # binary streams
+    fid = io.BytesIO()
+    ats_input_spec.io.write_stream(main, fid)
+    assert(lines_gold.encode('utf-8') == fid.getvalue())
+
+
+def test_write_stream_escape():
+    pars = [ats_input_spec.specs.Parameter('a <"quoted"> & name', str, value='x & y'),
+            ats_input_spec.specs.Parameter('flags', ats_input_spec.primitives.ListBool, value=[True, False]),
+            ats_input_spec.specs.Parameter('count', int, value=3),
+            ats_input_spec.specs.Parameter('unset', float, default=1.0)]
+    main = ats_input_spec.specs.Spec([ats_input_spec.specs.ParameterCollection(pars),])
+
+    fid = io.StringIO()
+    ats_input_spec.io.write_stream(main, fid)
+    assert(fid.getvalue() == '\n'.join([
+        '<ParameterList name="Main" type="ParameterList">',
+        '  <Parameter name="a &lt;&quot;quoted&quot;&gt; &amp; name" type="string" value="x &amp; y"/>',
+        '  <Parameter name="flags" type="Array(bool)" value="{true, false}"/>',
+        '  <Parameter name="count" type="int" value="3"/>',
+        '</ParameterList>',
+        '']))
+
+
+def test_write_array(main):
+    with open('ats_input_spec/tests/out_gold.xml', 'r') as fid:
+        lines_gold = fid.read()
+
+    # numpy arrays are written as the equivalent lists
+    times = np.array(main["checkpoint"]["times start period stop"])
+    main["checkpoint"]["times start period stop"] = times
+    assert(main["checkpoint"]["times start period stop"] is not times)
+    assert(np.shares_memory(main["checkpoint"]["times start period stop"], times))
+    fid = io.StringIO()
+    ats_input_spec.io.write_stream(main, fid)
+    assert(lines_gold == fid.getvalue())
+
+    # exactly
+    main["checkpoint"]["times start period stop"] = np.array([0.1, 1./3, -1.e-300])
+    xml = ats_input_spec.io.to_xml(main, backend='native')
+    value = xml.find('./ParameterList[@name="checkpoint"]/Parameter').get('value')
+    assert(value == '{0.1, 0.3333333333333333, -1e-300}')
+
+    # copies share the read-only array
+    copy = main.copy()
+    assert(copy["checkpoint"]["times start period stop"] is main["checkpoint"]["times start period stop"])
+
+
+def test_write_sidecar(main, tmp_path):
+    h5py = pytest.importorskip('h5py')
+    known_specs = ats_input_spec.public.known_specs
+    ev = main['state']['evaluators'].append_empty('surface-air_temperature')
+    ev.set_type('independent variable', known_specs['evaluator-independent-variable-spec'])
+    for name, n in [('large', 100), ('small', 10)]:
+        entry = ev['function'].append_empty(name)
+        entry['region'] = name
+        entry['component'] = 'cell'
+        ats_input_spec.public.set_tabular_function(entry['function'], np.arange(n)*3600., np.ones(n))
+
+    sidecar = str(tmp_path / 'forcing.h5')
+    filename = str(tmp_path / 'run.xml')
+    ats_input_spec.io.write(main, filename, sidecar=sidecar, known_specs=known_specs, sidecar_min_size=50)
+
+    root = xml.etree.ElementTree.parse(filename).getroot()
+    large = root.find('.//ParameterList[@name="large"]/ParameterList[@name="function"]/ParameterList[@name="function-tabular"]')
+    assert([p.get('name') for p in large] == ['file', 'x header', 'y header'])
+    assert(large[0].get('value') == sidecar)
+    small = root.find('.//ParameterList[@name="small"]/ParameterList[@name="function"]/ParameterList[@name="function-tabular"]')
+    assert([p.get('name') for p in small] == ['x values', 'y values'])
+
+    with h5py.File(sidecar, 'r') as fid:
+        assert(fid[large[1].get('value')][:].tolist() == (np.arange(100)*3600.).tolist())
+        assert(len(fid) == 2)
+
+    # main is unchanged
+    assert(len(ev['function']['large']['function']['function-tabular']['x values']) == 100)
+
+    # an unchanged sidecar is not written again
+    stat = os.stat(sidecar)
+    assert(not ats_input_spec.io.write(main, filename, sidecar=sidecar, known_specs=known_specs,
+                                       sidecar_min_size=50, only_if_changed=True))
+    assert(os.stat(sidecar).st_mtime_ns == stat.st_mtime_ns)
+    ev['function']['large']['function']['function-tabular']['y values'] = np.zeros(100)
+    assert(not ats_input_spec.io.write(main, filename, sidecar=sidecar, known_specs=known_specs,
+                                       sidecar_min_size=50, only_if_changed=True))
+    with h5py.File(sidecar, 'r') as fid:
+        assert(fid[large[2].get('value')][:].tolist() == [0.0,]*100)
+
+    with pytest.raises(ValueError):
+        ats_input_spec.io.write(main, filename, sidecar=sidecar)
+
+
+def test_write_ensemble(main, tmp_path):
+    variations = [{('cycle driver', 'end time'):float(i),
+                   ('checkpoint', 'times start period stop'):[0., float(i+1), -1.]}
+                  for i in range(3)]
+    variations[1][('cycle driver', 'end time units')] = 'd'
+    variations[2] = {'checkpoint':{'times start period stop':[1., 2., 3.]}}
+
+    out_pattern = str(tmp_path / 'run_{i:02d}.xml')
+    filenames = ats_input_spec.io.write_ensemble(main, variations, out_pattern)
+    assert(filenames == [str(tmp_path / f'run_{i:02d}.xml') for i in range(3)])
+    assert(main['cycle driver']['end time'] == 1.0)
+
+    for variation, filename in zip(variations, filenames):
+        expected = main.copy()
+        for path, value in variation.items():
+            if isinstance(path, str):
+                expected[path].update(value)
+            else:
+                expected[path[0]][path[1]] = value
+        fid = io.StringIO()
+        ats_input_spec.io.write_stream(expected, fid)
+        with open(filename, 'r') as fid2:
+            assert(fid.getvalue() == fid2.read())
+
+    # in parallel
+    filenames2 = ats_input_spec.io.write_ensemble(main, variations, str(tmp_path / 'par_{i:02d}.xml'), workers=2)
+    for filename, filename2 in zip(filenames, filenames2):
+        with open(filename, 'rb') as fid, open(filename2, 'rb') as fid2:
+            assert(fid.read() == fid2.read())
+
+
+def test_write_ensemble_empty(tmp_path):
+    # a varied list that has no value in a member is not written
+    template = ats_input_spec.public.get_main()
+    ats_input_spec.public.add_domain(template, "domain", 3, "read mesh file", {"file":"../mymesh.exo"})
+    variations = [{('checkpoint', 'times start period stop'):[0., 1., -1.]}, {}]
+    filenames = ats_input_spec.io.write_ensemble(template, variations, str(tmp_path / 'run_{i}.xml'))
+    with open(filenames[1], 'r') as fid:
+        lines = fid.read()
+    assert(lines == _write_string(template))
+    assert('checkpoint' not in lines)
+
+
+def test_write_ensemble_missing(main, tmp_path):
+    with pytest.raises(KeyError):
+        ats_input_spec.io.write_ensemble(main, [{('cycle driver', 'not a parameter'):1.0},],
+                                         str(tmp_path / 'run_{i}.xml'))
+
+
+def test_write_bindings(main, tmp_path):
+    with open('ats_input_spec/tests/out_gold.xml', 'r') as fid:
+        lines_gold = fid.read()
+
+    main['cycle driver']['end time'] = ats_input_spec.primitives.Placeholder('t_end', float)
+    main['cycle driver']['end time units'] = ats_input_spec.primitives.Placeholder('units', str)
+
+    filename = str(tmp_path / 'out.xml')
+    ats_input_spec.io.write(main, filename, bindings={'t_end':1, 'units':'yr', 'unused':2})
+    with open(filename, 'r') as fid:
+        assert(lines_gold == fid.read())
+
+    # unbound placeholders are reported before the file is opened
+    filename = str(tmp_path / 'unbound.xml')
+    with pytest.raises(KeyError) as err:
+        ats_input_spec.io.write(main, filename, bindings={'t_end':1.0})
+    assert('units' in str(err.value))
+    assert(not os.path.exists(filename))
+
+    # bindings are validated
+    with pytest.raises(TypeError):
+        ats_input_spec.io.write(main, filename, bindings={'t_end':'one', 'units':'yr'})
+    assert(not os.path.exists(filename))
+
+
+def test_write_bindings_unwritten():
+    specs = ats_input_spec.specs
+    one_of = specs.OneOf([specs.ParameterCollection([specs.Parameter('region', str)]),
+                          specs.ParameterCollection([specs.Parameter('other region', str)])])
+    main = specs.Spec([specs.ParameterCollection([specs.Parameter('observation', value=specs.Spec([one_of])),
+                                                  specs.Parameter('variable', str)])])
+    main['variable'] = 'x'
+    # in a branch that is not selected, so not written and not bound
+    one_of.collections[1]['other region'] = ats_input_spec.primitives.Placeholder('region', str)
+    lines = _write_string(main)
+    assert('observation' not in lines)
+    assert(_write_string(main, cache=True) == lines)
+
+
+def _write_string(main, **kwargs):
+    fid = io.StringIO()
+    ats_input_spec.io.write_stream(main, fid, **kwargs)
+    return fid.getvalue()
+
+
+def test_write_cache(main):
+    with open('ats_input_spec/tests/out_gold.xml', 'r') as fid:
+        lines_gold = fid.read()
+    assert(_write_string(main, cache=True) == lines_gold)
+    assert(_write_string(main, cache=True) == lines_gold)
+
+    # changes clear the cache of their containers only
+    main['cycle driver']['end time'] = 2.0
+    assert(main['cycle driver']._xml_cache is None)
+    assert(main._xml_cache is None)
+    assert(main['checkpoint']._xml_cache is not None)
+    assert(_write_string(main, cache=True) == _write_string(main))
+
+    # as do changes through Parameter objects
+    par = ats_input_spec.specs.find_parameter(main, ('checkpoint', 'times start period stop'))
+    par.set([0., 1., 2.])
+    assert(_write_string(main, cache=True) == _write_string(main))
+
+    # and appending to lists
+    ats_input_spec.public.add_region(main, 'box', 'box', {'low coordinate':[0.,0.,0.], 'high coordinate':[1.,1.,1.]})
+    assert('"box"' in _write_string(main, cache=True))
+    assert(_write_string(main, cache=True) == _write_string(main))
+
+    # copies do not share the cache
+    copy = main.copy()
+    copy['cycle driver']['end time'] = 3.0
+    assert(_write_string(copy, cache=True) == _write_string(copy))
+    assert('value="2.0"' in _write_string(main, cache=True))
+
+    # placeholders are not cached
+    main['cycle driver']['end time'] = ats_input_spec.primitives.Placeholder('t_end', float)
+    assert('value="4.0"' in _write_string(main, cache=True, bindings={'t_end':4.0}))
+    assert('value="5.0"' in _write_string(main, cache=True, bindings={'t_end':5.0}))
+    with pytest.raises(KeyError):
+        _write_string(main, cache=True)
+
+
+def test_write_cache_transaction(main):
+    lines_gold = _write_string(main, cache=True)
+    with pytest.raises(RuntimeError):
+        with ats_input_spec.specs.transaction():
+            main['cycle driver']['end time'] = 2.0
+            ats_input_spec.public.add_region(main, 'box', 'box', {'low coordinate':[0.,0.,0.], 'high coordinate':[1.,1.,1.]})
+            assert(_write_string(main, cache=True) == _write_string(main))
+            assert('"box"' in _write_string(main, cache=True))
+            raise RuntimeError('undo')
+    assert(_write_string(main, cache=True) == lines_gold)
+    assert(_write_string(main) == lines_gold)
+
+    # bindings are resolved in lists changed in the transaction
+    with ats_input_spec.specs.transaction():
+        main['cycle driver']['end time'] = ats_input_spec.primitives.Placeholder('p', float)
+        lines = _write_string(main, cache=True, bindings={'p':5.0})
+    assert(lines == _write_string(main, bindings={'p':5.0}))
+    assert('value="5.0"' in lines)
+
+
+def test_transaction_two_mains(main):
+    # transactions are of the process, so are not methods of a main
+    assert(not hasattr(main, 'transaction'))
+    assert(not hasattr(main, 'restore'))
+    other = ats_input_spec.public.get_main()
+    other['cycle driver']['end time'] = 3.0
+    lines_gold = _write_string(main, cache=True)
+    other_gold = _write_string(other, cache=True)
+    with pytest.raises(RuntimeError):
+        with ats_input_spec.specs.transaction():
+            main['cycle driver']['end time'] = 2.0
+            other['cycle driver']['end time'] = 4.0
+            raise RuntimeError('undo')
+    assert(_write_string(main, cache=True) == lines_gold)
+    assert(_write_string(other, cache=True) == other_gold)
+    assert(other['cycle driver']['end time'] == 3.0)
+
+
+def test_write_cache_unwritten(main):
+    # setting values in a list that was empty when cached
+    _write_string(main, cache=True)
+    main['state']['initial conditions'].append_empty('pressure')['value'] = 101325.0
+    assert(_write_string(main, cache=True) == _write_string(main))
+
+
+def test_write_cache_columns(main):
+    names = [f'soil {i}' for i in range(10)]
+    ats_input_spec.public.add_soil_types(main, {'region_name' : names,
+                                                'porosity' : np.linspace(0.2, 0.4, 10)})
+    _write_string(main, cache=True)
+
+    # changes in the sublists of an entry stored in columns clear the cache
+    entry = main['state']['evaluators']['base_porosity']['function']['soil 3']
+    entry['function'].get_sublist()['value'] = 0.5
+    lines = _write_string(main, cache=True)
+    assert(lines == _write_string(main))
+    assert('value="0.5"' in lines)
+
+
+def test_write_only_if_changed(main, tmp_path, monkeypatch):
+    filename = str(tmp_path / 'run.xml')
+    assert(ats_input_spec.io.write(main, filename, only_if_changed=True))
+    with open(filename, 'r') as fid:
+        assert(fid.read() == _write_string(main))
+    stat = os.stat(filename)
+
+    # the same content is not written
+    assert(not ats_input_spec.io.write(main, filename, only_if_changed=True))
+    assert(not ats_input_spec.io.write(main, filename, cache=True, only_if_changed=True))
+    assert(os.stat(filename).st_mtime_ns == stat.st_mtime_ns)
+    assert(os.stat(filename).st_ino == stat.st_ino)
+
+    # changes, including a file that is longer or shorter, replace it
+    main['cycle driver']['end time'] = 2.0
+    assert(ats_input_spec.io.write(main, filename, only_if_changed=True))
+    assert(os.stat(filename).st_ino != stat.st_ino)
+    with open(filename, 'a') as fid:
+        fid.write('\n')
+    assert(ats_input_spec.io.write(main, filename, only_if_changed=True))
+    main['cycle driver']['end time'] = 2.5
+    with open(filename, 'r') as fid:
+        assert(fid.read() != _write_string(main))
+    assert(ats_input_spec.io.write(main, filename, only_if_changed=True))
+    with open(filename, 'r') as fid:
+        assert(fid.read() == _write_string(main))
+    assert(os.listdir(str(tmp_path)) == ['run.xml',])
+
+    # or against a stored hash
+    digest = ats_input_spec.io.content_hash(main)
+    stat = os.stat(filename)
+    assert(not ats_input_spec.io.write(main, filename, only_if_changed=digest))
+    assert(os.stat(filename).st_ino == stat.st_ino)
+    main['cycle driver']['end time'] = 3.0
+    assert(ats_input_spec.io.write(main, filename, only_if_changed=digest))
+    assert(ats_input_spec.io.content_hash(main) != digest)
+    with open(filename, 'r') as fid:
+        assert(fid.read() == _write_string(main))
+    assert(not ats_input_spec.io.write(main, filename, only_if_changed=ats_input_spec.io.content_hash(main)))
+    assert(os.listdir(str(tmp_path)) == ['run.xml',])
+
+    # an unchanged write against a digest creates no file
+    def no_write(*args):
+        raise AssertionError('A file was written.')
+    monkeypatch.setattr(ats_input_spec.io, '_replace', no_write)
+    assert(not ats_input_spec.io.write(main, filename, only_if_changed=ats_input_spec.io.content_hash(main)))
+    monkeypatch.undo()
+
+    # which compares the native xml
+    with pytest.raises(ValueError):
+        ats_input_spec.io.write(main, filename, backend='amanzi_xml', only_if_changed=True)
+
+
+@pytest.mark.parametrize('format', ['tar', 'zip'])
+def test_write_many(main, tmp_path, format):
+    def members():
+        for i in range(3):
+            member = main.copy()
+            member['cycle driver']['end time'] = float(i)
+            yield member
+    archive = str(tmp_path / f'ensemble.{format}')
+    names = ats_input_spec.io.write_many(members(), archive, format)
+    assert(names == ['000000.xml', '000001.xml', '000002.xml'])
+    assert(os.listdir(str(tmp_path)) == [f'ensemble.{format}',])
+
+    # deterministic, also to a stream
+    stream = io.BytesIO()
+    ats_input_spec.io.write_many(members(), stream, format)
+    with open(archive, 'rb') as fid:
+        assert(fid.read() == stream.getvalue())
+
+    for source in [archive, stream]:
+        read = ats_input_spec.io.read_many(source, ats_input_spec.public.known_specs)
+        for expected, (name, member) in zip(members(), read):
+            assert(_write_string(member) == _write_string(expected))
+        assert(name == '000002.xml')
+
+    with pytest.raises(ValueError):
+        ats_input_spec.io.write_many(members(), archive, 'rar')
+
+
+def test_write_delta(main, tmp_path):
+    base = main.copy()
+    base_file = str(tmp_path / 'base.xml')
+    ats_input_spec.io.write(base, base_file)
+
+    main['cycle driver']['end time'] = 2.0
+    ats_input_spec.public.add_region(main, 'box', 'box', {'low coordinate':[0.,0.,0.], 'high coordinate':[1.,1.,1.]})
+    del main['regions']['computational domain boundary']
+
+    patch = str(tmp_path / 'patch.xml')
+    ats_input_spec.io.write_delta(main, base, patch)
+    root = xml.etree.ElementTree.parse(patch).getroot()
+    assert([e.get('name') for e in root] == ['cycle driver', 'regions'])
+    assert([(e.tag, e.get('name')) for e in root.find('ParameterList[@name="cycle driver"]')] == [('Parameter', 'end time')])
+    assert([(e.tag, e.get('name')) for e in root.find('ParameterList[@name="regions"]')] ==
+           [('ParameterList', 'box'), ('Remove', 'computational domain boundary')])
+    assert(os.path.getsize(patch) < os.path.getsize(base_file) / 2)
+
+    # applied to a main or the file, as xml or read into a main
+    expected = xml.etree.ElementTree.tostring(ats_input_spec.io.to_xml(main, 'native'))
+    for source in [base, base_file]:
+        assert(xml.etree.ElementTree.tostring(ats_input_spec.io.apply_delta(source, patch)) == expected)
+    patched = ats_input_spec.io.apply_delta(base_file, patch, ats_input_spec.public.known_specs)
+    assert(patched['cycle driver']['end time'] == 2.0)
+    assert(list(patched['regions'].keys()) == ['computational domain', 'box'])
+    assert(base['cycle driver']['end time'] == 1.0)
+
+    # no changes
+    ats_input_spec.io.write_delta(base, base_file, patch)
+    assert(len(xml.etree.ElementTree.parse(patch).getroot()) == 0)
+    assert(xml.etree.ElementTree.tostring(ats_input_spec.io.apply_delta(base, patch)) ==
+           xml.etree.ElementTree.tostring(ats_input_spec.io.to_xml(base, 'native')))
+
+
+def test_write_delta_insert(main, tmp_path):
+    ats_input_spec.public.add_region(main, 'box', 'box', {'low coordinate':[0.,0.,0.], 'high coordinate':[1.,1.,1.]})
+    ats_input_spec.public.add_region(main, 'box 2', 'box', {'low coordinate':[1.,0.,0.], 'high coordinate':[2.,1.,1.]})
+    base = main.copy()
+    del base['regions']['computational domain']
+    del base['regions']['box']
+    main['cycle driver']['end time'] = 2.0
+
+    patch = str(tmp_path / 'patch.xml')
+    ats_input_spec.io.write_delta(main, base, patch)
+    root = xml.etree.ElementTree.parse(patch).getroot()
+    assert([(e.tag, e.get('name')) for e in root.find('ParameterList[@name="regions"]')] ==
+           [('After', ''), ('ParameterList', 'computational domain'),
+            ('After', 'computational domain boundary'), ('ParameterList', 'box')])
+
+    # entries inserted mid-list are where they are in main
+    patched = ats_input_spec.io.apply_delta(base, patch, ats_input_spec.public.known_specs)
+    assert(list(patched['regions'].keys()) == list(main['regions'].keys()))
+    main_file = str(tmp_path / 'main.xml')
+    patched_file = str(tmp_path / 'patched.xml')
+    ats_input_spec.io.write(main, main_file)
+    ats_input_spec.io.write(patched, patched_file)
+    with open(main_file, 'rb') as fid:
+        expected = fid.read()
+    with open(patched_file, 'rb') as fid:
+        assert(fid.read() == expected)
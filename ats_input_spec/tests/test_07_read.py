@@ -0,0 +1,221 @@
+"""ats_input_spec/tests/test_07_read.py
+
+ATS is released under the three-clause BSD License. 
+The terms of use and "as is" disclaimer for this license are 
+provided in the top-level COPYRIGHT file.
+
+Tests for reading xml files into a main.
+
+"""
+import pytest
+import io
+import os
+import copy
+import pickle
+import numpy as np
+import ats_input_spec.primitives
+import ats_input_spec.specs as specs
+import ats_input_spec.public
+import ats_input_spec.io
+
+@pytest.fixture
+def main():
+    main = ats_input_spec.public.get_main()
+    ats_input_spec.public.add_domain(main, "domain", 3, "read mesh file", {"file":"../mymesh.exo"})
+    main["cycle driver"]["end time"] = 1.0
+    main["cycle driver"]["end time units"] = "yr"
+    return main
+
+
+def _write_string(main):
+    fid = io.StringIO()
+    ats_input_spec.io.write_stream(main, fid)
+    return fid.getvalue()
+
+
+def test_read_gold():
+    main = ats_input_spec.io.read('ats_input_spec/tests/out_gold.xml', ats_input_spec.public.known_specs)
+    with open('ats_input_spec/tests/out_gold.xml', 'r') as fid:
+        assert(fid.read() == _write_string(main))
+    assert(main['mesh']['domain']['mesh type'] == 'read mesh file')
+    assert(main['regions']['computational domain']['empty'])
+
+
+def test_read_round_trip(main, tmp_path):
+    ats_input_spec.public.add_leaf_pk(main, 'flow', main['cycle driver']['PK tree'], 'pk-richards-flow-spec')
+    table = {'region_name' : ['GLHYMPS-10101', 'GLHYMPS-10102'],
+             'label' : [1001, 1002],
+             'filename' : ['myfile.exo',]*2,
+             'porosity' : [0.25, 0.5],
+             'permeability' : [1.e-12, 1.e-10],
+             'van_genuchten_alpha' : [0.0001, 0.0001],
+             'van_genuchten_n' : [1.8, 1.54],
+             'residual_sat' : [0.1, 0.05],
+             'smoothing_interval' : [0.01, float('nan')]}
+    ats_input_spec.public.add_soil_types(main, table)
+    n = 100
+    lows = np.zeros((n,3))
+    lows[:,0] = np.arange(n)
+    ats_input_spec.public.add_regions(main, 'box', [f'box {i}' for i in range(n)],
+                                      low_coordinate=lows, high_coordinate=lows+1.)
+
+    filename = str(tmp_path / 'round_trip.xml')
+    ats_input_spec.io.write(main, filename)
+    problems = []
+    main2 = ats_input_spec.io.read(filename, ats_input_spec.public.known_specs, problems)
+    assert(_write_string(main) == _write_string(main2))
+
+    # add_leaf_pk() uses a type with no spec of its own, which is read unchecked
+    assert(problems == ['Main -> PKs -> flow: Unknown pk type "richards", its parameters are not checked.'])
+    assert(main2['regions']['box 7']['high coordinate'] == [8.0, 1.0, 1.0])
+
+
+def test_read_arrays(tmp_path):
+    values = {'Array(double)' : [0.5, -1.0], 'Array(int)' : [1, 2, 3],
+              'Array(bool)' : [True, False], 'Array(string)' : ['a', 'b c']}
+    pars = [specs.Parameter(ptype, ats_input_spec.primitives.text_to_primitive[ptype]) for ptype in values]
+    known_specs = specs.SpecDict({'main-spec' : specs.Spec([specs.ParameterCollection(pars)])})
+    main = known_specs['main-spec']
+    for ptype, value in values.items():
+        main[ptype] = value
+
+    filename = str(tmp_path / 'arrays.xml')
+    ats_input_spec.io.write(main, filename)
+    main2 = ats_input_spec.io.read(filename, known_specs)
+    for ptype, value in values.items():
+        assert(main2[ptype] == value)
+
+
+bad_xml = b'''<ParameterList name="Main" type="ParameterList">
+  <ParameterList name="cycle driver" type="ParameterList">
+    <Parameter name="end time" type="int" value="1"/>
+    <Parameter name="end time units" type="string" value="yr"/>
+    <Parameter name="not a parameter" type="double" value="1.0"/>
+    <ParameterList name="required times" type="ParameterList">
+      <Parameter name="times start period stop" type="Array(double)" value="{0.0, one}"/>
+    </ParameterList>
+  </ParameterList>
+</ParameterList>
+'''
+
+def test_read_problems():
+    with pytest.raises(TypeError):
+        ats_input_spec.io.read(io.BytesIO(bad_xml), ats_input_spec.public.known_specs)
+
+    problems = []
+    main = ats_input_spec.io.read(io.BytesIO(bad_xml), ats_input_spec.public.known_specs, problems)
+    assert(len(problems) == 3)
+    assert(problems[0].startswith('Main -> cycle driver: Parameter "end time" is of type "int"'))
+    assert('Unknown parameter "not a parameter"' in problems[1])
+    assert(problems[2].startswith('Main -> cycle driver -> required times:'))
+    assert(main['cycle driver']['end time units'] == 'yr')
+
+    # repeated entries of a list
+    duplicate_xml = b'''<ParameterList name="Main" type="ParameterList">
+  <ParameterList name="observations" type="ParameterList">
+    <ParameterList name="obs" type="ParameterList"/>
+    <ParameterList name="obs" type="ParameterList"/>
+  </ParameterList>
+</ParameterList>
+'''
+    with pytest.raises(ValueError):
+        ats_input_spec.io.read(io.BytesIO(duplicate_xml), ats_input_spec.public.known_specs)
+    problems = []
+    main = ats_input_spec.io.read(io.BytesIO(duplicate_xml), ats_input_spec.public.known_specs, problems)
+    assert(len(problems) == 1)
+    assert(problems[0].startswith('Main -> observations: Key "obs" already exists'))
+    assert(list(main['observations'].keys()) == ['obs',])
+
+
+def test_save_session(main, tmp_path):
+    ats_input_spec.public.add_leaf_pk(main, 'flow', main['cycle driver']['PK tree'], 'pk-richards-flow-spec')
+    n = 100
+    lows = np.zeros((n,3))
+    lows[:,0] = np.arange(n)
+    ats_input_spec.public.add_regions(main, 'box', [f'box {i}' for i in range(n)],
+                                      low_coordinate=lows, high_coordinate=lows+1.)
+
+    filename = str(tmp_path / 'session.pkl')
+    ats_input_spec.io.save_session({'main' : main, 'step' : 3}, filename)
+    session = ats_input_spec.io.resume_session(filename)
+    assert(session['step'] == 3)
+    assert(session['main'].same_as(main))
+    assert(_write_string(session['main']) == _write_string(main))
+    assert(session['main']['mesh']['domain']['mesh type'] == 'read mesh file')
+
+    # the file holds values, not the specs
+    assert(os.path.getsize(filename) < len(_write_string(main)))
+
+
+def _cycle_specs(end_time_type=float):
+    main = specs.Spec([specs.ParameterCollection([specs.Parameter('end time', end_time_type),
+                                                  specs.Parameter('cycles', int, default=1),
+                                                  specs.Parameter('observations', 'observation-list')])])
+    observation = specs.Spec([specs.ParameterCollection([specs.Parameter('variable', str),
+                                                         specs.Parameter('scale', float, default=1.0)])])
+    return specs.SpecDict({'main-spec' : main, 'observation' : observation})
+
+def test_pickle_spec_name():
+    known_specs = _cycle_specs()
+    main = known_specs['main-spec']
+    main['end time'] = 2.0
+    main['observations'].append_many([f'obs {i}' for i in range(20)],
+                                     [{'variable' : f'var {i}'} for i in range(20)])
+    main['observations']['obs 3']['scale'] = 2.0
+    main['observations'].append_empty('unfilled')
+    main['observations'].append_columns(['col 0', 'col 1'], {'variable' : ['a', 'b']})
+    main2 = pickle.loads(pickle.dumps(main))
+    assert(main2['end time'] == 2.0)
+    assert(main2['cycles'] == 1)
+    assert(list(main2['observations'].keys()) == list(main['observations'].keys()))
+    assert(main2['observations']['obs 3']['scale'] == 2.0)
+    assert(main2['observations']['obs 19']['variable'] == 'var 19')
+    assert(main2['observations']['col 1']['variable'] == 'b')
+    assert(main2.same_as(main))
+    assert(copy.deepcopy(main).same_as(main))
+
+    # hand-built specs pickle as they are
+    spec = specs.ParameterCollection([specs.Parameter('x', float, 1.0)])
+    assert(pickle.loads(pickle.dumps(spec)).same_as(spec))
+
+    # unpickling needs the same specs
+    known_specs = _cycle_specs(int)
+    main = known_specs['main-spec']
+    main['end time'] = 2
+    payload = pickle.dumps(main)
+    known_specs['main-spec'] = _cycle_specs()['main-spec']
+    with pytest.raises(ValueError):
+        pickle.loads(payload)
+
+
+def _pickled_same(main):
+    main2 = pickle.loads(pickle.dumps(main))
+    return main2.same_as(main) and _write_string(main2) == _write_string(main)
+
+def test_pickle_public(main):
+    n = 10
+    names = [f'soil {i}' for i in range(n)]
+
+    # typed functions with their values in columns
+    soils = main.copy()
+    ats_input_spec.public.add_soil_types(soils, {'region_name' : names,
+                                                 'porosity' : np.linspace(0.2, 0.4, n),
+                                                 'van_genuchten_alpha' : np.full(n, 1.e-4),
+                                                 'van_genuchten_n' : np.full(n, 2.0),
+                                                 'residual_sat' : np.full(n, 0.1)})
+    assert(_pickled_same(soils))
+
+    # lists set in an open list
+    land_cover = main.copy()
+    ats_input_spec.public.set_land_cover_types(land_cover, {'land_cover_name' : names,
+                                                            'rooting depth max [m]' : np.full(n, 2.0)})
+    assert(_pickled_same(land_cover))
+
+    # enough entries added one at a time to be pickled as columns
+    soils = main.copy()
+    for name in names:
+        ats_input_spec.public.add_soil_type(soils, name, porosity=0.3, van_genuchten_alpha=1.e-4,
+                                            van_genuchten_n=2.0, residual_sat=0.1)
+        ats_input_spec.public.set_land_cover_default_constants(soils, name)
+    assert(n >= ats_input_spec.io._min_column_run)
+    assert(_pickled_same(soils))
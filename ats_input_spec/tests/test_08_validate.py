@@ -0,0 +1,91 @@
+"""ats_input_spec/tests/test_08_validate.py
+
+ATS is released under the three-clause BSD License. 
+The terms of use and "as is" disclaimer for this license are 
+provided in the top-level COPYRIGHT file.
+
+Tests for checking xml files against the specs.
+
+"""
+import pytest
+import ats_input_spec.public
+import ats_input_spec.io
+import ats_input_spec.validate
+
+bad_xml = '''<ParameterList name="Main" type="ParameterList">
+  <ParameterList name="cycle driver" type="ParameterList">
+    <Parameter name="end time" type="int" value="1"/>
+    <Parameter name="not a parameter" type="double" value="1.0"/>
+  </ParameterList>
+</ParameterList>
+'''
+
+@pytest.fixture
+def bad_file(tmp_path):
+    filename = str(tmp_path / 'bad.xml')
+    with open(filename, 'w') as fid:
+        fid.write(bad_xml)
+    return filename
+
+
+def test_validate(bad_file):
+    problems = ats_input_spec.validate.validate(bad_file, ats_input_spec.public.known_specs)
+    assert('Main -> cycle driver: Parameter "end time" is of type "int", but should be of type "double".' in problems)
+    assert('Main -> cycle driver: Unknown parameter "not a parameter".' in problems)
+    assert('Main -> cycle driver: Missing required parameter "end time".' in problems)
+
+    main = ats_input_spec.io.read('ats_input_spec/tests/out_gold.xml', ats_input_spec.public.known_specs)
+    main_problems = list(ats_input_spec.validate.missing(main))
+    assert(ats_input_spec.validate.validate('ats_input_spec/tests/out_gold.xml',
+                                            ats_input_spec.public.known_specs) == main_problems)
+
+
+def test_validate_invalid_xml(tmp_path):
+    filename = str(tmp_path / 'invalid.xml')
+    with open(filename, 'w') as fid:
+        fid.write(bad_xml[:-20])
+    problems = ats_input_spec.validate.validate(filename, ats_input_spec.public.known_specs)
+    assert(len(problems) == 1)
+    assert(problems[0].startswith('Invalid xml'))
+
+
+def test_validate_unreadable(tmp_path):
+    missing_file = str(tmp_path / 'missing.xml')
+    not_a_list = str(tmp_path / 'parameter.xml')
+    with open(not_a_list, 'w') as fid:
+        fid.write('<Parameter name="end time" type="double" value="1.0"/>')
+
+    results = list(ats_input_spec.validate.validate_files([missing_file, not_a_list],
+                                                          ats_input_spec.public.known_specs))
+    assert(len(results) == 2)
+    assert(results[0][1][0].startswith('Cannot read file'))
+    assert(results[1][1] == ['The root element is not a ParameterList.'])
+
+
+def test_validate_duplicate(tmp_path, bad_file):
+    duplicate = str(tmp_path / 'duplicate.xml')
+    with open(duplicate, 'w') as fid:
+        fid.write('''<ParameterList name="Main" type="ParameterList">
+  <ParameterList name="observations" type="ParameterList">
+    <ParameterList name="obs" type="ParameterList"/>
+    <ParameterList name="obs" type="ParameterList"/>
+  </ParameterList>
+</ParameterList>
+''')
+    results = list(ats_input_spec.validate.validate_files([duplicate, bad_file],
+                                                          ats_input_spec.public.known_specs))
+    assert(len(results) == 2)
+    assert('Main -> observations: Key "obs" already exists, cannot append_empty() of this name.' in results[0][1])
+    assert('Main -> cycle driver: Unknown parameter "not a parameter".' in results[1][1])
+
+
+def test_validate_main(bad_file, capsys):
+    files = ['ats_input_spec/tests/out_gold.xml', bad_file]*3
+    assert(ats_input_spec.validate.main(['-j', '2',] + files) == 1)
+    lines = capsys.readouterr().out.splitlines()
+    assert(lines[-1] == '0 of 6 files are valid.')
+    assert(f'{bad_file}: Main -> cycle driver: Unknown parameter "not a parameter".' in lines)
+
+    # results are the same in serial
+    assert(ats_input_spec.validate.main(files) == 1)
+    assert(capsys.readouterr().out.splitlines() == lines)
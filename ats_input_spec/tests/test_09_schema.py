@@ -0,0 +1,154 @@
+"""ats_input_spec/tests/test_09_schema.py
+
+ATS is released under the three-clause BSD License.
+The terms of use and "as is" disclaimer for this license are
+provided in the top-level COPYRIGHT file.
+
+Tests for exporting the specs as XML Schema and JSON Schema.
+
+"""
+import pytest
+import io
+import os
+import xml.etree.ElementTree
+import ats_input_spec.public
+import ats_input_spec.specs as specs
+import ats_input_spec.schema
+
+gold = 'ats_input_spec/tests/out_gold.xml'
+
+bad_xml = '''<ParameterList name="Main" type="ParameterList">
+  <ParameterList name="cycle driver" type="ParameterList">
+    <Parameter name="end time" type="double" value="one"/>
+    <Parameter name="not a parameter" type="double" value="1.0"/>
+  </ParameterList>
+</ParameterList>
+'''
+
+@pytest.fixture
+def bad_file(tmp_path):
+    filename = str(tmp_path / 'bad.xml')
+    with open(filename, 'w') as fid:
+        fid.write(bad_xml)
+    return filename
+
+
+def switch_specs():
+    """A spec with a ONE OF and an IF."""
+    one_of = specs.OneOf([specs.ParameterCollection([specs.Parameter('region', str)]),
+                          specs.ParameterCollection([specs.Parameter('regions', 'string-list')])])
+    switch = specs.CaseSwitch(specs.Parameter('flux', bool, default=False),
+                              {True : specs.ParameterCollection([specs.Parameter('direction', str)]),
+                               False : specs.ParameterCollection([specs.Parameter('scale', float, default=1.0)])})
+    main = specs.Spec([one_of, switch, specs.ParameterCollection([specs.Parameter('variable', str)])])
+    return specs.SpecDict({'main-spec' : main, 'string' : specs.Spec([])})
+
+
+def test_json_schema():
+    schema = ats_input_spec.schema.to_json_schema(ats_input_spec.public.known_specs)
+    assert(schema['$ref'] == '#/$defs/main-spec')
+    observable = schema['$defs']['observable-spec']
+    assert(observable['properties']['location name'] == {'type':'string', 'default':'cell'})
+    assert(observable['required'] == ['variable', 'reduction'])
+    assert(observable['allOf'][0]['anyOf'][0]['required'] == ['region',])
+    assert(observable['unevaluatedProperties'] is False)
+
+    mesh = schema['$defs']['mesh-typed-spec']
+    assert('read mesh file' in mesh['properties']['mesh type']['enum'])
+    assert(mesh['properties']['read mesh file parameters'] == {'$ref':'#/$defs/mesh-read-mesh-file-spec'})
+
+    json_form = ats_input_spec.schema.to_json(gold)
+    assert(json_form['mesh']['domain']['read mesh file parameters'] == {'file':'../mymesh.exo'})
+    assert(json_form['cycle driver']['required times']['times start period stop'] == [0.0, 86400.0, -86400.0])
+
+    jsonschema = pytest.importorskip('jsonschema')
+    validator = jsonschema.Draft202012Validator(schema)
+    # the gold file has no state, as reported by validate
+    assert([e.message for e in validator.iter_errors(json_form)] == ["'state' is a required property"])
+
+
+def test_to_json_arrays(tmp_path):
+    filename = str(tmp_path / 'arrays.xml')
+    with open(filename, 'w') as fid:
+        fid.write('''<ParameterList name="Main" type="ParameterList">
+  <Parameter name="flags" type="Array(bool)" value="{true, false, true}"/>
+  <Parameter name="counts" type="Array(int)" value="{1, 2}"/>
+  <Parameter name="times" type="Array(double)" value="{0.0, 1.5}"/>
+  <Parameter name="names" type="Array(string)" value="{a, b}"/>
+</ParameterList>
+''')
+    json_form = ats_input_spec.schema.to_json(filename)
+    assert(json_form == {'flags':[True, False, True], 'counts':[1, 2],
+                         'times':[0.0, 1.5], 'names':['a', 'b']})
+
+
+def test_json_schema_switches():
+    jsonschema = pytest.importorskip('jsonschema')
+    schema = ats_input_spec.schema.to_json_schema(switch_specs())
+    assert(schema['$defs']['main-spec']['properties']['scale']['default'] == 1.0)
+
+    validator = jsonschema.Draft202012Validator(schema)
+    assert(validator.is_valid({'variable':'x', 'region':'a', 'scale':2.0}))
+    assert(validator.is_valid({'variable':'x', 'regions':{}, 'flux':True, 'direction':'down'}))
+    assert(not validator.is_valid({'variable':'x', 'region':'a', 'regions':{}}))
+    assert(not validator.is_valid({'variable':'x', 'flux':True, 'direction':'down'}))
+    assert(not validator.is_valid({'variable':'x', 'region':'a', 'flux':True}))
+    assert(not validator.is_valid({'variable':'x', 'region':'a', 'direction':'down'}))
+    assert(not validator.is_valid({'variable':'x', 'region':'a', 'other':1}))
+
+
+def test_xsd(bad_file):
+    xsd = ats_input_spec.schema.to_xsd(ats_input_spec.public.known_specs)
+    root = xml.etree.ElementTree.fromstring(xsd)
+    names = [e.get('name') for e in root]
+    assert('main-spec' in names)
+    assert('mesh-typed-spec' in names)
+
+    xmlschema = pytest.importorskip('xmlschema')
+    validator = xmlschema.XMLSchema11(io.StringIO(xsd))
+    errors = list(validator.iter_errors(gold))
+    assert(len(errors) == 1)
+    assert("'state'" in str(errors[0]))
+    assert(len(list(validator.iter_errors(bad_file))) > 1)
+
+
+def _parameter(name, ptype, value):
+    return f'<Parameter name="{name}" type="{ptype}" value="{value}"/>'
+
+def _main_xml(*children):
+    return io.StringIO('<ParameterList name="Main" type="ParameterList">' + ''.join(children) + '</ParameterList>')
+
+def test_xsd_switches():
+    xmlschema = pytest.importorskip('xmlschema')
+    validator = xmlschema.XMLSchema11(io.StringIO(ats_input_spec.schema.to_xsd(switch_specs())))
+    variable = _parameter('variable', 'string', 'x')
+    region = _parameter('region', 'string', 'a')
+    regions = '<ParameterList name="regions" type="ParameterList"/>'
+    direction = _parameter('direction', 'string', 'down')
+    assert(validator.is_valid(_main_xml(variable, region, _parameter('scale', 'double', '2.0'))))
+    assert(validator.is_valid(_main_xml(variable, regions, _parameter('flux', 'bool', 'True'), direction)))
+    assert(not validator.is_valid(_main_xml(variable, region, regions)))
+    assert(not validator.is_valid(_main_xml(variable, _parameter('flux', 'bool', 'true'), direction)))
+    assert(not validator.is_valid(_main_xml(variable, region, _parameter('flux', 'bool', 'true'))))
+    assert(not validator.is_valid(_main_xml(variable, region, direction)))
+    assert(not validator.is_valid(_main_xml(variable, region, _parameter('scale', 'int', '2'))))
+    assert(not validator.is_valid(_main_xml(variable, region, region)))
+
+
+def test_schema_cache(tmp_path):
+    known_specs = switch_specs()
+    spec_hash = ats_input_spec.schema.spec_hash(known_specs)
+    xsd = ats_input_spec.schema.to_xsd(known_specs, cache_dir=str(tmp_path))
+    assert(os.listdir(str(tmp_path)) == [f'{spec_hash}.xsd',])
+    assert(ats_input_spec.schema.to_xsd(switch_specs()) is xsd)
+
+    # the file is used by a new process, faked here by clearing the memory cache
+    with open(str(tmp_path / f'{spec_hash}.xsd'), 'w') as fid:
+        fid.write('from the cache')
+    ats_input_spec.schema._cache.clear()
+    assert(ats_input_spec.schema.to_xsd(known_specs, cache_dir=str(tmp_path)) == 'from the cache')
+
+    # changing the specs changes the hash
+    known_specs['string'] = specs.Spec([specs.ParameterCollection([specs.Parameter('units', str)])])
+    assert(ats_input_spec.schema.spec_hash(known_specs) != spec_hash)
+    assert('units' in ats_input_spec.schema.to_json_schema(known_specs)['$defs']['string']['properties'])
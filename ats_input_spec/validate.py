@@ -0,0 +1,133 @@
+"""ats_input_spec/validate.py
+
+ATS is released under the three-clause BSD License. 
+The terms of use and "as is" disclaimer for this license are 
+provided in the top-level COPYRIGHT file.
+
+Authors: Ethan Coon (coonet@ornl.gov)
+
+Checks existing xml input files against the specs.
+
+Usage:  python -m ats_input_spec.validate [-j N] [--amanzi-src DIR] FILE [FILE ...]
+
+Each file is read against the specs, reporting unknown parameters,
+parameters of the wrong type, and required parameters that are
+missing.  Files are checked in parallel by N processes, which share
+the specs loaded once at startup.
+"""
+
+import sys
+import os
+import argparse
+import concurrent.futures
+import xml.etree.ElementTree
+import ats_input_spec
+import ats_input_spec.specs
+import ats_input_spec.source_reader
+import ats_input_spec.io
+
+
+def missing(container, path=('Main',)):
+    """Generator for messages for each required parameter missing in container."""
+    where = ' -> '.join(path)
+    if isinstance(container, ats_input_spec.specs.OneOf):
+        if container.branch_index is None:
+            if not container.is_complete():
+                yield f'{where}: Missing one of the ONE OF branches.'
+            return
+        container = container.collections[container.branch_index]
+    elif isinstance(container, ats_input_spec.specs.CaseSwitch):
+        if not container.case.is_complete():
+            yield f'{where}: Missing required parameter "{container.case.name}".'
+            return
+        container = container.branches[container.case.get()]
+
+    for p in container.parameters():
+        if p.is_complete():
+            continue
+        if p.is_primitive() or p.value is None:
+            yield f'{where}: Missing required parameter "{p.name}".'
+        else:
+            count = 0
+            for message in missing(p.value, path+(p.name,)):
+                count += 1
+                yield message
+            if count == 0:
+                # incomplete, but nothing in it is missing, e.g. an empty list
+                yield f'{where}: Missing required entries in "{p.name}".'
+
+
+def validate(filename, known_specs, spec='main-spec'):
+    """Returns a list of messages for the problems in an xml file.
+
+    known_specs is a SpecDict, or a SpecCache to share specs across
+    calls.
+    """
+    problems = []
+    try:
+        main = ats_input_spec.io.read(filename, known_specs, problems, spec)
+    except xml.etree.ElementTree.ParseError as err:
+        return [f'Invalid xml: {err}',]
+    except OSError as err:
+        return [f'Cannot read file: {err}',]
+    except (KeyError, TypeError, ValueError, RuntimeError) as err:
+        # errors read() does not report are problems of this file only
+        problems.append(f'Cannot read file: {err}')
+        return problems
+    if main is None:
+        problems.append('The root element is not a ParameterList.')
+        return problems
+    problems.extend(missing(main))
+    return problems
+
+
+_worker_specs = None
+
+def _init_worker(known_specs):
+    global _worker_specs
+    _worker_specs = ats_input_spec.io.SpecCache(known_specs)
+
+def _validate_worker(filename):
+    return validate(filename, _worker_specs)
+
+
+def validate_files(filenames, known_specs, jobs=1):
+    """Generator for (filename, problems) for each file, in order."""
+    if jobs <= 1 or len(filenames) <= 1:
+        _init_worker(known_specs)
+        for filename in filenames:
+            yield filename, _validate_worker(filename)
+        return
+
+    chunksize = max(1, min(16, len(filenames) // (4*jobs)))
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init_worker,
+                                                initargs=(known_specs,)) as pool:
+        yield from zip(filenames, pool.map(_validate_worker, filenames, chunksize=chunksize))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check ATS xml input files against the specs.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes.')
+    parser.add_argument('--amanzi-src', default=None,
+                        help='Amanzi/ATS source directory to load specs from, defaults to $AMANZI_SRC_DIR.')
+    parser.add_argument('filenames', nargs='+', help='xml files to check.')
+    args = parser.parse_args(argv)
+
+    if args.amanzi_src is not None:
+        ats_input_spec.set_amanzi_source(args.amanzi_src)
+    if ats_input_spec.AMANZI_SRC_DIR is None:
+        parser.error('Set AMANZI_SRC_DIR or use --amanzi-src to load the specs.')
+    known_specs = ats_input_spec.source_reader.load()
+
+    num_bad = 0
+    for filename, problems in validate_files(args.filenames, known_specs, args.jobs):
+        if len(problems) > 0:
+            num_bad += 1
+        for problem in problems:
+            print(f'{filename}: {problem}')
+    print(f'{len(args.filenames)-num_bad} of {len(args.filenames)} files are valid.')
+    return 0 if num_bad == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
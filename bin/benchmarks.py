@@ -0,0 +1,412 @@
+"""bin/benchmarks.py
+
+ATS is released under the three-clause BSD License.
+The terms of use and "as is" disclaimer for this license are
+provided in the top-level COPYRIGHT file.
+
+Authors: Ethan Coon (coonet@ornl.gov)
+
+Timing of bulk operations on large specs.
+
+These use small, hand-built specs of roughly the shape of those found
+in ATS (regions, function entries) so that they do not require the
+Amanzi/ATS source to be available.
+
+Usage:  python bin/benchmarks.py [-n N] [benchmark ...]
+"""
+
+import io
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import argparse
+import concurrent.futures
+import pickle
+import numpy as np
+
+import ats_input_spec.primitives as primitives
+import ats_input_spec.specs as specs
+import ats_input_spec.io
+
+
+def _function_entry_spec():
+    """Something like an independent variable evaluator's function entry."""
+    value = specs.Parameter('value', float)
+    constant = specs.ParameterCollection([value,])
+
+    region = specs.Parameter('region', str)
+    component = specs.Parameter('component', str)
+    function = specs.Parameter('function', 'function-typedsublist-spec',
+                               value=specs.TypedSpec('function', policy='sublist'))
+    entry = specs.Spec([specs.ParameterCollection([region, component, function]),])
+    return entry, constant
+
+
+def _observable_spec():
+    """Something like an observation's observed quantity."""
+    pars = [specs.Parameter('variable', str),
+            specs.Parameter('region', str),
+            specs.Parameter('reduction', str),
+            specs.Parameter('location name', str, default='cell'),
+            specs.Parameter('time integrated', bool, default=False),
+            specs.Parameter('direction normalized flux', bool, default=False),
+            specs.Parameter('scale', float, optional=True)]
+    return specs.Spec([specs.ParameterCollection(pars),])
+
+
+def _report(name, n, t, mem=None):
+    if mem is None:
+        print(f'{name:<40s} {n:>8d} entries: {t:8.4f} s')
+    else:
+        print(f'{name:<40s} {n:>8d} entries: {t:8.4f} s, {mem/1024**2:8.2f} MB')
+
+
+def _timed(func, *args, peak=False):
+    """Calls func, returning the result, time, and memory allocated.
+
+    If peak, the memory is the peak during the call, otherwise it is
+    what remains allocated after the call.
+    """
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = func(*args)
+    t = time.perf_counter() - t0
+    mem = tracemalloc.get_traced_memory()[1 if peak else 0]
+    tracemalloc.stop()
+    return result, t, mem
+
+
+def bench_append_many(n):
+    """Compares append_empty() in a loop to append_many()."""
+    entry, constant = _function_entry_spec()
+    names = [f'region {i}' for i in range(n)]
+
+    tl = specs.TypedCollection(entry)
+    t0 = time.perf_counter()
+    for name in names:
+        tl.append_empty(name)
+    _report('append_empty (loop)', n, time.perf_counter() - t0)
+
+    tl = specs.TypedCollection(entry)
+    t0 = time.perf_counter()
+    tl.append_many(names)
+    _report('append_many', n, time.perf_counter() - t0)
+
+    tl = specs.TypedCollection(entry)
+    values = [{'region':name, 'component':'cell'} for name in names]
+    t0 = time.perf_counter()
+    tl.append_many(names, values)
+    _report('append_many, with values', n, time.perf_counter() - t0)
+
+
+def bench_columnar(n):
+    """Compares append_many() to append_columns() for a list of observables."""
+    names = [f'observable {i}' for i in range(n)]
+    regions = [f'region {i % 1000}' for i in range(n)]
+    scales = np.linspace(0, 1, n)
+
+    def by_rows():
+        tl = specs.TypedCollection(_observable_spec())
+        values = [{'variable':'surface-ponded_depth', 'region':region,
+                   'reduction':'average', 'scale':scale}
+                  for (region, scale) in zip(regions, scales.tolist())]
+        tl.append_many(names, values)
+        return tl
+
+    def by_columns():
+        tl = specs.TypedCollection(_observable_spec())
+        template = tl.contained_ptype.copy()
+        template['variable'] = 'surface-ponded_depth'
+        template['reduction'] = 'average'
+        tl.append_columns(names, {'region':regions, 'scale':scales}, template)
+        return tl
+
+    tl, t, mem = _timed(by_rows)
+    _report('append_many, with values', n, t, mem)
+    del tl
+    tl, t, mem = _timed(by_columns)
+    _report('append_columns', n, t, mem)
+
+    t0 = time.perf_counter()
+    count = sum(1 for p in tl.valued())
+    _report('append_columns, iterate entries', count, time.perf_counter() - t0)
+
+
+def _large_main(n):
+    """A main with n function entries and n observables."""
+    entry, constant = _function_entry_spec()
+    functions = specs.TypedCollection(entry)
+    for i, func in enumerate(functions.append_many([f'region {i}' for i in range(n)])):
+        func['region'] = f'region {i}'
+        func['component'] = 'cell'
+        func['function'].set_type('constant', constant.copy())['value'] = float(i)
+
+    observables = specs.TypedCollection(_observable_spec())
+    observables.append_many([f'observable {i}' for i in range(n)],
+                            [{'variable':'surface-ponded_depth', 'region':f'region {i}',
+                              'reduction':'average'} for i in range(n)])
+
+    pars = [specs.Parameter('function', 'function-list', value=functions),
+            specs.Parameter('observed quantities', 'observable-list', value=observables)]
+    return specs.Spec([specs.ParameterCollection(pars),])
+
+
+def _large_specs():
+    """A SpecDict that reads the output of _large_main()."""
+    entry, constant = _function_entry_spec()
+    pars = [specs.Parameter('function', 'function-list'),
+            specs.Parameter('observed quantities', 'observable-list')]
+    return specs.SpecDict({'main-spec' : specs.Spec([specs.ParameterCollection(pars),]),
+                           'function' : entry,
+                           'function-constant-spec' : constant,
+                           'observable' : _observable_spec()})
+
+
+def bench_write(n):
+    """Compares the native and amanzi_xml xml backends."""
+    main = _large_main(n)
+    with open(os.devnull, 'w') as fid:
+        _, t, mem = _timed(ats_input_spec.io.write_stream, main, fid, peak=True)
+    _report('write, native (peak memory)', n, t, mem)
+
+    if ats_input_spec.io.amanzi_xml is None:
+        print('write, amanzi_xml: skipped, amanzi_xml is not installed')
+    else:
+        _, t, mem = _timed(ats_input_spec.io.write, main, os.devnull, 'amanzi_xml', peak=True)
+        _report('write, amanzi_xml (peak memory)', n, t, mem)
+
+
+def bench_rewrite(n):
+    """Compares writing after a change with and without the xml cache."""
+    main = _large_main(n)
+    ats_input_spec.io.write(main, os.devnull, cache=True)
+    for cache in [False, True]:
+        main['function']['region 0']['function']['function: constant']['value'] = -1.0
+        t0 = time.perf_counter()
+        ats_input_spec.io.write(main, os.devnull, cache=cache)
+        _report(f'write after a change, cache={cache}', n, time.perf_counter() - t0)
+
+
+def bench_read(n):
+    """Reads the output of _large_main()."""
+    main = _large_main(n)
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, 'large.xml')
+        ats_input_spec.io.write(main, filename)
+        size = os.path.getsize(filename)/1024**2
+        known_specs = _large_specs()
+        t0 = time.perf_counter()
+        ats_input_spec.io.read(filename, known_specs)
+        _report(f'read {size:.1f} MB', n, time.perf_counter() - t0)
+        _, t, mem = _timed(ats_input_spec.io.read, filename, known_specs, peak=True)
+        _report(f'read {size:.1f} MB, traced (peak memory)', n, t, mem)
+
+
+def bench_ensemble(n, members=100):
+    """Compares copying and writing each member to write_ensemble()."""
+    main = _large_main(n)
+    variations = [{('function', 'region 0', 'function', 'function: constant', 'value'):float(i),
+                   ('observed quantities', 'observable 0', 'variable'):f'variable {i}'}
+                  for i in range(members)]
+    with tempfile.TemporaryDirectory() as dirname:
+        out_pattern = os.path.join(dirname, 'run_{i}.xml')
+        t0 = time.perf_counter()
+        for i, variation in enumerate(variations):
+            member = main.copy()
+            for path, value in variation.items():
+                container = member
+                for k in path[:-1]:
+                    container = container[k]
+                container[path[-1]] = value
+            ats_input_spec.io.write(member, out_pattern.format(i=i))
+        _report(f'copy and write, {members} members', n, time.perf_counter() - t0)
+
+        for workers in [1, 4]:
+            t0 = time.perf_counter()
+            ats_input_spec.io.write_ensemble(main, variations, out_pattern, workers=workers)
+            _report(f'write_ensemble, {members} members, {workers} workers', n, time.perf_counter() - t0)
+
+
+def bench_arrays(n):
+    """Compares list and numpy array values of a tabular function."""
+    x = np.linspace(0, 1, n)
+    for name, value in [('list', x.tolist()), ('array', x)]:
+        pars = [specs.Parameter('x values', primitives.ListFloat),
+                specs.Parameter('y values', primitives.ListFloat)]
+        main = specs.Spec([specs.ParameterCollection(pars),])
+        t0 = time.perf_counter()
+        main['x values'] = value
+        main['y values'] = value
+        _report(f'set, {name}', n, time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        ats_input_spec.io.write(main, os.devnull)
+        _report(f'write, {name}', n, time.perf_counter() - t0)
+
+    string = '{' + ','.join(map(str, np.arange(n).tolist())) + '}'
+    t0 = time.perf_counter()
+    primitives.valid_primitive_from_string('Array(int)', string)
+    _report('parse Array(int)', n, time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    [primitives.valid_int_from_string(p) for p in primitives.list_from_string(string)]
+    _report('parse Array(int), per entry', n, time.perf_counter() - t0)
+
+
+def bench_archive(n, members=1000):
+    """Compares writing an ensemble of small files to write_many()."""
+    main = _large_main(max(1, n // members))
+    def variations():
+        for i in range(members):
+            member = main.copy()
+            member['function']['region 0']['function']['function: constant']['value'] = float(i)
+            yield member
+    with tempfile.TemporaryDirectory() as dirname:
+        t0 = time.perf_counter()
+        for i, member in enumerate(variations()):
+            ats_input_spec.io.write(member, os.path.join(dirname, f'run_{i}.xml'))
+        _report(f'write, {members} files', members, time.perf_counter() - t0)
+        for format in ['tar', 'zip']:
+            t0 = time.perf_counter()
+            ats_input_spec.io.write_many(variations(), os.path.join(dirname, f'runs.{format}'), format)
+            _report(f'write_many, {format}', members, time.perf_counter() - t0)
+
+
+def bench_hash(n):
+    """Times structural hashing, equality, and diff of a large main."""
+    main = _large_main(n)
+    other = _large_main(n)
+    t0 = time.perf_counter()
+    main.structural_hash()
+    _report('structural_hash, first', n, time.perf_counter() - t0)
+    other.structural_hash()
+    t0 = time.perf_counter()
+    equal = main.same_as(other)
+    _report('compare to another, both hashed', n, time.perf_counter() - t0)
+    assert(equal)
+    main['function']['region 0']['function']['function: constant']['value'] = -1.0
+    t0 = time.perf_counter()
+    equal = main.same_as(other)
+    _report('compare after a change', n, time.perf_counter() - t0)
+    assert(not equal)
+
+    copy = main.copy()
+    copy['function']['region 1']['function']['function: constant']['value'] = -1.0
+    t0 = time.perf_counter()
+    diff = specs.diff(main, copy)
+    _report('diff of a changed copy', n, time.perf_counter() - t0)
+    assert(len(diff) == 1)
+
+
+def bench_transaction(n, changes=100):
+    """Compares copying a large main to undo changes with a transaction."""
+    main = _large_main(n)
+    def change(main):
+        for i in range(changes):
+            main['function'][f'region {i}']['function']['function: constant']['value'] = -1.0
+
+    t0 = time.perf_counter()
+    backup = main.copy()
+    change(main)
+    main = backup
+    _report(f'copy, {changes} changes, discard', n, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    token = specs.snapshot()
+    change(main)
+    specs.restore(token)
+    specs.commit(token)
+    _report(f'snapshot, {changes} changes, restore', n, time.perf_counter() - t0)
+
+
+class _GraphPickler(pickle.Pickler):
+    """Pickles the full object graph, as before pickling by spec name."""
+    def reducer_override(self, obj):
+        if isinstance(obj, specs._Pickled):
+            return object.__reduce_ex__(obj, pickle.HIGHEST_PROTOCOL)
+        return NotImplemented
+
+def bench_pickle(n):
+    """Compares pickling the object graph of a large main to pickling by spec name."""
+    main = _large_main(n)
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, 'large.xml')
+        ats_input_spec.io.write(main, filename)
+        main = ats_input_spec.io.read(filename, _large_specs())
+
+    fid = io.BytesIO()
+    t0 = time.perf_counter()
+    _GraphPickler(fid, pickle.HIGHEST_PROTOCOL).dump(main)
+    payload = fid.getvalue()
+    _report(f'pickle object graph, {len(payload)/1024**2:.1f} MB', n, time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    pickle.loads(payload)
+    _report('unpickle object graph', n, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    payload = pickle.dumps(main, pickle.HIGHEST_PROTOCOL)
+    _report(f'pickle by spec name, {len(payload)/1024**2:.1f} MB', n, time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    pickle.loads(payload)
+    _report('unpickle by spec name', n, time.perf_counter() - t0)
+
+
+def _observables_fragment(names):
+    """A main of _large_specs() with an observable for each name."""
+    main = _large_specs()['main-spec']
+    for name in names:
+        observable = main['observed quantities'].append_empty(name)
+        observable['variable'] = 'surface-ponded_depth'
+        observable['region'] = name
+        observable['reduction'] = 'average'
+    return main
+
+def bench_merge(n, workers=4):
+    """Compares building a main serially to merging fragments built by a process pool."""
+    names = [f'observable {i}' for i in range(n)]
+    t0 = time.perf_counter()
+    serial = _observables_fragment(names)
+    _report('build serially', n, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    chunk = -(-n // workers)
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        fragments = list(pool.map(_observables_fragment, [names[i:i+chunk] for i in range(0, n, chunk)]))
+    _report(f'build {workers} fragments in a pool', n, time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    main = _large_specs()['main-spec']
+    specs.merge(main, *fragments)
+    _report(f'merge {workers} fragments', n, time.perf_counter() - t0)
+    assert(main.same_as(serial))
+
+
+benchmarks = {'append_many' : bench_append_many,
+              'columnar' : bench_columnar,
+              'write' : bench_write,
+              'rewrite' : bench_rewrite,
+              'read' : bench_read,
+              'ensemble' : bench_ensemble,
+              'arrays' : bench_arrays,
+              'archive' : bench_archive,
+              'hash' : bench_hash,
+              'transaction' : bench_transaction,
+              'pickle' : bench_pickle,
+              'merge' : bench_merge,
+              }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time bulk operations on large specs.')
+    parser.add_argument('-n', type=int, default=10000, help='Number of entries.')
+    parser.add_argument('benchmarks', nargs='*',
+                        help='Benchmarks to run, one of: '+', '.join(benchmarks.keys())+'.  Defaults to all.')
+    args = parser.parse_args()
+
+    to_run = args.benchmarks
+    if len(to_run) == 0:
+        to_run = list(benchmarks.keys())
+    for name in to_run:
+        if name not in benchmarks:
+            parser.error(f'Unknown benchmark "{name}"')
+    for name in to_run:
+        print(f'{name}:')
+        benchmarks[name](args.n)